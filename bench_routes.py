@@ -0,0 +1,518 @@
+# bench_routes.py - HTTP benchmarks for every Flask route, with stored baselines
+#
+# Each route is driven through Flask's in-process test client and through a
+# real threaded socket server, at several concurrency levels and dataset
+# sizes. Results (throughput, latency percentiles, allocations per request)
+# can be saved as a versioned baseline and later compared against it; the
+# run fails when a route regresses beyond --threshold.
+#
+# Admin writes are signed with a bench bot token and admin id (as the webapp's
+# initData is), and each run gets fresh rows to update or delete. Not measured:
+#   POST /api/media       multipart bodies differ between the two clients, and a
+#                         repeated upload of one image only hits the exists check
+#   POST /api/clear       wipes the seeded dataset the other workloads read
+#   GET  /api/reports/payments?format=xlsx
+#                         same query as the CSV workload, the rest is openpyxl
+#   /metrics, /api/me, /api/sql-stats, /api/ads/stats, /api/events/hourly,
+#   /api/rum/summary, /asset-manifest.json, /sw.js
+#                         diagnostics and static files, not on a user path
+#
+# Usage:
+#   python bench_routes.py --save                      # record bench_baselines/default.json
+#   python bench_routes.py --compare                   # fail on >15% regression
+#   python bench_routes.py --routes api_campaigns webapp --datasets large --concurrency 1 32 --compare --threshold 25
+
+import os
+import sys
+import io
+import hmac
+import json
+import time
+import random
+import hashlib
+import itertools
+import sqlite3
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import urllib.parse
+import tracemalloc
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_baselines')
+BASELINE_VERSION = 2
+BENCH_BOT_TOKEN = '123456:bench'
+BENCH_ADMIN_ID = '1000'
+
+DATASETS = {
+    'small': {'campaigns': 10, 'payments': 1000},
+    'medium': {'campaigns': 1000, 'payments': 50000},
+    'large': {'campaigns': 10000, 'payments': 500000},
+}
+CATEGORIES = ['tibbiyot', 'nogironlik', 'talim', 'uy-joy', 'hayvonlar', 'ijtimoiy', 'ayollar', 'yetimlar']
+
+
+def seed_dataset(db_path: str, campaigns: int, payments: int, seed: int = 42):
+    rnd = random.Random(seed)
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
+    c.execute("DELETE FROM campaigns")
+    c.executemany("INSERT INTO campaigns VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", (
+        (f"bench_{i}", f"Kampaniya {i}", rnd.choice(CATEGORIES), "Benchmark uchun tavsif " * 5,
+         rnd.randint(1, 100) * 1e6, rnd.randint(0, 100) * 1e5, rnd.randint(0, 500), rnd.randint(1, 60),
+         rnd.random() < 0.2, "8600 0000 0000 0000", "Bench", "+998900000000", "Bench", "💝", "Admin",
+         datetime.now().isoformat()) for i in range(campaigns)))
+    c.executemany("INSERT INTO payments (payment_id, user_id, amount, status, click_trans_id, created_at) "
+                  "VALUES (?, ?, ?, ?, ?, ?)", (
+        (f"bench_pay_{i}", str(rnd.randint(1, 10000)), rnd.choice([5000, 10000, 50000]), 'success',
+         f"bench_click_{i}", datetime.now().isoformat()) for i in range(payments)))
+    conn.commit()
+    conn.close()
+
+
+def create_pending(db_path: str, count: int, prefix: str) -> list:
+    ids = [f"{prefix}_{i}" for i in range(count)]
+    conn = sqlite3.connect(db_path)
+    conn.executemany("INSERT INTO payments (payment_id, user_id, status, created_at) VALUES (?, ?, 'pending', ?)",
+                     ((pid, 'bench_user', datetime.now().isoformat()) for pid in ids))
+    conn.commit()
+    conn.close()
+    return ids
+
+
+def admin_init_data(bot_token: str, admin_id: str) -> str:
+    """WebApp initData for the admin, signed the way Telegram signs it"""
+    fields = {'auth_date': str(int(time.time())), 'user': json.dumps({'id': int(admin_id), 'first_name': 'Bench'})}
+    check_string = '\n'.join(f"{key}={value}" for key, value in sorted(fields.items()))
+    secret = hmac.new(b'WebAppData', bot_token.encode(), hashlib.sha256).digest()
+    fields['hash'] = hmac.new(secret, check_string.encode(), hashlib.sha256).hexdigest()
+    return urllib.parse.urlencode(fields)
+
+
+def create_rows(db_path: str, table: str, rows: list):
+    conn = sqlite3.connect(db_path)
+    conn.executemany(f"INSERT OR REPLACE INTO {table} VALUES ({', '.join('?' * len(rows[0]))})", rows)
+    conn.commit()
+    conn.close()
+
+
+def http_failed(status: int, body: bytes) -> bool:
+    return status >= 400
+
+
+def click_failed(status: int, body: bytes) -> bool:
+    """Click callbacks answer 200 and report failures in the body's error field"""
+    if status >= 400:
+        return True
+    try:
+        return json.loads(body).get('error') != 0
+    except (ValueError, AttributeError):
+        return True
+
+
+def mock_click_failed(status: int, body: bytes) -> bool:
+    """/mock_click nests the complete callback's answer"""
+    if status >= 400:
+        return True
+    try:
+        return json.loads(body)['callback_response'].get('error') != 0
+    except (ValueError, KeyError, AttributeError):
+        return True
+
+
+class Workload:
+    """A route plus a generator of request arguments; `setup` prepares state before each run
+    and `failed(status, body)` decides which responses count as errors. `path` and `payload`
+    may be callables of (i, state); admin workloads send the signed initData header"""
+
+    def __init__(self, name, method, path, payload=None, setup=None, failed=http_failed, as_json=False, admin=False):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.payload = payload
+        self.setup = setup
+        self.failed = failed
+        self.as_json = as_json
+        self.admin = admin
+
+    def requests_for(self, n, state):
+        for i in range(n):
+            path = self.path(i, state) if callable(self.path) else self.path
+            payload = self.payload(i, state) if callable(self.payload) else self.payload
+            options = {'json' if self.as_json else 'data': payload}
+            if self.admin:
+                options['headers'] = {'X-Telegram-Init-Data': state['init_data']}
+            yield self.method, path, options
+
+
+def _click_prepare_payload(i, state):
+    pid = state['pending'][i]
+    return {'click_trans_id': f"bench_prep_{pid}", 'service_id': 'bench', 'merchant_trans_id': pid,
+            'amount': '10000', 'action': '0', 'error': '0'}
+
+
+def _click_complete_payload(i, state):
+    pid, prepare_id = state['prepared'][i]
+    return {'click_trans_id': f"bench_prep_{pid}", 'service_id': 'bench', 'merchant_trans_id': pid,
+            'merchant_prepare_id': str(prepare_id), 'amount': '10000', 'action': '1', 'error': '0'}
+
+
+def _setup_prepare(bot, db_path, n, state):
+    state['pending'] = create_pending(db_path, n, f"bench_pending_{time.time_ns()}")
+
+
+def _setup_complete(bot, db_path, n, state):
+    _setup_prepare(bot, db_path, n, state)
+    state['prepared'] = []
+    for pid in state['pending']:
+        response = bot.click_prepare({'click_trans_id': f"bench_prep_{pid}", 'merchant_trans_id': pid, 'amount': '10000'})
+        if response.get('error') != 0:
+            raise RuntimeError(f"click_prepare {pid}: {response.get('error')} {response.get('error_note')}")
+        state['prepared'].append((pid, response['merchant_prepare_id']))
+
+
+def _campaign_payload(i, state):
+    return {'id': f"bench_write_{i}", 'title': f"Kampaniya {i}", 'category': 'tibbiyot',
+            'description': "Benchmark uchun tavsif", 'targetAmount': 1e7, 'currentAmount': 0, 'donors': 0,
+            'daysLeft': 30, 'urgent': False, 'cardNumber': "8600 0000 0000 0000", 'cardOwner': 'Bench',
+            'contactPhone': '+998900000000', 'contactName': 'Bench', 'image': '💝', 'createdBy': 'Admin',
+            'createdAt': datetime.now().isoformat()}
+
+
+def _ad_payload(i, state):
+    return {'id': f"bench_ad_write_{i}", 'type': 'banner', 'title': f"Reklama {i}", 'description': 'Bench',
+            'linkUrl': 'https://example.com', 'contact': 'Bench', 'showDuration': 5, 'banner': True,
+            'createdAt': datetime.now().isoformat(), 'weight': 1, 'frequencyCap': 0, 'dailyImpressions': 0}
+
+
+def _team_payload(i, state):
+    return {'id': 100000 + i, 'name': f"A'zo {i}", 'role': 'Bench', 'description': 'Bench', 'image': '👤',
+            'socials': {'telegram': '@bench'}}
+
+
+def _setup_rows(table, row):
+    """Insert n fresh rows and keep their ids; `row(i, prefix)` builds the tuple, its first field is the id"""
+    def setup(bot, db_path, n, state):
+        prefix = f"bench_del_{time.time_ns()}"
+        rows = [row(i, prefix) for i in range(n)]
+        create_rows(db_path, table, rows)
+        state['ids'] = [r[0] for r in rows]
+        if table == 'ads':
+            bot.ad_server.invalidate()
+    return setup
+
+
+def _campaign_row(i, prefix):
+    return (f"{prefix}_{i}", "Bench", 'tibbiyot', "Bench", 1e7, 0, 0, 30, 0, "8600 0000 0000 0000", "Bench",
+            "+998900000000", "Bench", "💝", "Admin", datetime.now().isoformat())
+
+
+_TEAM_IDS = itertools.count(10**6)  # team ids are integers
+
+
+def _ad_row(i, prefix):
+    return (f"{prefix}_{i}", 'banner', "Bench", "Bench", 'https://example.com', 'Bench', 5, 1,
+            datetime.now().isoformat(), 1.0, 0, 0)
+
+
+def _team_row(i, prefix):
+    return (next(_TEAM_IDS), "Bench", "Bench", "Bench", '👤', '{}')
+
+
+def _setup_ad_click(bot, db_path, n, state):
+    _setup_rows('ads', _ad_row)(bot, db_path, 1, state)
+
+
+def _setup_settings(bot, db_path, n, state):
+    state['settings'] = bot.get_settings()  # saved back unchanged, so other workloads see the same data
+
+
+def _setup_media(bot, db_path, n, state):
+    from PIL import Image
+    buf = io.BytesIO()
+    Image.new('RGB', (1280, 960), (200, 120, 40)).save(buf, 'PNG')
+    conn = bot.db_connect()
+    try:
+        state['media_id'] = bot.media_store.save(buf.getvalue(), conn)['id']
+    finally:
+        conn.close()
+
+
+def _events_payload(i, state):
+    return json.dumps({'t0': int(time.time() * 1000), 'e': [[0, 'app_open'], [120, 'campaign_view', {'id': 'bench_1'}]]})
+
+
+def _rum_payload(i, state):
+    return json.dumps({'v': state['app_version'], 'dm': 4, 'hc': 8,
+                       'm': {'ttfb': [120], 'first_contentful_paint': [640], 'load': [1500]}})
+
+
+def _today_report_path(i, state):
+    today = datetime.now().date().isoformat()
+    return f"/api/reports/payments?from={today}&to={today}&format=csv"
+
+
+WORKLOADS = [
+    Workload('webapp', 'GET', '/webapp'),
+    Workload('payment_form', 'GET', '/payment?user_id=42&campaign_id=bench_1'),
+    Workload('success', 'GET', '/success'),
+    Workload('api_campaigns', 'GET', '/api/campaigns'),
+    Workload('api_ads', 'GET', '/api/ads'),
+    Workload('api_ads_next', 'GET', '/api/ads/next?user_id=42'),
+    Workload('api_team', 'GET', '/api/team'),
+    Workload('api_settings', 'GET', '/api/settings'),
+    Workload('api_export', 'GET', '/api/export'),
+    Workload('click_prepare', 'POST', '/click/callback', _click_prepare_payload, _setup_prepare, click_failed),
+    Workload('click_complete', 'POST', '/click/callback', _click_complete_payload, _setup_complete, click_failed),
+    Workload('mock_click', 'GET', lambda i, s: f"/mock_click?transaction_param={s['pending'][i]}&amount=10000",
+             setup=_setup_prepare, failed=mock_click_failed),
+    Workload('campaign_save', 'POST', '/api/campaigns', _campaign_payload, as_json=True, admin=True),
+    Workload('campaign_delete', 'DELETE', lambda i, s: f"/api/campaigns/{s['ids'][i]}",
+             setup=_setup_rows('campaigns', _campaign_row), admin=True),
+    Workload('ad_save', 'POST', '/api/ads', _ad_payload, as_json=True, admin=True),
+    Workload('ad_delete', 'DELETE', lambda i, s: f"/api/ads/{s['ids'][i]}",
+             setup=_setup_rows('ads', _ad_row), admin=True),
+    Workload('ad_click', 'POST', lambda i, s: f"/api/ads/{s['ids'][0]}/click", setup=_setup_ad_click),
+    Workload('team_save', 'POST', '/api/team', _team_payload, as_json=True, admin=True),
+    Workload('team_delete', 'DELETE', lambda i, s: f"/api/team/{s['ids'][i]}",
+             setup=_setup_rows('team', _team_row), admin=True),
+    Workload('settings_save', 'POST', '/api/settings', lambda i, s: s['settings'], _setup_settings,
+             as_json=True, admin=True),
+    Workload('events', 'POST', '/api/events', _events_payload),
+    Workload('rum', 'POST', '/api/rum', _rum_payload),
+    Workload('media_variant', 'GET', lambda i, s: f"/media/{s['media_id']}?w=320&f=webp", setup=_setup_media),
+    Workload('report_csv', 'GET', _today_report_path, admin=True),
+]
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))] if ordered else 0.0
+
+
+def _summarize(latencies, elapsed, errors):
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+def run_inprocess(app, reqs, concurrency, failed=http_failed):
+    local = threading.local()
+    latencies, errors = [], 0
+    lock = threading.Lock()
+
+    def one(req):
+        nonlocal errors
+        method, path, options = req
+        if not hasattr(local, 'client'):
+            local.client = app.test_client()
+        started = time.perf_counter()
+        response = local.client.open(path, method=method, **options)
+        body = response.get_data()
+        took = time.perf_counter() - started
+        with lock:
+            latencies.append(took)
+            if failed(response.status_code, body):
+                errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, reqs))
+    return _summarize(latencies, time.perf_counter() - started, errors)
+
+
+def run_socket(base_url, reqs, concurrency, failed=http_failed):
+    local = threading.local()
+    latencies, errors = [], 0
+    lock = threading.Lock()
+
+    def one(req):
+        nonlocal errors
+        method, path, options = req
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        started = time.perf_counter()
+        try:
+            response = local.session.request(method, base_url + path, timeout=30, **options)
+            error = failed(response.status_code, response.content)
+        except requests.RequestException:
+            error = True
+        took = time.perf_counter() - started
+        with lock:
+            latencies.append(took)
+            if error:
+                errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, reqs))
+    return _summarize(latencies, time.perf_counter() - started, errors)
+
+
+def measure_allocations(app, reqs):
+    """Bytes allocated per request (sequential, in-process, tracemalloc)"""
+    client = app.test_client()
+    reqs = list(reqs)
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        total_peak = 0
+        for method, path, options in reqs:
+            current, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            client.open(path, method=method, **options).get_data()
+            _, peak = tracemalloc.get_traced_memory()
+            total_peak += peak - current
+        after, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    n = len(reqs) or 1
+    return {'alloc_peak_kb': round(total_peak / n / 1024, 1), 'retained_kb': round((after - before) / n / 1024, 2)}
+
+
+def start_socket_server(app, port):
+    from werkzeug.serving import make_server
+    server = make_server('127.0.0.1', port, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for key, current in results.items():
+        previous = baseline.get('results', {}).get(key)
+        if not previous:
+            continue
+        if previous['rps'] and current['rps'] < previous['rps'] * (1 - threshold):
+            regressions.append(f"{key}: rps {previous['rps']} -> {current['rps']}")
+        if previous['p95_ms'] and current['p95_ms'] > previous['p95_ms'] * (1 + threshold):
+            regressions.append(f"{key}: p95 {previous['p95_ms']} ms -> {current['p95_ms']} ms")
+        if current['errors'] > previous.get('errors', 0):
+            regressions.append(f"{key}: errors {previous.get('errors', 0)} -> {current['errors']}")
+        if previous.get('alloc_peak_kb') and current.get('alloc_peak_kb', 0) > previous['alloc_peak_kb'] * (1 + threshold):
+            regressions.append(f"{key}: alloc {previous['alloc_peak_kb']} KB -> {current['alloc_peak_kb']} KB")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Flask route'lari uchun benchmark")
+    parser.add_argument('--routes', nargs='*', default=[w.name for w in WORKLOADS])
+    parser.add_argument('--datasets', nargs='*', default=['small', 'medium'], choices=list(DATASETS))
+    parser.add_argument('--concurrency', nargs='*', type=int, default=[1, 8, 32])
+    parser.add_argument('--modes', nargs='*', default=['inprocess', 'socket'], choices=['inprocess', 'socket'])
+    parser.add_argument('--requests', type=int, default=200, help="Har bir o'lchov uchun so'rovlar soni")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--baseline', default='default', help='bench_baselines/<nom>.json')
+    parser.add_argument('--save', action='store_true', help='Natijani baseline sifatida saqlash')
+    parser.add_argument('--compare', action='store_true', help='Baseline bilan solishtirish')
+    parser.add_argument('--threshold', type=float, default=15.0, help='Ruxsat etilgan regressiya, foizda')
+    args = parser.parse_args(argv)
+
+    work_dir = tempfile.mkdtemp(prefix='ehson_bench_')
+    os.environ['DB_PATH'] = os.path.join(work_dir, 'bootstrap.db')
+    os.environ['EVENT_LOG_DIR'] = os.path.join(work_dir, 'events')
+    os.environ['MEDIA_DIR'] = os.path.join(work_dir, 'media')
+    import bot
+    bot.app.logger.disabled = True
+    # The admin workloads sign initData with these, as Telegram would with the real token
+    bot.BOT_TOKEN, bot.ADMIN_ID = BENCH_BOT_TOKEN, BENCH_ADMIN_ID
+    init_data = admin_init_data(BENCH_BOT_TOKEN, BENCH_ADMIN_ID)
+
+    workloads = [w for w in WORKLOADS if w.name in args.routes]
+    server = start_socket_server(bot.app, args.port) if 'socket' in args.modes else None
+    base_url = f"http://127.0.0.1:{args.port}"
+    results = {}
+    try:
+        for dataset in args.datasets:
+            db_path = os.path.join(work_dir, f"{dataset}.db")
+            bot.DB_PATH = db_path
+            bot.init_db()
+            seed_dataset(db_path, **DATASETS[dataset])
+            for workload in workloads:
+                for mode in args.modes:
+                    for concurrency in args.concurrency:
+                        state = {'init_data': init_data, 'app_version': bot.APP_VERSION}
+                        if workload.setup:
+                            workload.setup(bot, db_path, args.requests, state)
+                        reqs = list(workload.requests_for(args.requests, state))
+                        if mode == 'inprocess':
+                            result = run_inprocess(bot.app, reqs, concurrency, workload.failed)
+                        else:
+                            result = run_socket(base_url, reqs, concurrency, workload.failed)
+                        if mode == 'inprocess' and concurrency == args.concurrency[0]:
+                            state = {'init_data': init_data, 'app_version': bot.APP_VERSION}
+                            if workload.setup:
+                                workload.setup(bot, db_path, min(args.requests, 50), state)
+                            result.update(measure_allocations(bot.app, workload.requests_for(min(args.requests, 50), state)))
+                        key = f"{workload.name}|{mode}|c{concurrency}|{dataset}"
+                        results[key] = result
+                        print(f"{key:<45} {result['rps']:>9.1f} rps  p50 {result['p50_ms']:>8.2f}  "
+                              f"p95 {result['p95_ms']:>8.2f}  p99 {result['p99_ms']:>8.2f} ms"
+                              f"{'  alloc %.1f KB' % result['alloc_peak_kb'] if 'alloc_peak_kb' in result else ''}"
+                              f"{'  errors %d' % result['errors'] if result['errors'] else ''}")
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    baseline_path = os.path.join(BASELINE_DIR, f"{args.baseline}.json")
+    status = 0
+    if args.compare:
+        if not os.path.exists(baseline_path):
+            print(f"Baseline topilmadi: {baseline_path}")
+            status = 1
+        else:
+            with open(baseline_path, encoding='utf-8') as f:
+                baseline = json.load(f)
+            if baseline.get('version') != BASELINE_VERSION:
+                print(f"Baseline versiyasi mos emas ({baseline.get('version')} != {BASELINE_VERSION}); qayta saqlang")
+                status = 1
+            else:
+                regressions = compare(results, baseline, args.threshold / 100.0)
+                for line in regressions:
+                    print(f"REGRESSIYA {line}")
+                status = 1 if regressions else 0
+                if not regressions:
+                    print(f"Regressiya yo'q (baseline {baseline.get('revision')}, chegarasi {args.threshold}%)")
+    failing = [key for key, result in results.items() if result['errors']]
+    if args.save and failing:
+        # A baseline must describe working routes, not fast failures
+        print(f"Baseline saqlanmadi: xatoli o'lchovlar bor ({', '.join(failing)})")
+        status = 1
+    elif args.save:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        with open(baseline_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'version': BASELINE_VERSION,
+                'revision': git_revision(),
+                'created_at': datetime.now().isoformat(),
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'requests_per_run': args.requests,
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+        print(f"Baseline saqlandi: {baseline_path}")
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
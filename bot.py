@@ -1,52 +1,108 @@
 # ehson_all_in_one.py - Complete Telegram Ehson Bot with Integrated WebApp
 
 import os
+import re
+import sys
 import json
 import logging
 import sqlite3
 import asyncio
+import bisect
+import random
 import threading
-from datetime import datetime
+import contextvars
+import traceback
+import time
+from datetime import datetime, timedelta
 from typing import Dict, Any, List, Optional
 import uuid
+import gzip
+import queue
+import hashlib
+import hmac
+import urllib.parse
+import tempfile
+import atexit
+from collections import OrderedDict
 import requests
+from concurrent.futures import ThreadPoolExecutor
 
 # Flask imports
-from flask import Flask, request, jsonify, make_response
+from flask import Flask, request, jsonify, make_response, Response, send_file, g
 
 # aiogram imports
-from aiogram import Bot, Dispatcher, F, types
-from aiogram.filters import Command
+from aiogram import Bot, Dispatcher, F, types, BaseMiddleware
+from aiogram.filters import Command, CommandObject
 from aiogram.types import (
     Message, InlineKeyboardMarkup, InlineKeyboardButton,
-    ReplyKeyboardMarkup, KeyboardButton, WebAppInfo
+    ReplyKeyboardMarkup, KeyboardButton, WebAppInfo, BufferedInputFile,
+    InlineQuery, InlineQueryResultArticle, InputTextMessageContent
 )
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
 from aiogram.utils.keyboard import InlineKeyboardBuilder, ReplyKeyboardBuilder
 from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
 
 # dotenv for environment variables
 from dotenv import load_dotenv
 
-# Logging setup
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('ehson.log'),
-        logging.StreamHandler()
-    ]
-)
-logger = logging.getLogger(__name__)
+import reports
+import logsetup
+import tracing
+import events
+import rum
+import media
+import search
 
 # Load .env
 load_dotenv()
 
+# Logging setup: records go through a queue; a listener thread writes
+# redacted JSON lines to rotating, gzip-compressed files
+log_handler, log_listener = logsetup.setup_logging(
+    path=os.getenv("LOG_PATH", "ehson.log"),
+    level=os.getenv("LOG_LEVEL", "INFO"),
+    max_bytes=int(os.getenv("LOG_MAX_BYTES", str(50 * 1024 * 1024))),
+    interval=float(os.getenv("LOG_ROTATE_SECONDS", "86400")),
+    backup_count=int(os.getenv("LOG_BACKUPS", "14")),
+    debug_sample=int(os.getenv("LOG_DEBUG_SAMPLE", "10")),
+    side_logs={"ehson.slow": os.getenv("SLOW_UPDATE_LOG", "slow_updates.log")},
+    secrets=[os.getenv("CLICK_SECRET_KEY", "")],
+)
+logger = logging.getLogger(__name__)
+
 # Environment variables with validation
 BOT_TOKEN = os.getenv("6335576043:AAFMEtBcH-RZ-dXByEDhVhRDiEePg1_AIIY")
 ADMIN_ID = os.getenv("6060353145")
-CHANNEL_ID = os.getenv("3085828839")
+# Channel that mirrors every campaign as a post; empty disables the mirror
+CHANNEL_ID = os.getenv("CHANNEL_ID", "")
+CHANNEL_EDIT_INTERVAL = float(os.getenv("CHANNEL_EDIT_INTERVAL", "60"))
+# Inline mode (@bot <query>): how long Telegram may cache an answer
+INLINE_CACHE_SECONDS = int(os.getenv("INLINE_CACHE_SECONDS", "30"))
 PAYMENT_FORM_URL = os.getenv("PAYMENT_FORM_URL", "/payment")
+# A reopened payment form reuses the user's pending row for the same campaign this long
+PAYMENT_REUSE_SECONDS = int(os.getenv("PAYMENT_REUSE_SECONDS", "1800"))
 BASE_URL = os.getenv("BASE_URL", "http://127.0.0.1:8000")
+CLICK_SECRET_KEY = os.getenv("CLICK_SECRET_KEY", "")
+# Alternative Bot API server, e.g. fake_telegram.py for tests and benchmarks
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")
+# Record incoming updates (gzipped JSONL, anonymized) for replay.py
+UPDATE_RECORD_PATH = os.getenv("UPDATE_RECORD_PATH", "")
+# Payment trace spans (JSONL, OTLP field names); empty disables export
+TRACE_PATH = os.getenv("TRACE_PATH", "payment_traces.jsonl")
+# Webapp event beacons: segment directory and how often segments are rolled up
+EVENT_LOG_DIR = os.getenv("EVENT_LOG_DIR", "events")
+EVENT_ROLLUP_SECONDS = float(os.getenv("EVENT_ROLLUP_SECONDS", "3600"))
+# Reported by the webapp with its events and timings
+APP_VERSION = os.getenv("APP_VERSION", "dev")
+# Uploaded images and the disk budget for their resized variants
+MEDIA_DIR = os.getenv("MEDIA_DIR", "media")
+MEDIA_CACHE_BYTES = int(os.getenv("MEDIA_CACHE_BYTES", str(512 * 1024 * 1024)))
+MEDIA_WORKERS = int(os.getenv("MEDIA_WORKERS", "2"))
+# How long signed WebApp initData is accepted for admin requests (seconds)
+WEBAPP_AUTH_MAX_AGE = int(os.getenv("WEBAPP_AUTH_MAX_AGE", "86400"))
 
 # Validate required variables
 required_vars = {"BOT_TOKEN": BOT_TOKEN, "ADMIN_ID": ADMIN_ID}
@@ -56,7 +112,7 @@ for var_name, var_value in required_vars.items():
         raise SystemExit(f"{var_name} topilmadi.")
 
 # Database path
-DB_PATH = 'ehson_test.db'
+DB_PATH = os.getenv("DB_PATH", 'ehson_test.db')
 
 # Default data
 DEFAULT_CAMPAIGNS = [
@@ -239,9 +295,309 @@ DEFAULT_AD_SETTINGS = {
     'bannerText': '🎯 Maxsus Taklif! Eng Yaxshi Xizmatlar'
 }
 
+# Metrics - in-process registry exposed in Prometheus text format at /metrics.
+# Recording is a lock, a dict lookup and an add, so it stays well under a
+# microsecond and is safe from both the Flask threads and the bot loop.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape_label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names, values, extra: str = '') -> str:
+    parts = [f'{n}="{_escape_label(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            yield self.name, _format_labels(self.labelnames, labels), value
+
+class Gauge:
+    """Value read at scrape time from a callback, e.g. a queue size"""
+    type = 'gauge'
+
+    def __init__(self, name: str, help: str, labelnames=(), callback=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        # callback returns {label_tuple: value}
+        self.callback = callback
+
+    def samples(self):
+        try:
+            values = self.callback() if self.callback else {}
+        except Exception:
+            values = {}
+        for labels, value in values.items():
+            yield self.name, _format_labels(self.labelnames, labels), value
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def _new_series(self, labels):
+        with self._lock:
+            return self._series.setdefault(labels, [0] * (len(self.buckets) + 2))
+
+    def observe(self, value: float, *labels, _bisect=bisect.bisect_left):
+        series = self._series.get(labels) or self._new_series(labels)
+        index = _bisect(self.buckets, value)
+        with self._lock:
+            series[index] += 1
+            series[-1] += value
+
+    def samples(self):
+        with self._lock:
+            items = [(labels, list(series)) for labels, series in self._series.items()]
+        for labels, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                yield f"{self.name}_bucket", _format_labels(self.labelnames, labels, f'le="{le}"'), cumulative
+            yield f"{self.name}_sum", _format_labels(self.labelnames, labels), series[-1]
+            yield f"{self.name}_count", _format_labels(self.labelnames, labels), cumulative
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name, help, labelnames=(), callback=None):
+        return self.register(Gauge(name, help, labelnames, callback))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {value}")
+        return '\n'.join(lines) + '\n'
+
+metrics = MetricsRegistry()
+HTTP_REQUEST_SECONDS = metrics.histogram('ehson_http_request_seconds', 'Flask request latency', ('route', 'method', 'status'))
+UPDATE_HANDLER_SECONDS = metrics.histogram('ehson_update_handler_seconds', 'aiogram handler latency', ('handler',))
+UPDATE_SECONDS = metrics.histogram('ehson_update_seconds', 'End-to-end update processing time', ('event',))
+BOT_API_SECONDS = metrics.histogram('ehson_bot_api_seconds', 'Telegram Bot API call latency', ('method',))
+DB_QUERY_SECONDS = metrics.histogram('ehson_db_query_seconds', 'SQLite statement execution time', ('statement',))
+CLICK_CALLBACKS = metrics.counter('ehson_click_callbacks_total', 'Click callback outcomes', ('action', 'error'))
+NOTIFICATION_SECONDS = metrics.histogram('ehson_notification_seconds', 'Telegram payment confirmation send latency', ('outcome',))
+
+# Per-update time breakdown, filled by TimedCursor and BotApiTimer while
+# UpdateTimer is processing an update (None outside of update handling)
+update_timing = contextvars.ContextVar('update_timing', default=None)
+
+# SQL profiling - per normalized statement stats, slow query log with the
+# query plan, and plan checks for hot-path queries
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+# Count every statement SQLite actually runs (implicit BEGIN, each executemany row)
+SQL_TRACE = os.getenv("SQL_TRACE") == "1"
+_SQL_LITERALS = re.compile(r"'(?:[^']|'')*'|(?<![\w.])-?\d+(?:\.\d+)?(?![\w.])")
+_normalized = {}
+
+def normalize_sql(sql: str) -> str:
+    """Literals replaced by ?, whitespace collapsed; cached for the literal statements in this file"""
+    normalized = _normalized.get(sql)
+    if normalized is None:
+        normalized = ' '.join(_SQL_LITERALS.sub('?', sql).split())
+        if len(_normalized) < 1000:
+            _normalized[sql] = normalized
+    return normalized
+
+def statement_label(sql: str) -> str:
+    return normalize_sql(sql)[:120]
+
+def explain_query_plan(conn: sqlite3.Connection, sql: str, parameters=()) -> List[str]:
+    # A plain cursor so the EXPLAIN itself is not timed/profiled
+    c = conn.cursor(sqlite3.Cursor)
+    c.execute("EXPLAIN QUERY PLAN " + sql, parameters)
+    return [row[3] for row in c.fetchall()]
+
+class SqlProfiler:
+    def __init__(self, slow_ms: float):
+        self.slow_seconds = slow_ms / 1000
+        self._stats = {}  # statement -> [calls, total_seconds, max_seconds, traced_executions]
+        self._plans = {}
+        self._lock = threading.Lock()
+
+    def record(self, sql: str, parameters, elapsed: float, conn: Optional[sqlite3.Connection]):
+        statement = normalize_sql(sql)
+        with self._lock:
+            stats = self._stats.get(statement)
+            if stats is None:
+                stats = self._stats[statement] = [0, 0.0, 0.0, 0]
+            stats[0] += 1
+            stats[1] += elapsed
+            if elapsed > stats[2]:
+                stats[2] = elapsed
+        if elapsed >= self.slow_seconds and conn is not None:
+            self.log_slow(statement, sql, parameters, elapsed, conn)
+
+    def trace(self, expanded_sql: str):
+        # Expanded SQL carries bound values, so it is normalized without caching
+        statement = ' '.join(_SQL_LITERALS.sub('?', expanded_sql).split())
+        with self._lock:
+            stats = self._stats.get(statement)
+            if stats is None:
+                stats = self._stats[statement] = [0, 0.0, 0.0, 0]
+            stats[3] += 1
+
+    def log_slow(self, statement: str, sql: str, parameters, elapsed: float, conn: sqlite3.Connection):
+        plan = self._plans.get(statement)
+        if plan is None and statement.split(' ', 1)[0].upper() in ('SELECT', 'UPDATE', 'DELETE', 'INSERT', 'WITH'):
+            try:
+                plan = self._plans[statement] = explain_query_plan(conn, sql, parameters)
+            except sqlite3.Error as e:
+                plan = [f"EXPLAIN xatosi: {e}"]
+        logger.warning(f"Sekin so'rov ({elapsed * 1000:.1f} ms): {statement} | plan: {'; '.join(plan or [])}")
+
+    def snapshot(self, limit: int = 50) -> List[Dict[str, Any]]:
+        with self._lock:
+            items = [(statement, list(stats)) for statement, stats in self._stats.items()]
+        items.sort(key=lambda item: item[1][1], reverse=True)
+        return [{
+            'statement': statement,
+            'calls': calls,
+            'total_ms': round(total * 1000, 2),
+            'avg_ms': round(total / calls * 1000, 3) if calls else 0.0,
+            'max_ms': round(worst * 1000, 2),
+            'traced_executions': traced,
+            'plan': self._plans.get(statement),
+        } for statement, (calls, total, worst, traced) in items[:limit]]
+
+sql_profiler = SqlProfiler(SLOW_QUERY_MS)
+
+def record_query(sql: str, parameters, elapsed: float, conn: Optional[sqlite3.Connection]):
+    DB_QUERY_SECONDS.observe(elapsed, statement_label(sql))
+    sql_profiler.record(sql, parameters, elapsed, conn)
+    timing = update_timing.get()
+    if timing is not None:
+        timing['db_seconds'] += elapsed
+        timing['db_calls'] += 1
+
+# Tables that grow with traffic or content; hot-path queries must not scan them
+LARGE_TABLES = ('payments', 'users', 'campaigns', 'data_changes')
+# Refuse to start when a hot-path query plan scans a large table
+STRICT_QUERY_PLANS = os.getenv("STRICT_QUERY_PLANS") == "1"
+
+# (name, sql, sample parameters) for every query on a request/update path
+HOT_PATH_QUERIES = [
+    ('payment_form_reuse', "SELECT payment_id FROM payments WHERE user_id = ? AND campaign_id IS ? "
+                           "AND status = 'pending' AND created_at >= ? LIMIT 1", ('1', 'c', '2024-01-01')),
+    ('history', "SELECT amount, status, created_at FROM payments WHERE user_id = ? AND status NOT IN ('pending', 'prepared')", ('1',)),
+    ('click_prepare', "SELECT rowid, amount, status, click_trans_id, traceparent FROM payments WHERE payment_id = ?",
+     ('x',)),
+    ('click_complete', "SELECT rowid, user_id, amount, status, click_trans_id, traceparent FROM payments "
+                       "WHERE payment_id = ?", ('x',)),
+    ('report_range', "SELECT payment_id, created_at, user_id, campaign_id, status, amount FROM payments "
+                     "WHERE created_at >= ? AND created_at < ? ORDER BY created_at", ('2024-01-01', '2024-01-02')),
+    ('campaigns_by_id', "SELECT * FROM campaigns WHERE id IN (?, ?)", ('a', 'b')),
+    ('data_version', "SELECT MAX(version) FROM data_changes", ()),
+    ('data_oldest', "SELECT MIN(version) FROM data_changes", ()),
+    ('data_changes_since', "SELECT entity, item_id FROM data_changes WHERE version > ?", (0,)),
+    ('data_changes_prune', "DELETE FROM data_changes WHERE version <= (SELECT MAX(version) FROM data_changes) - ?",
+     (1000,)),
+]
+
+def query_plan_problems(conn: sqlite3.Connection, sql: str, parameters=(), large_tables=LARGE_TABLES) -> List[str]:
+    """Plan lines that scan a large table (full table or full index scan) or sort in a temp b-tree"""
+    problems = []
+    for line in explain_query_plan(conn, sql, parameters):
+        # SQLite before 3.36 says "SCAN TABLE payments", later versions "SCAN payments"
+        words = [w for w in line.split() if w != 'TABLE']
+        if len(words) >= 2 and words[0] == 'SCAN' and words[1] in large_tables:
+            problems.append(line)
+        elif 'USE TEMP B-TREE' in line:
+            problems.append(line)
+    return problems
+
+def assert_query_plan(conn: sqlite3.Connection, sql: str, parameters=(), large_tables=LARGE_TABLES):
+    """Fail (AssertionError) when `sql` would scan a large table; tests and the strict startup check"""
+    problems = query_plan_problems(conn, sql, parameters, large_tables)
+    assert not problems, f"{' '.join(sql.split())} -> {problems}"
+
+def check_hot_path_plans(conn: sqlite3.Connection) -> List[str]:
+    return [f"{name}: {problem}" for name, sql, params in HOT_PATH_QUERIES
+            for problem in query_plan_problems(conn, sql, params)]
+
+# Database connections - every connection times its statements
+class TimedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            record_query(sql, parameters, time.perf_counter() - started, self.connection)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            record_query(sql, None, time.perf_counter() - started, None)
+
+class TimedConnection(sqlite3.Connection):
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def commit(self):
+        started = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            record_query('COMMIT', None, time.perf_counter() - started, None)
+
+def db_connect(path: Optional[str] = None) -> sqlite3.Connection:
+    conn = sqlite3.connect(path or DB_PATH, factory=TimedConnection)
+    if SQL_TRACE:
+        conn.set_trace_callback(sql_profiler.trace)
+    return conn
+
+# Payment traces: payment_form -> Click callbacks -> DB writes -> bot loop -> Telegram
+# The span file rotates at the same size as the logs
+tracer = tracing.Tracer(TRACE_PATH, max_bytes=int(os.getenv("LOG_MAX_BYTES", str(50 * 1024 * 1024))),
+                        backup_count=int(os.getenv("LOG_BACKUPS", "14")))
+
 # Database setup
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
+    conn = db_connect()
     c = conn.cursor()
     c.execute('''CREATE TABLE IF NOT EXISTS users (
                     user_id TEXT PRIMARY KEY,
@@ -256,8 +612,31 @@ def init_db():
                     status TEXT DEFAULT 'pending',
                     click_trans_id TEXT,
                     created_at TEXT,
+                    campaign_id TEXT,
+                    traceparent TEXT,
                     FOREIGN KEY (user_id) REFERENCES users (user_id)
                 )''')
+    # Older databases were created before these payments columns existed
+    c.execute("PRAGMA table_info(payments)")
+    columns = [row[1] for row in c.fetchall()]
+    for column in ('campaign_id', 'traceparent'):
+        if column not in columns:
+            c.execute(f"ALTER TABLE payments ADD COLUMN {column} TEXT")
+    # Range scans for accountant reports
+    c.execute("CREATE INDEX IF NOT EXISTS idx_payments_created_at ON payments (created_at)")
+    # Payment history lookups by user
+    c.execute("CREATE INDEX IF NOT EXISTS idx_payments_user_id ON payments (user_id)")
+    # One payment per Click transaction; also serves ordered scans for reconciliation
+    c.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'uq_payments_click_trans_id'")
+    if not c.fetchone():
+        # Older databases may hold duplicates (repeated callbacks, the test row
+        # re-inserted on every start). Keep the first one and tag the rest so
+        # they stay visible to reconciliation instead of being deleted.
+        c.execute("""UPDATE payments SET click_trans_id = click_trans_id || '#dup' || rowid
+                     WHERE click_trans_id IS NOT NULL AND rowid NOT IN (
+                         SELECT MIN(rowid) FROM payments WHERE click_trans_id IS NOT NULL GROUP BY click_trans_id)""")
+        c.execute("DROP INDEX IF EXISTS idx_payments_click_trans_id")
+        c.execute("CREATE UNIQUE INDEX uq_payments_click_trans_id ON payments (click_trans_id)")
     c.execute('''CREATE TABLE IF NOT EXISTS campaigns (
                     id TEXT PRIMARY KEY,
                     title TEXT,
@@ -285,7 +664,50 @@ def init_db():
                     contact TEXT,
                     showDuration INTEGER,
                     banner INTEGER,
-                    createdAt TEXT
+                    createdAt TEXT,
+                    weight REAL DEFAULT 1,
+                    frequencyCap INTEGER DEFAULT 0,
+                    dailyImpressions INTEGER DEFAULT 0
+                )''')
+    # Ad decision fields: selection weight, per-user daily cap, daily impression budget (0 = no limit)
+    c.execute("PRAGMA table_info(ads)")
+    ad_columns = [row[1] for row in c.fetchall()]
+    for column, ddl in (('weight', 'REAL DEFAULT 1'), ('frequencyCap', 'INTEGER DEFAULT 0'),
+                        ('dailyImpressions', 'INTEGER DEFAULT 0')):
+        if column not in ad_columns:
+            c.execute(f"ALTER TABLE ads ADD COLUMN {column} {ddl}")
+    # Impression/click counters, flushed in batches by AdServer
+    c.execute('''CREATE TABLE IF NOT EXISTS ad_stats (
+                    ad_id TEXT,
+                    day TEXT,
+                    impressions INTEGER DEFAULT 0,
+                    clicks INTEGER DEFAULT 0,
+                    PRIMARY KEY (ad_id, day)
+                )''')
+    events.init_rollup_tables(conn)
+    # Admin edits bump the data version the webapp caches against
+    c.execute('''CREATE TABLE IF NOT EXISTS data_changes (
+                    version INTEGER PRIMARY KEY AUTOINCREMENT,
+                    entity TEXT,
+                    item_id TEXT,
+                    changed_at TEXT
+                )''')
+    rum.init_tables(conn)
+    media.init_tables(conn)
+    # Channel post mirroring each campaign (see ChannelPublisher)
+    c.execute('''CREATE TABLE IF NOT EXISTS channel_posts (
+                    campaign_id TEXT PRIMARY KEY,
+                    message_id INTEGER,
+                    text TEXT,
+                    media_id TEXT,
+                    updated_at TEXT
+                )''')
+    # Telegram file_id per hash of the bytes uploaded (see TelegramFileRegistry)
+    c.execute('''CREATE TABLE IF NOT EXISTS telegram_files (
+                    content_hash TEXT PRIMARY KEY,
+                    file_id TEXT,
+                    asset TEXT,
+                    uploaded_at TEXT
                 )''')
     c.execute('''CREATE TABLE IF NOT EXISTS team (
                     id INTEGER PRIMARY KEY,
@@ -311,7 +733,8 @@ def init_db():
     c.execute("SELECT COUNT(*) FROM ads")
     if c.fetchone()[0] == 0:
         for ad in DEFAULT_ADS:
-            c.execute("INSERT INTO ads VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            c.execute("INSERT INTO ads (id, type, title, description, linkUrl, contact, showDuration, banner, createdAt) "
+                      "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
                       (ad['id'], ad['type'], ad['title'], ad['description'], ad['linkUrl'], ad['contact'],
                        ad['showDuration'], 1 if ad['banner'] else 0, ad['createdAt']))
 
@@ -331,16 +754,24 @@ def init_db():
     c.execute("INSERT OR IGNORE INTO payments (payment_id, user_id, amount, status, click_trans_id, created_at) VALUES (?, ?, ?, ?, ?, ?)",
               (str(uuid.uuid4()), "test_user_1", 10000.0, "success", "test_click_1", datetime.now().isoformat()))
     conn.commit()
+    if STRICT_QUERY_PLANS:
+        for name, sql, params in HOT_PATH_QUERIES:
+            assert_query_plan(conn, sql, params)
+    for problem in check_hot_path_plans(conn):
+        logger.warning(f"Query plan muammosi: {problem}")
     conn.close()
     logger.info("Database initialized with default and test data.")
 
 init_db()
 
 # Functions to get data from DB
-def get_campaigns():
-    conn = sqlite3.connect(DB_PATH)
+def get_campaigns(ids=None):
+    conn = db_connect()
     c = conn.cursor()
-    c.execute("SELECT * FROM campaigns")
+    if ids is None:
+        c.execute("SELECT * FROM campaigns")
+    else:
+        c.execute(f"SELECT * FROM campaigns WHERE id IN ({', '.join('?' * len(ids))})", list(ids))
     rows = c.fetchall()
     conn.close()
     campaigns = []
@@ -366,10 +797,13 @@ def get_campaigns():
         campaigns.append(camp)
     return campaigns
 
-def get_ads():
-    conn = sqlite3.connect(DB_PATH)
+def get_ads(ids=None):
+    conn = db_connect()
     c = conn.cursor()
-    c.execute("SELECT * FROM ads")
+    if ids is None:
+        c.execute("SELECT * FROM ads")
+    else:
+        c.execute(f"SELECT * FROM ads WHERE id IN ({', '.join('?' * len(ids))})", list(ids))
     rows = c.fetchall()
     conn.close()
     ads = []
@@ -383,15 +817,21 @@ def get_ads():
             'contact': row[5],
             'showDuration': row[6],
             'banner': bool(row[7]),
-            'createdAt': row[8]
+            'createdAt': row[8],
+            'weight': row[9] if row[9] is not None else 1,
+            'frequencyCap': row[10] or 0,
+            'dailyImpressions': row[11] or 0
         }
         ads.append(ad)
     return ads
 
-def get_team():
-    conn = sqlite3.connect(DB_PATH)
+def get_team(ids=None):
+    conn = db_connect()
     c = conn.cursor()
-    c.execute("SELECT * FROM team")
+    if ids is None:
+        c.execute("SELECT * FROM team")
+    else:
+        c.execute(f"SELECT * FROM team WHERE id IN ({', '.join('?' * len(ids))})", list(ids))
     rows = c.fetchall()
     conn.close()
     team = []
@@ -408,7 +848,7 @@ def get_team():
     return team
 
 def get_settings():
-    conn = sqlite3.connect(DB_PATH)
+    conn = db_connect()
     c = conn.cursor()
     c.execute("SELECT data FROM settings LIMIT 1")
     row = c.fetchone()
@@ -418,9 +858,102 @@ def get_settings():
     else:
         return DEFAULT_AD_SETTINGS
 
+# Data versions: every admin write logs (entity, item_id) in the same
+# transaction. The webapp caches a snapshot under the version it saw and asks
+# for the changes since then.
+DATA_ENTITIES = ('campaigns', 'ads', 'team', 'settings')
+DATA_CHANGES_KEPT = 1000
+
+def record_change(c: sqlite3.Cursor, entity: str, item_id):
+    c.execute("INSERT INTO data_changes (entity, item_id, changed_at) VALUES (?, ?, ?)",
+              (entity, None if item_id is None else str(item_id), datetime.now().isoformat()))
+    # Clients older than the kept window get a full snapshot instead
+    c.execute("DELETE FROM data_changes WHERE version <= (SELECT MAX(version) FROM data_changes) - ?",
+              (DATA_CHANGES_KEPT,))
+
+def data_version(c: sqlite3.Cursor) -> int:
+    c.execute("SELECT MAX(version) FROM data_changes")
+    return c.fetchone()[0] or 0
+
+def data_snapshot(version: int) -> dict:
+    return {'version': version, 'full': True, 'campaigns': get_campaigns(), 'ads': get_ads(),
+            'team': get_team(), 'settings': get_settings()}
+
+def data_diff(c: sqlite3.Cursor, since: int, version: int) -> Optional[dict]:
+    """Changes after `since`, or None when a full snapshot is needed"""
+    c.execute("SELECT MIN(version) FROM data_changes")
+    oldest = c.fetchone()[0]
+    if since > version or oldest is None or since < oldest - 1:
+        return None
+    # No DISTINCT: the sets below dedupe without a temp b-tree
+    c.execute("SELECT entity, item_id FROM data_changes WHERE version > ?", (since,))
+    changed = {}
+    for entity, item_id in c.fetchall():
+        if item_id is None:
+            # Whole-table change (api_clear)
+            return None
+        changed.setdefault(entity, set()).add(item_id)
+    diff = {'version': version, 'full': False}
+    loaders = {'campaigns': get_campaigns, 'ads': get_ads, 'team': get_team}
+    for entity, ids in changed.items():
+        if entity == 'settings':
+            diff['settings'] = get_settings()
+            continue
+        rows = loaders[entity](sorted(ids))
+        found = {str(row['id']) for row in rows}
+        diff[entity] = {'upsert': rows, 'delete': sorted(ids - found)}
+    return diff
+
 # Flask app setup
 app = Flask(__name__)
 
+# Admin requests are authorized by the initData Telegram signs with the bot
+# token, never by a user id the page sends
+def webapp_user(init_data: Optional[str]) -> Optional[dict]:
+    """The user in Telegram WebApp initData, or None if the hash does not check out or it is too old"""
+    if not init_data:
+        return None
+    fields = dict(urllib.parse.parse_qsl(init_data, keep_blank_values=True))
+    received = fields.pop('hash', '')
+    check_string = '\n'.join(f"{key}={value}" for key, value in sorted(fields.items()))
+    secret = hmac.new(b'WebAppData', BOT_TOKEN.encode(), hashlib.sha256).digest()
+    expected = hmac.new(secret, check_string.encode(), hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(expected, received):
+        return None
+    try:
+        if time.time() - int(fields.get('auth_date', 0)) > WEBAPP_AUTH_MAX_AGE:
+            return None
+        user = json.loads(fields['user'])
+    except (KeyError, ValueError):
+        return None
+    return user if isinstance(user, dict) else None
+
+def request_is_admin() -> bool:
+    # Header from fetch(); the query parameter is for plain links such as report downloads
+    user = webapp_user(request.headers.get('X-Telegram-Init-Data') or request.args.get('init_data'))
+    return user is not None and str(user.get('id')) == ADMIN_ID
+
+@app.route('/api/me', methods=['GET'])
+def api_me():
+    return jsonify({'admin': request_is_admin()})
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.get('request_started')
+    if started is not None:
+        # The URL rule, not the path, keeps label cardinality bounded
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, route, request.method, str(response.status_code))
+    return response
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
 # Payment HTML - Improved to match the platform style
 PAYMENT_HTML = '''
 <!DOCTYPE html>
@@ -440,7 +973,7 @@ PAYMENT_HTML = '''
             <input type="hidden" name="merchant_id" value="YOUR_MERCHANT_ID">
             <input type="hidden" name="service_id" value="YOUR_SERVICE_ID">
             <input type="hidden" name="merchant_user_id" value="{user_id}">
-            <input type="hidden" name="transaction_param" value="ehson_payment">
+            <input type="hidden" name="transaction_param" value="{payment_id}">
             <input type="hidden" name="return_url" value="{base_url}/success">
             <input type="hidden" name="card_type" value="0">
             <div class="mb-4">
@@ -453,9 +986,13 @@ PAYMENT_HTML = '''
         </form>
     </div>
     <script>
-        if (window.Telegram) {
+        if (window.Telegram) {{
             Telegram.WebApp.expand();
-        }
+        }}
+        // Shares the app shell worker, so the CDN scripts above come from its cache
+        if ('serviceWorker' in navigator) {{
+            navigator.serviceWorker.register('/sw.js', {{ updateViaCache: 'none' }}).catch(() => {{}});
+        }}
     </script>
 </body>
 </html>
@@ -465,8 +1002,35 @@ PAYMENT_HTML = '''
 def payment_form():
     user_id = request.args.get('user_id', 'guest')
     campaign_id = request.args.get('campaign_id', '')
+    # Pending session; Click sends its id back as merchant_trans_id and the
+    # prepare/complete callbacks update this row in place by primary key.
+    # The trace starts here; its traceparent is stored with the row so the
+    # Click callbacks and the confirmation continue the same trace
+    with tracer.span("payment_form", user_id=user_id, campaign_id=campaign_id) as span:
+        conn = db_connect()
+        c = conn.cursor()
+        row = None
+        if user_id != 'guest':
+            # Reloads and reopened forms reuse the pending row instead of adding one per GET
+            c.execute("SELECT payment_id FROM payments WHERE user_id = ? AND campaign_id IS ? AND status = 'pending' "
+                      "AND created_at >= ? LIMIT 1",
+                      (user_id, campaign_id or None,
+                       (datetime.now() - timedelta(seconds=PAYMENT_REUSE_SECONDS)).isoformat()))
+            row = c.fetchone()
+        if row:
+            payment_id = row[0]
+        else:
+            payment_id = str(uuid.uuid4())
+            with tracer.span("db.insert_payment"):
+                c.execute("INSERT INTO payments (payment_id, user_id, amount, status, created_at, campaign_id, traceparent) "
+                          "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                          (payment_id, user_id, None, "pending", datetime.now().isoformat(), campaign_id or None,
+                           span.traceparent))
+                conn.commit()
+        conn.close()
+        span.set(payment_id=payment_id, reused=bool(row))
     form_action = "https://my.click.uz/services/pay" if not os.getenv("TEST_MODE") else f"{BASE_URL}/mock_click"
-    html = PAYMENT_HTML.format(user_id=user_id, form_action=form_action, base_url=BASE_URL)
+    html = PAYMENT_HTML.format(user_id=user_id, payment_id=payment_id, form_action=form_action, base_url=BASE_URL)
     return make_response(html)
 
 @app.route("/success")
@@ -477,69 +1041,235 @@ def success():
 def mock_click():
     """Simulate Click API response for testing"""
     if request.method == "GET":
-        # Simulate redirect to callback
+        # Run prepare + complete in-process. Posting back to our own
+        # /click/callback would hold this worker while waiting on another one.
+        # For the full protocol over HTTP, use click_simulator.py.
         data = {
-            "merchant_id": "YOUR_MERCHANT_ID",
+            "click_trans_id": str(uuid.uuid4().int % 10**12),
             "service_id": "YOUR_SERVICE_ID",
-            "merchant_user_id": request.args.get("merchant_user_id"),
+            "click_paydoc_id": str(uuid.uuid4().int % 10**12),
+            "merchant_trans_id": request.args.get("transaction_param"),
             "amount": request.args.get("amount", "10000"),
-            "transaction_param": request.args.get("transaction_param"),
+            "action": "0",
             "error": "0",
-            "click_trans_id": str(uuid.uuid4()),
-            "payment_id": str(uuid.uuid4())
-        }
-        logger.info(f"Mock Click data: {data}")
-        # Send to callback
-        response = requests.post(f"{BASE_URL}/click/callback", data=data)
-        return jsonify({"status": "Mock payment processed", "callback_response": response.json()})
+            "error_note": "Success",
+        }
+        logger.debug("Mock Click data", extra={"click": data})
+        with tracer.span("click.prepare", mock=True) as span:
+            prepared = click_prepare(data)
+            span.set(error=prepared.get("error"))
+        data.update(action="1", merchant_prepare_id=str(prepared.get("merchant_prepare_id", "")))
+        with tracer.span("click.complete", mock=True) as span:
+            completed = click_complete(data)
+            span.set(error=completed.get("error"))
+        return jsonify({"status": "Mock payment processed", "prepare_response": prepared, "callback_response": completed})
     return jsonify({"error": -1, "message": "Invalid method"})
 
-@app.route("/click/callback", methods=["POST"])
-def click_callback():
-    data = request.form.to_dict()
-    logger.info(f"Click callback data: {data}")
-    
+# Click SHOP API error codes
+CLICK_SUCCESS = 0
+CLICK_SIGN_FAILED = -1
+CLICK_BAD_AMOUNT = -2
+CLICK_ACTION_NOT_FOUND = -3
+CLICK_ALREADY_PAID = -4
+CLICK_ORDER_NOT_FOUND = -5
+CLICK_TRANSACTION_NOT_FOUND = -6
+CLICK_UPDATE_FAILED = -7
+CLICK_BAD_REQUEST = -8
+CLICK_CANCELLED = -9
+
+class RecentTransactions:
+    """Thread-safe bounded LRU of finished Click transactions: (payment id, amount, the response we gave)"""
+
+    def __init__(self, capacity: int = 10000):
+        self.capacity = capacity
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, click_trans_id: str) -> Optional[tuple]:
+        with self._lock:
+            response = self._items.get(click_trans_id)
+            if response is not None:
+                self._items.move_to_end(click_trans_id)
+            return response
+
+    def put(self, click_trans_id: str, payment_id: str, amount: Optional[float], response: dict):
+        with self._lock:
+            self._items[click_trans_id] = (payment_id, amount, response)
+            self._items.move_to_end(click_trans_id)
+            while len(self._items) > self.capacity:
+                self._items.popitem(last=False)
+
+completed_transactions = RecentTransactions(int(os.getenv("CLICK_LRU_SIZE", "10000")))
+metrics.gauge('ehson_click_lru_size', 'Completed Click transactions held in the LRU',
+              callback=lambda: {(): len(completed_transactions._items)})
+
+def click_sign(data: Dict[str, Any]) -> str:
+    parts = [data.get("click_trans_id", ""), data.get("service_id", ""), CLICK_SECRET_KEY,
+             data.get("merchant_trans_id", "")]
+    if str(data.get("action")) == "1":
+        parts.append(data.get("merchant_prepare_id", ""))
+    parts += [data.get("amount", ""), data.get("action", ""), data.get("sign_time", "")]
+    return hashlib.md5("".join(str(p) for p in parts).encode()).hexdigest()
+
+def click_response(data: Dict[str, Any], error: int, note: str, **extra) -> dict:
+    response = {
+        "click_trans_id": data.get("click_trans_id"),
+        "merchant_trans_id": data.get("merchant_trans_id"),
+        "error": error,
+        "error_note": note,
+    }
+    response.update(extra)
+    return response
+
+def click_prepare(data: Dict[str, Any]) -> dict:
+    payment_id = data.get("merchant_trans_id")
+    click_trans_id = data.get("click_trans_id")
+    amount = float(data.get("amount", 0))
+
+    conn = db_connect()
     try:
-        conn = sqlite3.connect(DB_PATH)
         c = conn.cursor()
-        
-        user_id = data.get("merchant_user_id")
-        amount = float(data.get("amount", 0))
-        click_trans_id = data.get("click_trans_id", str(uuid.uuid4()))
-        payment_id = data.get("payment_id", str(uuid.uuid4()))
-        error_code = data.get("error", "-1")
-        
-        if not user_id:
-            logger.error("No user_id in callback")
-            conn.close()
-            return jsonify({"error": -1, "message": "No user_id"}), 400
-        
-        # Save or update user
-        c.execute("INSERT OR REPLACE INTO users (user_id, created_at) VALUES (?, ?)",
-                  (user_id, datetime.now().isoformat()))
-        
-        # Update payment
-        status = "success" if error_code == "0" else "failed"
-        c.execute("INSERT OR REPLACE INTO payments (payment_id, user_id, amount, status, click_trans_id, created_at) VALUES (?, ?, ?, ?, ?, ?)",
-                  (payment_id, user_id, amount, status, click_trans_id, datetime.now().isoformat()))
-        
-        conn.commit()
+        c.execute("SELECT rowid, amount, status, click_trans_id, traceparent FROM payments WHERE payment_id = ?",
+                  (payment_id,))
+        row = c.fetchone()
+        if not row:
+            return click_response(data, CLICK_ORDER_NOT_FOUND, "Payment not found")
+        prepare_id, stored_amount, status, stored_trans_id, traceparent = row
+        # The callback span joins the trace payment_form started
+        tracer.adopt(traceparent)
+        if status == "success":
+            return click_response(data, CLICK_ALREADY_PAID, "Already paid")
+        if status == "cancelled":
+            return click_response(data, CLICK_CANCELLED, "Transaction cancelled")
+        if stored_amount is not None and abs(stored_amount - amount) > 0.01:
+            return click_response(data, CLICK_BAD_AMOUNT, "Incorrect amount")
+        if stored_trans_id == click_trans_id and status == "prepared":
+            # Retried prepare: answer from the row, no write
+            return click_response(data, CLICK_SUCCESS, "Success", merchant_prepare_id=prepare_id)
+
+        with tracer.span("db.mark_prepared"):
+            c.execute("UPDATE payments SET amount = ?, status = 'prepared', click_trans_id = ? WHERE payment_id = ?",
+                      (amount, click_trans_id, payment_id))
+            conn.commit()
+        return click_response(data, CLICK_SUCCESS, "Success", merchant_prepare_id=prepare_id)
+    except sqlite3.IntegrityError:
+        # click_trans_id already belongs to another payment
+        return click_response(data, CLICK_BAD_REQUEST, "Duplicate click_trans_id")
+    finally:
         conn.close()
-        
-        if error_code == "0":
-            logger.info(f"✅ To‘lov qabul qilindi: ID = {payment_id}, Miqdor = {amount}, Foydalanuvchi = {user_id}")
+
+def click_complete(data: Dict[str, Any]) -> dict:
+    click_trans_id = data.get("click_trans_id")
+    cached = completed_transactions.get(click_trans_id)
+    if cached is not None:
+        cached_payment_id, cached_amount, response = cached
+        # Only the same retry is answered from memory; a different order or
+        # amount goes through the row checks below and gets their error
+        if (cached_payment_id == data.get("merchant_trans_id") and cached_amount is not None
+                and abs(cached_amount - float(data.get("amount", 0))) <= 0.01):
+            return response
+
+    payment_id = data.get("merchant_trans_id")
+    provider_error = int(data.get("error", 0))
+    conn = db_connect()
+    try:
+        c = conn.cursor()
+        c.execute("SELECT rowid, user_id, amount, status, click_trans_id, traceparent FROM payments "
+                  "WHERE payment_id = ?", (payment_id,))
+        row = c.fetchone()
+        if not row:
+            return click_response(data, CLICK_ORDER_NOT_FOUND, "Payment not found")
+        prepare_id, user_id, amount, status, stored_trans_id, traceparent = row
+        tracer.adopt(traceparent)
+        if str(prepare_id) != str(data.get("merchant_prepare_id")) or stored_trans_id != click_trans_id:
+            return click_response(data, CLICK_TRANSACTION_NOT_FOUND, "Transaction not found")
+        if amount is not None and abs(amount - float(data.get("amount", 0))) > 0.01:
+            return click_response(data, CLICK_BAD_AMOUNT, "Incorrect amount")
+
+        if status == "success":
+            response = click_response(data, CLICK_SUCCESS, "Success", merchant_confirm_id=prepare_id)
+            completed_transactions.put(click_trans_id, payment_id, amount, response)
+            return response
+        if status == "cancelled":
+            response = click_response(data, CLICK_CANCELLED, "Transaction cancelled")
+            completed_transactions.put(click_trans_id, payment_id, amount, response)
+            return response
+
+        if provider_error < 0:
+            c.execute("UPDATE payments SET status = 'cancelled' WHERE payment_id = ? AND status = 'prepared'", (payment_id,))
+            conn.commit()
+            logger.info(f"❌ To‘lov bekor qilindi: ID = {payment_id}, Error = {provider_error}")
+            response = click_response(data, CLICK_CANCELLED, "Transaction cancelled")
+            completed_transactions.put(click_trans_id, payment_id, amount, response)
+            return response
+
+        # The status guard makes concurrent duplicates race on one row; only
+        # the winner sees rowcount == 1 and sends the confirmation
+        with tracer.span("db.mark_success") as span:
+            c.execute("UPDATE payments SET status = 'success' WHERE payment_id = ? AND status = 'prepared'", (payment_id,))
+            won = c.rowcount == 1
+            c.execute("INSERT OR IGNORE INTO users (user_id, created_at) VALUES (?, ?)", (user_id, datetime.now().isoformat()))
+            conn.commit()
+            span.set(won=won)
+    except sqlite3.Error as e:
+        logger.error(f"Callback xatosi: {e}")
+        return click_response(data, CLICK_UPDATE_FAILED, "Failed to update payment")
+    finally:
+        conn.close()
+
+    response = click_response(data, CLICK_SUCCESS, "Success", merchant_confirm_id=prepare_id)
+    completed_transactions.put(click_trans_id, payment_id, amount, response)
+    if won:
+        logger.info(f"✅ To‘lov qabul qilindi: ID = {payment_id}, Miqdor = {amount}, Foydalanuvchi = {user_id}")
+        # Ends on the bot loop when the coroutine starts: the cross-thread wait
+        hop = tracer.start("bot_loop.hop", user_id=user_id)
+        if str(user_id).isdigit() and bot_loop is not None:
             asyncio.run_coroutine_threadsafe(
-                send_payment_confirmation(int(user_id), amount, status),
+                send_payment_confirmation(int(user_id), amount, "success", hop=hop),
                 bot_loop
             )
         else:
-            logger.info(f"❌ To‘lov bekor qilindi: Error = {error_code}")
-        
-        return jsonify({"error": 0})
-    
+            hop.error("bot loop not running" if bot_loop is None else "user_id is not a Telegram id")
+            hop.end()
+    return response
+
+def handle_click_callback(data: Dict[str, Any]) -> dict:
+    try:
+        for field in ("click_trans_id", "merchant_trans_id", "amount", "action"):
+            if not data.get(field):
+                return click_response(data, CLICK_BAD_REQUEST, f"Missing {field}")
+        if CLICK_SECRET_KEY and data.get("sign_string") != click_sign(data):
+            return click_response(data, CLICK_SIGN_FAILED, "SIGN CHECK FAILED!")
+
+        action = data["action"]
+        if action == "0":
+            return click_prepare(data)
+        elif action == "1":
+            return click_complete(data)
+        return click_response(data, CLICK_ACTION_NOT_FOUND, "Action not found")
+
+    except ValueError as e:
+        return click_response(data, CLICK_BAD_REQUEST, str(e))
     except Exception as e:
         logger.error(f"Callback xatosi: {e}")
-        return jsonify({"error": -1, "message": str(e)}), 500
+        return click_response(data, CLICK_UPDATE_FAILED, str(e))
+
+@app.route("/click/callback", methods=["POST"])
+def click_callback():
+    data = request.form.to_dict()
+    logger.debug("Click callback", extra={"click": data})
+    name = {"0": "click.prepare", "1": "click.complete"}.get(data.get("action"), "click.callback")
+    # Starts its own trace; click_prepare/click_complete move it under the
+    # payment's trace once they have read the row
+    with tracer.span(name, click_trans_id=data.get("click_trans_id", "")) as span:
+        response = handle_click_callback(data)
+        span.set(error=response.get("error"))
+        if response.get("error", 0) < 0:
+            span.error(response.get("error_note", ""))
+    CLICK_CALLBACKS.inc(data.get("action", ""), str(response.get("error")))
+    logger.info(f"Click callback: action={data.get('action')} trans_id={data.get('click_trans_id')} "
+                f"error={response.get('error')}")
+    return jsonify(response)
 
 # API routes
 @app.route('/api/campaigns', methods=['GET', 'POST'])
@@ -547,12 +1277,11 @@ def api_campaigns():
     if request.method == 'GET':
         return jsonify(get_campaigns())
     elif request.method == 'POST':
-        data = request.json
-        user_id = data.get('user_id')
-        if user_id != ADMIN_ID:
+        if not request_is_admin():
             return jsonify({'error': 'Unauthorized'}), 403
-        del data['user_id']
-        conn = sqlite3.connect(DB_PATH)
+        data = request.json
+        data.pop('user_id', None)
+        conn = db_connect()
         c = conn.cursor()
         values = (
             data['id'], data['title'], data['category'], data['description'], data['targetAmount'], data['currentAmount'],
@@ -560,19 +1289,19 @@ def api_campaigns():
             data['contactPhone'], data['contactName'], data['image'], data['createdBy'], data['createdAt']
         )
         c.execute("INSERT OR REPLACE INTO campaigns VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", values)
+        record_change(c, 'campaigns', data['id'])
         conn.commit()
         conn.close()
         return jsonify({'success': True})
 
 @app.route('/api/campaigns/<id>', methods=['DELETE'])
 def delete_campaign(id):
-    data = request.json
-    user_id = data.get('user_id')
-    if user_id != ADMIN_ID:
+    if not request_is_admin():
         return jsonify({'error': 'Unauthorized'}), 403
-    conn = sqlite3.connect(DB_PATH)
+    conn = db_connect()
     c = conn.cursor()
     c.execute("DELETE FROM campaigns WHERE id = ?", (id,))
+    record_change(c, 'campaigns', id)
     conn.commit()
     conn.close()
     return jsonify({'success': True})
@@ -582,64 +1311,389 @@ def api_ads():
     if request.method == 'GET':
         return jsonify(get_ads())
     elif request.method == 'POST':
-        data = request.json
-        user_id = data.get('user_id')
-        if user_id != ADMIN_ID:
+        if not request_is_admin():
             return jsonify({'error': 'Unauthorized'}), 403
-        del data['user_id']
-        conn = sqlite3.connect(DB_PATH)
+        data = request.json
+        data.pop('user_id', None)
+        conn = db_connect()
         c = conn.cursor()
         values = (
             data['id'], data['type'], data['title'], data['description'], data['linkUrl'], data['contact'],
-            data['showDuration'], 1 if data['banner'] else 0, data['createdAt']
+            data['showDuration'], 1 if data['banner'] else 0, data['createdAt'],
+            float(data['weight']) if data.get('weight') is not None else 1.0, int(data.get('frequencyCap') or 0), int(data.get('dailyImpressions') or 0)
         )
-        c.execute("INSERT OR REPLACE INTO ads VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", values)
+        c.execute("INSERT OR REPLACE INTO ads VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", values)
+        record_change(c, 'ads', data['id'])
         conn.commit()
         conn.close()
+        ad_server.invalidate()
         return jsonify({'success': True})
 
 @app.route('/api/ads/<id>', methods=['DELETE'])
 def delete_ad(id):
-    data = request.json
-    user_id = data.get('user_id')
-    if user_id != ADMIN_ID:
+    if not request_is_admin():
         return jsonify({'error': 'Unauthorized'}), 403
-    conn = sqlite3.connect(DB_PATH)
+    conn = db_connect()
     c = conn.cursor()
     c.execute("DELETE FROM ads WHERE id = ?", (id,))
+    record_change(c, 'ads', id)
     conn.commit()
     conn.close()
+    ad_server.invalidate()
     return jsonify({'success': True})
 
+# Ad decisions: the banner slot asks the server which ad to show. Counters
+# live in memory and are flushed to ad_stats in one transaction every
+# AD_FLUSH_SECONDS, so a view never costs a write.
+AD_FLUSH_SECONDS = float(os.getenv("AD_FLUSH_SECONDS", "5"))
+AD_DEFAULT_FREQUENCY_CAP = int(os.getenv("AD_FREQUENCY_CAP", "0"))
+AD_DECISIONS = metrics.counter('ehson_ad_decisions_total', 'Ad decision outcomes', ('outcome',))
+
+class AdServer:
+    def __init__(self, flush_interval: float = AD_FLUSH_SECONDS, cache_ttl: float = 30.0, max_users: int = 50000):
+        self.flush_interval = flush_interval
+        self.cache_ttl = cache_ttl
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        self._ads = None
+        self._loaded_at = 0.0
+        self._day = None
+        self._served_today = {}  # ad_id -> impressions today (flushed + pending)
+        self._views = OrderedDict()  # user_id -> {ad_id: impressions today}, LRU-bounded
+        self._pending = {}  # (ad_id, day) -> [impressions, clicks]
+        self._stop = threading.Event()
+        self._flusher = None
+
+    def invalidate(self):
+        with self._lock:
+            self._ads = None
+
+    def _load(self, today: str):
+        """Banner ads and today's impression totals; called with the lock held"""
+        conn = db_connect()
+        try:
+            self._ads = [ad for ad in get_ads() if ad['banner']]
+            if self._day != today:
+                self._day = today
+                self._views.clear()
+                self._served_today = dict(conn.execute(
+                    "SELECT ad_id, impressions FROM ad_stats WHERE day = ?", (today,)).fetchall())
+                for (ad_id, day), (impressions, _) in self._pending.items():
+                    if day == today:
+                        self._served_today[ad_id] = self._served_today.get(ad_id, 0) + impressions
+        finally:
+            conn.close()
+        self._loaded_at = time.monotonic()
+
+    def _refresh(self, today: str):
+        """Reload the ads when the cache is stale or the day changed; called with the lock held"""
+        if self._ads is None or self._day != today or time.monotonic() - self._loaded_at > self.cache_ttl:
+            self._load(today)
+
+    @staticmethod
+    def _paced_out(ad: dict, served: int, now: datetime) -> bool:
+        """Spread a daily budget over the day: allow budget * elapsed fraction, plus a small burst"""
+        budget = ad['dailyImpressions']
+        if not budget:
+            return False
+        elapsed = (now.hour * 3600 + now.minute * 60 + now.second) / 86400
+        return served >= min(budget, budget * elapsed + max(1, budget // 100))
+
+    def next_ad(self, user_id: Optional[str]) -> Optional[dict]:
+        self.start()
+        now = datetime.now()
+        today = now.date().isoformat()
+        with self._lock:
+            self._refresh(today)
+            seen = self._views.get(user_id, {}) if user_id else {}
+            candidates = []
+            for ad in self._ads:
+                cap = ad['frequencyCap'] or AD_DEFAULT_FREQUENCY_CAP
+                if cap and seen.get(ad['id'], 0) >= cap:
+                    continue
+                if self._paced_out(ad, self._served_today.get(ad['id'], 0), now):
+                    continue
+                if ad['weight'] > 0:
+                    candidates.append(ad)
+            if not candidates:
+                AD_DECISIONS.inc('capped' if self._ads else 'empty')
+                return None
+            ad = random.choices(candidates, weights=[a['weight'] for a in candidates])[0]
+            self._served_today[ad['id']] = self._served_today.get(ad['id'], 0) + 1
+            self._pending.setdefault((ad['id'], today), [0, 0])[0] += 1
+            if user_id:
+                views = self._views.setdefault(user_id, {})
+                views[ad['id']] = views.get(ad['id'], 0) + 1
+                self._views.move_to_end(user_id)
+                while len(self._views) > self.max_users:
+                    self._views.popitem(last=False)
+        AD_DECISIONS.inc('served')
+        return ad
+
+    def record_click(self, ad_id: str) -> bool:
+        """Count a click on a served ad; False (nothing counted) for unknown ids"""
+        self.start()
+        today = datetime.now().date().isoformat()
+        with self._lock:
+            self._refresh(today)
+            if not any(ad['id'] == ad_id for ad in self._ads):
+                return False
+            self._pending.setdefault((ad_id, today), [0, 0])[1] += 1
+        return True
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        rows = [(ad_id, day, impressions, clicks) for (ad_id, day), (impressions, clicks) in pending.items()]
+        conn = db_connect()
+        try:
+            conn.executemany("""INSERT INTO ad_stats (ad_id, day, impressions, clicks) VALUES (?, ?, ?, ?)
+                                ON CONFLICT (ad_id, day) DO UPDATE SET
+                                    impressions = impressions + excluded.impressions,
+                                    clicks = clicks + excluded.clicks""", rows)
+            conn.commit()
+        except sqlite3.Error as e:
+            # Put the counts back; the next flush retries them
+            logger.error(f"Reklama statistikasini yozishda xato: {e}")
+            with self._lock:
+                for key, (impressions, clicks) in pending.items():
+                    counts = self._pending.setdefault(key, [0, 0])
+                    counts[0] += impressions
+                    counts[1] += clicks
+        finally:
+            conn.close()
+
+    def stats(self) -> List[dict]:
+        """Totals per ad and day, including counts not flushed yet"""
+        conn = db_connect()
+        try:
+            rows = conn.execute("SELECT ad_id, day, impressions, clicks FROM ad_stats").fetchall()
+        finally:
+            conn.close()
+        totals = {(ad_id, day): [impressions, clicks] for ad_id, day, impressions, clicks in rows}
+        with self._lock:
+            for key, (impressions, clicks) in self._pending.items():
+                counts = totals.setdefault(key, [0, 0])
+                counts[0] += impressions
+                counts[1] += clicks
+        return [{'ad_id': ad_id, 'day': day, 'impressions': impressions, 'clicks': clicks}
+                for (ad_id, day), (impressions, clicks) in sorted(totals.items())]
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def start(self):
+        """Start the flush thread; called lazily by the first decision or click"""
+        if self._flusher is not None:
+            return
+        with self._lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name="ad-flush", daemon=True)
+                self._flusher.start()
+                atexit.register(self.stop)
+
+    def stop(self):
+        self._stop.set()
+        self.flush()
+
+ad_server = AdServer()
+metrics.gauge('ehson_ad_pending_counters', 'Ad counters waiting for the next flush',
+              callback=lambda: {(): len(ad_server._pending)})
+
+@app.route('/api/ads/next', methods=['GET'])
+def api_ads_next():
+    ad = ad_server.next_ad(request.args.get('user_id'))
+    return jsonify({'ad': ad})
+
+@app.route('/api/ads/<id>/click', methods=['POST'])
+def api_ad_click(id):
+    if not ad_server.record_click(id):
+        return jsonify({'error': 'Ad not found'}), 404
+    return ('', 204)
+
+@app.route('/api/ads/stats', methods=['GET'])
+def api_ad_stats():
+    if not request_is_admin():
+        return jsonify({'error': 'Unauthorized'}), 403
+    return jsonify(ad_server.stats())
+
+# Webapp events: one queued line per beacon batch, rolled up hourly. The log
+# is opened on first use, so tools that import bot (replay.py, benchmarks)
+# do not start a writer in the events directory.
+event_log = None
+_event_log_lock = threading.Lock()
+
+def get_event_log() -> events.EventLog:
+    global event_log
+    with _event_log_lock:
+        if event_log is None:
+            event_log = events.EventLog(EVENT_LOG_DIR,
+                                        segment_seconds=float(os.getenv("EVENT_SEGMENT_SECONDS", "300")),
+                                        segment_bytes=int(os.getenv("EVENT_SEGMENT_BYTES", str(16 * 1024 * 1024))))
+        return event_log
+
+EVENT_BATCHES = metrics.counter('ehson_event_batches_total', 'Webapp event beacon batches', ('outcome',))
+metrics.gauge('ehson_event_log_queue_depth', 'Event batches waiting for the segment writer',
+              callback=lambda: {(): event_log.queue.qsize()} if event_log else {})
+
+@app.route('/api/events', methods=['POST'])
+def api_events():
+    # sendBeacon posts text/plain, so parse the raw body whatever the content type
+    try:
+        batch = events.parse_batch(request.get_data(cache=False))
+    except ValueError as e:
+        EVENT_BATCHES.inc('rejected')
+        return jsonify({'error': str(e)}), 400
+    if not get_event_log().append(batch, time.time()):
+        EVENT_BATCHES.inc('dropped')
+        return jsonify({'error': 'busy'}), 503
+    EVENT_BATCHES.inc('accepted')
+    return ('', 204)
+
+@app.route('/api/events/hourly', methods=['GET'])
+def api_events_hourly():
+    if not request_is_admin():
+        return jsonify({'error': 'Unauthorized'}), 403
+    conn = db_connect()
+    try:
+        rows = events.hourly_counts(conn, request.args.get('name'), request.args.get('since'))
+    finally:
+        conn.close()
+    return jsonify([{'hour': hour, 'name': name, 'count': count} for hour, name, count in rows])
+
+# Real-user timings from the webapp, aggregated per device class and app version
+RUM_FLUSH_SECONDS = float(os.getenv("RUM_FLUSH_SECONDS", "30"))
+rum_aggregator = rum.RumAggregator(versions=(APP_VERSION,))
+
+@app.route('/api/rum', methods=['POST'])
+def api_rum():
+    body = request.get_data(cache=False)
+    if len(body) > 16 * 1024:
+        return jsonify({'error': 'report too large'}), 400
+    try:
+        rum_aggregator.record(json.loads(body))
+    except (ValueError, AttributeError) as e:
+        return jsonify({'error': str(e)}), 400
+    return ('', 204)
+
+@app.route('/api/rum/summary', methods=['GET'])
+def api_rum_summary():
+    if not request_is_admin():
+        return jsonify({'error': 'Unauthorized'}), 403
+    days = request.args.get('days', 7, type=int)
+    conn = db_connect()
+    try:
+        rows = rum_aggregator.summary(conn, max(1, min(days, 366)), request.args.get('version'))
+    finally:
+        conn.close()
+    return jsonify({'buckets_ms': rum.BUCKETS_MS, 'rows': rows})
+
+def flush_rum():
+    conn = db_connect()
+    try:
+        rum_aggregator.flush(conn)
+    except sqlite3.Error as e:
+        logger.error(f"RUM ma'lumotlarini yozishda xato: {e}")
+    finally:
+        conn.close()
+
+def run_rum_flush():
+    while True:
+        time.sleep(RUM_FLUSH_SECONDS)
+        flush_rum()
+
+atexit.register(flush_rum)
+
+# Media store: uploads are content-addressed, so /media URLs never change
+# meaning and are served as immutable
+media_store = media.MediaStore(MEDIA_DIR, cache_bytes=MEDIA_CACHE_BYTES, workers=MEDIA_WORKERS)
+MEDIA_VARIANTS = metrics.counter('ehson_media_variants_total', 'Media variant requests by outcome', ('outcome',))
+metrics.gauge('ehson_media_cache_bytes', 'Bytes of resized media in the disk cache',
+              callback=lambda: {(): media_store.cached_bytes})
+
+@app.route('/api/media', methods=['POST'])
+def api_media_upload():
+    if not request_is_admin():
+        return jsonify({'error': 'Unauthorized'}), 403
+    if (request.content_length or 0) > media.MAX_UPLOAD_BYTES + 64 * 1024:
+        return jsonify({'error': 'file too large'}), 413
+    upload = request.files.get('file')
+    if upload is None:
+        return jsonify({'error': 'file is required'}), 400
+    conn = db_connect()
+    try:
+        info = media_store.save(upload.read(media.MAX_UPLOAD_BYTES + 1), conn)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except RuntimeError as e:
+        logger.error(f"Media xatosi: {e}")
+        return jsonify({'error': str(e)}), 500
+    finally:
+        conn.close()
+    return jsonify(info)
+
+@app.route('/media/<media_id>', methods=['GET'])
+def media_file(media_id):
+    fmt = request.args.get('f', 'jpeg')
+    width = request.args.get('w', media.WIDTHS[-1], type=int)
+    try:
+        f, cached = media_store.open_variant(media_id, width, fmt)
+    except FileNotFoundError:
+        MEDIA_VARIANTS.inc('not_found')
+        return jsonify({'error': 'not found'}), 404
+    except Exception as e:
+        MEDIA_VARIANTS.inc('error')
+        logger.error(f"Rasm varianti yaratilmadi ({media_id}, {width}, {fmt}): {e}")
+        return jsonify({'error': 'variant failed'}), 503
+    MEDIA_VARIANTS.inc('hit' if cached else 'generated')
+    response = send_file(f, mimetype=media.FORMATS[fmt])
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+def run_event_rollup():
+    while True:
+        time.sleep(EVENT_ROLLUP_SECONDS)
+        conn = db_connect()
+        try:
+            summary = events.rollup(EVENT_LOG_DIR, conn)
+            if summary['segments']:
+                logger.info(f"Hodisalar yig'ildi: {summary}")
+        except Exception as e:
+            logger.error(f"Hodisalarni yig'ishda xato: {e}")
+        finally:
+            conn.close()
+
 @app.route('/api/team', methods=['GET', 'POST'])
 def api_team():
     if request.method == 'GET':
         return jsonify(get_team())
     elif request.method == 'POST':
-        data = request.json
-        user_id = data.get('user_id')
-        if user_id != ADMIN_ID:
+        if not request_is_admin():
             return jsonify({'error': 'Unauthorized'}), 403
-        del data['user_id']
-        conn = sqlite3.connect(DB_PATH)
+        data = request.json
+        data.pop('user_id', None)
+        conn = db_connect()
         c = conn.cursor()
         values = (
             data['id'], data['name'], data['role'], data['description'], data['image'], json.dumps(data['socials'])
         )
         c.execute("INSERT OR REPLACE INTO team VALUES (?, ?, ?, ?, ?, ?)", values)
+        record_change(c, 'team', data['id'])
         conn.commit()
         conn.close()
         return jsonify({'success': True})
 
 @app.route('/api/team/<id>', methods=['DELETE'])
 def delete_team(id):
-    data = request.json
-    user_id = data.get('user_id')
-    if user_id != ADMIN_ID:
+    if not request_is_admin():
         return jsonify({'error': 'Unauthorized'}), 403
-    conn = sqlite3.connect(DB_PATH)
+    conn = db_connect()
     c = conn.cursor()
     c.execute("DELETE FROM team WHERE id = ?", (id,))
+    record_change(c, 'team', id)
     conn.commit()
     conn.close()
     return jsonify({'success': True})
@@ -649,32 +1703,33 @@ def api_settings():
     if request.method == 'GET':
         return jsonify(get_settings())
     elif request.method == 'POST':
-        data = request.json
-        user_id = data.get('user_id')
-        if user_id != ADMIN_ID:
+        if not request_is_admin():
             return jsonify({'error': 'Unauthorized'}), 403
-        del data['user_id']
-        conn = sqlite3.connect(DB_PATH)
+        data = request.json
+        data.pop('user_id', None)
+        conn = db_connect()
         c = conn.cursor()
         c.execute("UPDATE settings SET data = ? WHERE id=1", (json.dumps(data),))
+        record_change(c, 'settings', 1)
         conn.commit()
         conn.close()
         return jsonify({'success': True})
 
 @app.route('/api/clear', methods=['POST'])
 def api_clear():
-    data = request.json
-    user_id = data.get('user_id')
-    if user_id != ADMIN_ID:
+    if not request_is_admin():
         return jsonify({'error': 'Unauthorized'}), 403
-    conn = sqlite3.connect(DB_PATH)
+    conn = db_connect()
     c = conn.cursor()
     c.execute("DELETE FROM campaigns")
     c.execute("DELETE FROM ads")
     c.execute("DELETE FROM team")
     c.execute("UPDATE settings SET data = ?", (json.dumps(DEFAULT_AD_SETTINGS),))
+    for entity in DATA_ENTITIES:
+        record_change(c, entity, None)
     conn.commit()
     conn.close()
+    ad_server.invalidate()
     return jsonify({'success': True})
 
 @app.route('/api/export', methods=['GET'])
@@ -687,9 +1742,80 @@ def api_export():
     }
     return jsonify(data)
 
+@app.route('/api/data', methods=['GET'])
+def api_data():
+    """Webapp data with a version ETag; ?since=<version> returns only what changed"""
+    conn = db_connect()
+    try:
+        c = conn.cursor()
+        version = data_version(c)
+        etag = f"v{version}"
+        if request.if_none_match.contains(etag):
+            response = make_response('', 304)
+            response.set_etag(etag)
+            return response
+        since = request.args.get('since', type=int)
+        payload = data_diff(c, since, version) if since is not None else None
+    finally:
+        conn.close()
+    response = jsonify(payload or data_snapshot(version))
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/api/sql-stats', methods=['GET'])
+def api_sql_stats():
+    if not request_is_admin():
+        return jsonify({'error': 'Unauthorized'}), 403
+    limit = request.args.get('limit', 50, type=int)
+    return jsonify(sql_profiler.snapshot(max(1, limit)))
+
+# Accountant reports - built on a separate pool so a large export never
+# occupies the threads that serve Click callbacks
+report_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="report")
+metrics.gauge('ehson_report_queue_depth', 'Reports waiting for a report worker',
+              callback=lambda: {(): report_executor._work_queue.qsize()})
+# An XLSX file is built before it is sent, in the request thread; extra
+# requests are turned away rather than holding more server threads
+xlsx_report_slots = threading.BoundedSemaphore(2)
+
+@app.route('/api/reports/payments', methods=['GET'])
+def api_payments_report():
+    if not request_is_admin():
+        return jsonify({'error': 'Unauthorized'}), 403
+    date_from = request.args.get('from', datetime.now().date().isoformat())
+    date_to = request.args.get('to', date_from)
+    fmt = request.args.get('format', 'csv')
+    filename = f"payments_{date_from}_{date_to}.{fmt}"
+    try:
+        if fmt == 'csv':
+            chunks = reports.stream_csv_report(report_executor, DB_PATH, date_from, date_to)
+            return Response(chunks, mimetype='text/csv',
+                            headers={'Content-Disposition': f'attachment; filename={filename}'})
+        elif fmt == 'xlsx':
+            if not xlsx_report_slots.acquire(blocking=False):
+                return jsonify({'error': 'busy'}), 503, {'Retry-After': '30'}
+            fd, tmp_path = tempfile.mkstemp(suffix='.xlsx')
+            os.close(fd)
+            try:
+                reports.write_xlsx_report(DB_PATH, date_from, date_to, tmp_path)
+                # The open handle keeps the data alive after unlinking; send_file streams and closes it
+                report_file = open(tmp_path, 'rb')
+            finally:
+                os.remove(tmp_path)
+                xlsx_report_slots.release()
+            return send_file(report_file, as_attachment=True, download_name=filename,
+                             mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+        return jsonify({'error': 'Unknown format'}), 400
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except RuntimeError as e:
+        logger.error(f"Hisobot xatosi: {e}")
+        return jsonify({'error': str(e)}), 500
+
 # WebApp HTML - the second code with modifications
-WEBAPP_HTML = '''\
-<!DOCTYPE html>
+# Raw string: the JavaScript below relies on \' escapes reaching the browser
+WEBAPP_HTML = r'''<!DOCTYPE html>
 <html lang="uz">
 <head>
     <meta charset="UTF-8">
@@ -1200,7 +2326,7 @@ WEBAPP_HTML = '''\
             }
         }
 
-        /* Local Storage Indicator */
+        /* Data Freshness Indicator */
         .storage-indicator {
             position: fixed;
             bottom: 20px;
@@ -1271,7 +2397,7 @@ WEBAPP_HTML = '''\
                 <i class="fas fa-times"></i>
             </button>
             <div id="adTimer" class="ad-timer">5</div>
-            <button id="adSkipBtn" class="ad-skip-btn hidden" onclick="closeAdOverlay()">
+            <button id="adSkipBtn" class="ad-skip-btn hidden" onclick="skipAdOverlay()">
                 Reklamani o'tkazib yuborish
             </button>
             <div id="adContentArea">
@@ -1292,10 +2418,8 @@ WEBAPP_HTML = '''\
         </div>
     </div>
 
-    <!-- Local Storage Indicator (Admin uchun) -->
-    <div id="storageIndicator" class="storage-indicator">
-        💾 Ma'lumotlar local saqlandi. Deploy qiling!
-    </div>
+    <!-- Data freshness indicator (saved copy / offline) -->
+    <div id="storageIndicator" class="storage-indicator"></div>
 
     <!-- Language Bar -->
     <div class="bg-gradient-to-r from-blue-500 to-purple-500 text-white py-2">
@@ -1389,6 +2513,10 @@ WEBAPP_HTML = '''\
                     <div class="text-2xl mb-2">⚙️</div>
                     <div class="font-bold">Sozlamalar</div>
                 </button>
+                <button onclick="showPerformance()" class="user-card rounded-xl p-4 text-center hover:bg-white hover:bg-opacity-20 transition-all">
+                    <div class="text-2xl mb-2">📈</div>
+                    <div class="font-bold">Tezlik (RUM)</div>
+                </button>
                 <button onclick="exportData()" class="user-card rounded-xl p-4 text-center hover:bg-white hover:bg-opacity-20 transition-all">
                     <div class="text-2xl mb-2">📤</div>
                     <div class="font-bold">Ma'lumotlarni Export</div>
@@ -1669,7 +2797,7 @@ WEBAPP_HTML = '''\
             </div>
             
             <div id="teamGrid" class="grid grid-cols-1 md:grid-cols-2 lg:grid-cols-4 gap-8">
-                <!-- Team members will be loaded here from localStorage -->
+                <!-- Team members are rendered by displayTeam -->
             </div>
         </div>
     </section>
@@ -1812,12 +2940,293 @@ WEBAPP_HTML = '''\
         let currentFilter = 'all';
         let isAdmin = false;
 
-        // Admin parol
-        const ADMIN_PASSWORD = 'serinaqu123';
+        // Filled in by the /webapp route
+        const PAYMENT_FORM_URL = '{payment_form_url}';
+        const APP_VERSION = '{app_version}';
 
         // Ad settings
         let adSettings = {};
 
+        // ========================================
+        // TELEMETRY
+        // ========================================
+        
+        // Events are batched as [ms since t0, name, props?] and sent with
+        // sendBeacon every 10 s, at 20 events, and when the page is hidden
+        const telemetry = {
+            t0: Date.now(),
+            session: Math.random().toString(36).slice(2, 10),
+            queue: [],
+            track(name, props) {
+                const event = [Date.now() - this.t0, name];
+                if (props) event.push(props);
+                this.queue.push(event);
+                if (this.queue.length >= 20) this.flush();
+            },
+            flush() {
+                if (this.queue.length === 0) return;
+                const body = JSON.stringify({ t0: this.t0, s: this.session, u: getTelegramUserId(), v: APP_VERSION, e: this.queue });
+                this.queue = [];
+                if (!navigator.sendBeacon || !navigator.sendBeacon('/api/events', body)) {
+                    fetch('/api/events', { method: 'POST', body, keepalive: true }).catch(() => {});
+                }
+            }
+        };
+
+        function track(name, props) {
+            telemetry.track(name, props);
+        }
+
+        setInterval(() => telemetry.flush(), 10000);
+        document.addEventListener('visibilitychange', () => {
+            if (document.visibilityState === 'hidden') telemetry.flush();
+        });
+        window.addEventListener('pagehide', () => telemetry.flush());
+
+        // ========================================
+        // PERFORMANCE (RUM)
+        // ========================================
+        
+        // Timings in ms, sent to /api/rum a few seconds after load and again
+        // when the page is hidden (long tasks and later display measures)
+        const rum = {
+            pending: {},
+            longTasksTotal: 0,
+            add(name, value) {
+                (this.pending[name] = this.pending[name] || []).push(Math.round(value));
+            },
+            flush() {
+                if (this.longTasksTotal) {
+                    this.add('long_tasks_total', this.longTasksTotal);
+                    this.longTasksTotal = 0;
+                }
+                if (Object.keys(this.pending).length === 0) return;
+                const connection = navigator.connection || {};
+                const body = JSON.stringify({
+                    v: APP_VERSION,
+                    dm: navigator.deviceMemory || 0,
+                    hc: navigator.hardwareConcurrency || 0,
+                    ect: connection.effectiveType || '',
+                    m: this.pending
+                });
+                this.pending = {};
+                if (!navigator.sendBeacon || !navigator.sendBeacon('/api/rum', body)) {
+                    fetch('/api/rum', { method: 'POST', body, keepalive: true }).catch(() => {});
+                }
+            }
+        };
+
+        function resourceMetric(url) {
+            if (url.includes('cdn.tailwindcss.com')) return 'res_tailwind';
+            if (url.includes('font-awesome')) return 'res_fontawesome';
+            if (url.includes('telegram-web-app.js')) return 'res_telegram';
+            return null;
+        }
+
+        function collectPageTimings() {
+            const [nav] = performance.getEntriesByType('navigation');
+            if (nav) {
+                rum.add('ttfb', nav.responseStart - nav.startTime);
+                rum.add('dom_content_loaded', nav.domContentLoadedEventEnd - nav.startTime);
+                rum.add('load', nav.loadEventEnd - nav.startTime);
+            }
+            performance.getEntriesByType('paint').forEach(entry => {
+                rum.add(entry.name.replace(/-/g, '_'), entry.startTime);
+            });
+            performance.getEntriesByType('resource').forEach(entry => {
+                const metric = resourceMetric(entry.name);
+                if (metric) rum.add(metric, entry.duration);
+            });
+            rum.flush();
+        }
+
+        // Wraps a render function in performance marks and records the measure
+        function measured(name, fn) {
+            return function (...args) {
+                performance.mark(`${name}:start`);
+                try {
+                    return fn.apply(this, args);
+                } finally {
+                    const measure = performance.measure(name, `${name}:start`);
+                    if (measure) rum.add(name, measure.duration);
+                }
+            };
+        }
+
+        if (window.PerformanceObserver && PerformanceObserver.supportedEntryTypes &&
+                PerformanceObserver.supportedEntryTypes.includes('longtask')) {
+            new PerformanceObserver(list => {
+                list.getEntries().forEach(entry => {
+                    rum.add('long_task', entry.duration);
+                    rum.longTasksTotal += entry.duration;
+                });
+            }).observe({ type: 'longtask', buffered: true });
+        }
+        window.addEventListener('load', () => setTimeout(collectPageTimings, 3000));
+        document.addEventListener('visibilitychange', () => {
+            if (document.visibilityState === 'hidden') rum.flush();
+        });
+
+        // ========================================
+        // MEDIA
+        // ========================================
+        
+        // Variant widths served by /media/<id>?w=<width>&f=<webp|jpeg>
+        const MEDIA_WIDTHS = [160, 320, 480, 640, 960, 1280];
+
+        function isMedia(src) {
+            return typeof src === 'string' && src.startsWith('/media/');
+        }
+
+        function mediaSrcset(src, format) {
+            return MEDIA_WIDTHS.map(width => `${src}?w=${width}&f=${format} ${width}w`).join(', ');
+        }
+
+        // Uploaded media get WebP and JPEG srcsets; other web URLs load lazily
+        // as they are. Anything else (emoji, desktop file paths) gets a placeholder.
+        function mediaImage(src, alt, className, sizes) {
+            if (isMedia(src)) {
+                return `<picture>
+                    <source type="image/webp" srcset="${mediaSrcset(src, 'webp')}" sizes="${sizes}">
+                    <img src="${src}?w=640&f=jpeg" srcset="${mediaSrcset(src, 'jpeg')}" sizes="${sizes}" alt="${alt}" class="${className}" loading="lazy" decoding="async">
+                </picture>`;
+            }
+            if (typeof src === 'string' && /^https?:\/\//.test(src)) {
+                return `<img src="${src}" alt="${alt}" class="${className}" loading="lazy" decoding="async">`;
+            }
+            return `<div class="${className} bg-gray-200 flex items-center justify-center text-5xl">👤</div>`;
+        }
+
+        async function uploadMedia(file) {
+            const form = new FormData();
+            form.append('file', file);
+            const response = await fetch('/api/media', { method: 'POST', headers: authHeaders(), body: form });
+            const result = await response.json();
+            if (!response.ok) {
+                showNotification(`❌ Rasm yuklanmadi: ${result.error}`, 'error');
+                throw new Error(result.error);
+            }
+            return result.url;
+        }
+
+        // ========================================
+        // KEYED LIST RENDERING
+        // ========================================
+        
+        // Each rendered item is remembered by key together with the HTML it was
+        // built from: an unchanged item keeps its DOM node, a changed one is
+        // rebuilt, and nodes are only moved when the order changed
+        function htmlToElement(html) {
+            const template = document.createElement('template');
+            template.innerHTML = html.trim();
+            return template.content.firstElementChild;
+        }
+
+        function renderKeyed(container, items, key, render, after = null) {
+            const previous = container.keyedNodes || new Map();
+            const next = new Map();
+            let anchor = after;
+            for (const item of items) {
+                const id = String(key(item));
+                const html = render(item);
+                let entry = previous.get(id);
+                if (!entry || entry.html !== html) {
+                    if (entry) entry.el.remove();
+                    entry = { el: htmlToElement(html), html };
+                }
+                previous.delete(id);
+                next.set(id, entry);
+                const expected = anchor ? anchor.nextSibling : container.firstChild;
+                if (entry.el !== expected) container.insertBefore(entry.el, expected);
+                anchor = entry.el;
+            }
+            for (const entry of previous.values()) entry.el.remove();
+            container.keyedNodes = next;
+        }
+
+        // Windowed grid with infinite scroll. Items are revealed a page at a
+        // time as the viewport nears the end, and only the rows around the
+        // viewport are in the DOM; full-width spacers stand in for the rows
+        // above and below, sized from the measured row height.
+        class VirtualGrid {
+            constructor(container, key, render, pageSize) {
+                this.container = container;
+                this.key = key;
+                this.render = render;
+                this.pageSize = pageSize;
+                this.items = [];
+                this.revealed = pageSize;
+                this.rowHeight = 0;
+                this.frame = 0;
+                this.top = this.spacer();
+                this.bottom = this.spacer();
+                container.append(this.top, this.bottom);
+                const schedule = () => this.schedule();
+                window.addEventListener('scroll', schedule, { passive: true });
+                window.addEventListener('resize', schedule);
+            }
+
+            spacer() {
+                const el = document.createElement('div');
+                el.style.gridColumn = '1 / -1';
+                el.style.display = 'none';
+                return el;
+            }
+
+            setItems(items, reset = false) {
+                this.items = items;
+                if (reset) this.revealed = this.pageSize;
+                this.update();
+            }
+
+            schedule() {
+                if (!this.frame) {
+                    this.frame = requestAnimationFrame(() => {
+                        this.frame = 0;
+                        this.update();
+                    });
+                }
+            }
+
+            setSpacer(el, rows, gap) {
+                el.style.display = rows > 0 ? 'block' : 'none';
+                el.style.height = `${Math.max(0, rows * this.rowHeight - gap)}px`;
+            }
+
+            update() {
+                const style = getComputedStyle(this.container);
+                const columns = Math.max(1, style.gridTemplateColumns.split(' ').length);
+                const gap = parseFloat(style.rowGap) || 0;
+                // Estimate until a row has been measured
+                const rowHeight = this.rowHeight || 400;
+                const viewTop = -this.container.getBoundingClientRect().top;
+                const overscan = 2;
+                const first = Math.max(0, Math.floor(viewTop / rowHeight) - overscan);
+                const wanted = Math.ceil((viewTop + window.innerHeight) / rowHeight) + overscan;
+                while (wanted * columns > this.revealed && this.revealed < this.items.length) {
+                    this.revealed += this.pageSize;
+                }
+                const rows = Math.ceil(Math.min(this.revealed, this.items.length) / columns);
+                const last = Math.max(0, Math.min(rows, wanted));
+                const start = Math.min(first, Math.max(0, last - 1)) * columns;
+                const end = Math.min(this.items.length, this.revealed, last * columns);
+
+                renderKeyed(this.container, this.items.slice(start, end), this.key, this.render, this.top);
+
+                // Measure the rendered rows; the tallest card sets each row's height
+                if (end > start) {
+                    let bottom = 0;
+                    for (const { el } of this.container.keyedNodes.values()) {
+                        bottom = Math.max(bottom, el.getBoundingClientRect().bottom);
+                    }
+                    const firstTop = this.top.nextElementSibling.getBoundingClientRect().top;
+                    this.rowHeight = (bottom - firstTop + gap) / Math.ceil((end - start) / columns);
+                }
+                this.setSpacer(this.top, start / columns, gap);
+                this.setSpacer(this.bottom, rows - Math.ceil(end / columns), gap);
+            }
+        }
+
         // ========================================
         // NOTIFICATION SYSTEM
         // ========================================
@@ -1896,7 +3305,15 @@ WEBAPP_HTML = '''\
             const member = teamMembers.find(m => m.id === memberId);
             if (!member) return;
 
-            document.getElementById('modalTeamImage').src = member.image;
+            const modalImage = document.getElementById('modalTeamImage');
+            if (isMedia(member.image)) {
+                modalImage.srcset = mediaSrcset(member.image, 'jpeg');
+                modalImage.sizes = '(min-width: 768px) 600px, 100vw';
+                modalImage.src = `${member.image}?w=960&f=jpeg`;
+            } else {
+                modalImage.removeAttribute('srcset');
+                modalImage.src = member.image;
+            }
             document.getElementById('modalTeamName').textContent = member.name;
             document.getElementById('modalTeamRole').textContent = member.role;
             document.getElementById('modalTeamDescription').textContent = member.description;
@@ -1918,6 +3335,7 @@ WEBAPP_HTML = '''\
             }
 
             document.getElementById('teamModal').classList.remove('hidden');
+            track('team_modal_open', { m: memberId });
             showNotification(`👤 ${member.name} haqida batafsil ma'lumot`, 'info');
         }
 
@@ -1962,14 +3380,24 @@ WEBAPP_HTML = '''\
         // ADMIN LOGIN SYSTEM
         // ========================================
         
-        function checkAdminAccess() {
+        // Signed by Telegram; the server checks it on every admin request
+        function telegramInitData() {
+            const tg = window.Telegram && window.Telegram.WebApp;
+            return tg && tg.initData ? tg.initData : '';
+        }
+
+        function authHeaders(headers = {}) {
+            return { ...headers, 'X-Telegram-Init-Data': telegramInitData() };
+        }
+
+        async function checkAdminAccess() {
             isAdmin = false;
-            if (window.Telegram) {
-                const tg = window.Telegram.WebApp;
-                if (tg.initDataUnsafe && tg.initDataUnsafe.user) {
-                    if (tg.initDataUnsafe.user.id.toString() === ADMIN_ID) {
-                        isAdmin = true;
-                    }
+            if (telegramInitData()) {
+                try {
+                    const response = await fetch('/api/me', { headers: authHeaders(), cache: 'no-store' });
+                    isAdmin = response.ok && (await response.json()).admin === true;
+                } catch (e) {
+                    console.warn('Admin huquqi tekshirilmadi:', e);
                 }
             }
             if (isAdmin) {
@@ -2016,8 +3444,7 @@ WEBAPP_HTML = '''\
                 showNotification('❌ Faqat admin e\'lonlarni boshqara oladi!', 'error');
                 return;
             }
-            const list = document.getElementById('campaignsList');
-            list.innerHTML = campaigns.map(campaign => createAdminCampaignItem(campaign)).join('');
+            renderKeyed(document.getElementById('campaignsList'), campaigns, campaign => campaign.id, createAdminCampaignItem);
             document.getElementById('manageCampaignsModal').classList.remove('hidden');
         }
 
@@ -2064,8 +3491,7 @@ WEBAPP_HTML = '''\
                 showNotification('❌ Faqat admin reklamalarni boshqara oladi!', 'error');
                 return;
             }
-            const list = document.getElementById('adsList');
-            list.innerHTML = ads.map(ad => createAdminAdItem(ad)).join('');
+            renderKeyed(document.getElementById('adsList'), ads, ad => ad.id, createAdminAdItem);
             document.getElementById('manageAdsModal').classList.remove('hidden');
         }
 
@@ -2112,8 +3538,7 @@ WEBAPP_HTML = '''\
                 showNotification('❌ Faqat admin jamoani boshqara oladi!', 'error');
                 return;
             }
-            const list = document.getElementById('teamList');
-            list.innerHTML = teamMembers.map(member => createAdminTeamItem(member)).join('');
+            renderKeyed(document.getElementById('teamList'), teamMembers, member => member.id, createAdminTeamItem);
             document.getElementById('manageTeamModal').classList.remove('hidden');
         }
 
@@ -2178,7 +3603,11 @@ WEBAPP_HTML = '''\
                         </div>
                         <div class="mb-4">
                             <label class="block text-sm font-medium mb-2">Rasm URL</label>
-                            <input type="url" name="image" value="${existingMember ? existingMember.image : ''}" class="w-full px-3 py-2 border rounded-lg">
+                            <input type="text" name="image" value="${existingMember ? existingMember.image : ''}" class="w-full px-3 py-2 border rounded-lg">
+                        </div>
+                        <div class="mb-4">
+                            <label class="block text-sm font-medium mb-2">📷 Yoki rasm yuklang</label>
+                            <input type="file" name="photo" accept="image/jpeg,image/png,image/webp" class="w-full px-3 py-2 border rounded-lg">
                         </div>
                         <div class="mb-4">
                             <label class="block text-sm font-medium mb-2">Telegram</label>
@@ -2230,12 +3659,13 @@ WEBAPP_HTML = '''\
                 twitter: formData.get('twitter'),
                 tiktok: formData.get('tiktok')
             };
+            const photo = formData.get('photo');
             const memberData = {
                 id: existingId || Date.now(),
                 name: formData.get('name'),
                 role: formData.get('role'),
                 description: formData.get('description'),
-                image: formData.get('image'),
+                image: photo && photo.size ? await uploadMedia(photo) : formData.get('image'),
                 socials
             };
             
@@ -2245,15 +3675,19 @@ WEBAPP_HTML = '''\
             showNotification('✅ Jamoa a\'zosi saqlandi!', 'success');
         }
 
-        function displayTeam() {
-            const grid = document.getElementById('teamGrid');
-            grid.innerHTML = teamMembers.map(member => createTeamCard(member)).join('');
-        }
+        let teamGrid = null;
+
+        const displayTeam = measured('display_team', function () {
+            if (!teamGrid) {
+                teamGrid = new VirtualGrid(document.getElementById('teamGrid'), member => member.id, createTeamCard, 8);
+            }
+            teamGrid.setItems(teamMembers);
+        });
 
         function createTeamCard(member) {
             return `
                 <div class="team-card" onclick="showTeamModal(${member.id})">
-                    <img src="${member.image}" alt="${member.name}" class="team-image">
+                    ${mediaImage(member.image, member.name, 'team-image', '(min-width: 1024px) 25vw, (min-width: 768px) 50vw, 100vw')}
                     <div class="p-6 text-center">
                         <h3 class="text-xl font-bold mb-2">${member.name}</h3>
                         <p class="text-blue-600 font-semibold mb-4">${member.role}</p>
@@ -2339,6 +3773,10 @@ WEBAPP_HTML = '''\
                                 <span class="text-sm">Shoshilinch e'lon</span>
                             </label>
                         </div>
+                        <div class="mb-4">
+                            <label class="block text-sm font-medium mb-2">📷 Rasm ${existingCampaign && isMedia(existingCampaign.image) ? '(yangisini tanlasangiz almashtiriladi)' : ''}</label>
+                            <input type="file" name="photo" accept="image/jpeg,image/png,image/webp" class="w-full px-3 py-2 border rounded-lg">
+                        </div>
                         <div class="flex gap-3">
                             <button type="submit" class="flex-1 bg-blue-600 text-white py-2 rounded-lg hover:bg-blue-700">
                                 ${isEdit ? '💾 Saqlash' : '📤 Qo\'shish'}
@@ -2359,6 +3797,15 @@ WEBAPP_HTML = '''\
             
             const formData = new FormData(event.target);
             const isEdit = !!existingId;
+            const existing = isEdit ? campaigns.find(c => c.id === existingId) : null;
+            // An uploaded photo replaces the category emoji; an earlier upload is kept
+            const photo = formData.get('photo');
+            let image = getCategoryIcon(formData.get('category'));
+            if (photo && photo.size) {
+                image = await uploadMedia(photo);
+            } else if (existing && isMedia(existing.image)) {
+                image = existing.image;
+            }
             const campaignData = {
                 id: existingId || 'campaign_' + Date.now(),
                 title: formData.get('title'),
@@ -2366,14 +3813,14 @@ WEBAPP_HTML = '''\
                 description: formData.get('description'),
                 targetAmount: parseInt(formData.get('targetAmount')),
                 currentAmount: parseInt(formData.get('currentAmount')) || 0,
-                donors: isEdit ? campaigns.find(c => c.id === existingId).donors : Math.floor(Math.random() * 100) + 10,
+                donors: isEdit ? existing.donors : Math.floor(Math.random() * 100) + 10,
                 daysLeft: parseInt(formData.get('daysLeft')) || 30,
                 urgent: formData.get('urgent') === 'on',
                 cardNumber: formData.get('cardNumber'),
                 cardOwner: formData.get('cardOwner'),
                 contactPhone: formData.get('contactPhone'),
                 contactName: formData.get('contactName'),
-                image: getCategoryIcon(formData.get('category')),
+                image,
                 createdBy: 'Admin',
                 createdAt: new Date().toISOString()
             };
@@ -2431,6 +3878,22 @@ WEBAPP_HTML = '''\
                             <input type="text" name="contact" value="${existingAd ? existingAd.contact : ''}" class="w-full px-3 py-2 border rounded-lg" placeholder="Telefon yoki Telegram">
                         </div>
                         
+                        <div class="mb-4 grid grid-cols-3 gap-2">
+                            <div>
+                                <label class="block text-xs font-medium mb-1">⚖️ Vazn</label>
+                                <input type="number" name="weight" value="${existingAd ? existingAd.weight : 1}" min="0" step="0.1" class="w-full px-2 py-2 border rounded-lg">
+                            </div>
+                            <div>
+                                <label class="block text-xs font-medium mb-1">👤 Kunlik limit</label>
+                                <input type="number" name="frequencyCap" value="${existingAd ? existingAd.frequencyCap : 0}" min="0" class="w-full px-2 py-2 border rounded-lg">
+                            </div>
+                            <div>
+                                <label class="block text-xs font-medium mb-1">📊 Kunlik ko'rish</label>
+                                <input type="number" name="dailyImpressions" value="${existingAd ? existingAd.dailyImpressions : 0}" min="0" class="w-full px-2 py-2 border rounded-lg">
+                            </div>
+                        </div>
+                        <div class="text-xs text-gray-500 -mt-3 mb-4">0 - cheklovsiz. Kunlik limit: bitta foydalanuvchiga necha marta ko'rsatish.</div>
+                        
                         <div class="mb-4">
                             <label class="flex items-center">
                                 <input type="checkbox" name="banner" ${existingAd ? (existingAd.banner ? 'checked' : '') : 'checked'} class="mr-2">
@@ -2467,7 +3930,10 @@ WEBAPP_HTML = '''\
                 contact: formData.get('contact'),
                 showDuration: parseInt(formData.get('showDuration')) || 10,
                 banner: formData.get('banner') === 'on',
-                createdAt: new Date().toISOString()
+                createdAt: new Date().toISOString(),
+                weight: formData.get('weight') === '' ? 1 : parseFloat(formData.get('weight')),
+                frequencyCap: parseInt(formData.get('frequencyCap')) || 0,
+                dailyImpressions: parseInt(formData.get('dailyImpressions')) || 0
             };
             
             await saveToServer('ads', adData);
@@ -2476,6 +3942,43 @@ WEBAPP_HTML = '''\
             showNotification('✅ Reklama saqlandi!', 'success');
         }
 
+        async function showPerformance() {
+            if (!isAdmin) return;
+            let rows = [];
+            try {
+                const response = await fetch('/api/rum/summary?days=7', { headers: authHeaders() });
+                rows = (await response.json()).rows || [];
+            } catch (e) {
+                showNotification('❌ RUM ma\'lumotlari olinmadi', 'error');
+                return;
+            }
+            const modal = document.createElement('div');
+            modal.className = 'fixed inset-0 bg-black bg-opacity-50 flex items-center justify-center z-50 p-4';
+            modal.innerHTML = `
+                <div class="bg-white rounded-2xl p-6 max-w-3xl w-full max-h-96 overflow-y-auto">
+                    <h3 class="text-2xl font-bold mb-4">📈 Foydalanuvchilardagi tezlik (7 kun, ms)</h3>
+                    ${rows.length === 0 ? '<p class="text-gray-600">Hali ma\'lumot yo\'q.</p>' : `
+                    <table class="w-full text-sm">
+                        <thead><tr class="text-left border-b">
+                            <th class="py-1">Ko'rsatkich</th><th>Qurilma</th><th>Versiya</th>
+                            <th class="text-right">n</th><th class="text-right">p50</th><th class="text-right">p75</th><th class="text-right">p95</th>
+                        </tr></thead>
+                        <tbody>
+                            ${rows.map(row => `<tr class="border-b">
+                                <td class="py-1">${row.metric}</td><td>${row.device_class}</td><td>${row.app_version}</td>
+                                <td class="text-right">${row.count}</td><td class="text-right">${row.p50}</td>
+                                <td class="text-right">${row.p75}</td><td class="text-right font-bold">${row.p95}</td>
+                            </tr>`).join('')}
+                        </tbody>
+                    </table>`}
+                    <button type="button" onclick="closeModal()" class="mt-4 w-full bg-gray-300 text-gray-700 py-2 rounded-lg hover:bg-gray-400">
+                        ❌ Yopish
+                    </button>
+                </div>
+            `;
+            document.body.appendChild(modal);
+        }
+
         function showAdSettings() {
             if (!isAdmin) return;
             
@@ -2539,12 +4042,25 @@ WEBAPP_HTML = '''\
         // BANNER AD SYSTEM
         // ========================================
         
-        function showRandomAd() {
-            const bannerAds = ads.filter(ad => ad.banner);
-            if (bannerAds.length === 0) return;
-            
-            const randomAd = bannerAds[Math.floor(Math.random() * bannerAds.length)];
-            showBannerAd(randomAd);
+        function getTelegramUserId() {
+            const tg = window.Telegram && window.Telegram.WebApp;
+            return tg && tg.initDataUnsafe && tg.initDataUnsafe.user ? tg.initDataUnsafe.user.id.toString() : '';
+        }
+
+        // The server picks the ad (weights, frequency caps, pacing) and counts the impression
+        async function showRandomAd() {
+            try {
+                const response = await fetch(`/api/ads/next?user_id=${encodeURIComponent(getTelegramUserId())}`);
+                const { ad } = await response.json();
+                if (ad) showBannerAd(ad);
+            } catch (e) {
+                console.error('Reklama olinmadi:', e);
+            }
+        }
+
+        function recordAdClick(adId) {
+            track('banner_click', { ad: adId });
+            navigator.sendBeacon(`/api/ads/${encodeURIComponent(adId)}/click`);
         }
 
         function showAdOverlay(ad) {
@@ -2570,6 +4086,7 @@ WEBAPP_HTML = '''\
             
             contentArea.innerHTML = content;
             overlay.classList.remove('hidden');
+            track('ad_overlay_shown', { ad: ad.id });
             
             let timeLeft = adSettings.overlayDuration;
             timer.textContent = timeLeft;
@@ -2589,6 +4106,11 @@ WEBAPP_HTML = '''\
             }, 1000);
         }
 
+        function skipAdOverlay() {
+            track('ad_overlay_skipped');
+            closeAdOverlay();
+        }
+
         function closeAdOverlay() {
             document.getElementById('adOverlay').classList.add('hidden');
             document.getElementById('adSkipBtn').classList.add('hidden');
@@ -2601,7 +4123,7 @@ WEBAPP_HTML = '''\
             const bannerText = document.getElementById('bannerAdText');
             
             if (ad.linkUrl) {
-                bannerText.innerHTML = `<a href="${ad.linkUrl}" target="_blank" rel="noopener noreferrer" class="text-white hover:text-yellow-200 transition-colors">${ad.title || adSettings.bannerText}</a>`;
+                bannerText.innerHTML = `<a href="${ad.linkUrl}" target="_blank" rel="noopener noreferrer" onclick="recordAdClick('${ad.id}')" class="text-white hover:text-yellow-200 transition-colors">${ad.title || adSettings.bannerText}</a>`;
             } else {
                 bannerText.textContent = ad.title || adSettings.bannerText;
             }
@@ -2622,27 +4144,37 @@ WEBAPP_HTML = '''\
         // CAMPAIGN SYSTEM
         // ========================================
 
-        function displayCampaigns() {
-            const grid = document.getElementById('campaignsGrid');
+        let campaignsGrid = null;
+
+        // reset: start again from the first page (a new filter)
+        const displayCampaigns = measured('display_campaigns', function (reset = false) {
+            if (!campaignsGrid) {
+                campaignsGrid = new VirtualGrid(document.getElementById('campaignsGrid'), campaign => campaign.id,
+                                                createCampaignCard, 12);
+            }
             let filteredCampaigns = campaigns;
             
             if (currentFilter !== 'all') {
                 filteredCampaigns = campaigns.filter(campaign => campaign.category === currentFilter);
             }
             
-            grid.innerHTML = filteredCampaigns.map(campaign => createCampaignCard(campaign)).join('');
-        }
+            campaignsGrid.setItems(filteredCampaigns, reset);
+        });
 
         function createCampaignCard(campaign) {
             const progress = (campaign.currentAmount / campaign.targetAmount * 100).toFixed(1);
             const urgentBadge = campaign.urgent ? '<span class="absolute top-4 right-4 bg-red-500 text-white text-xs px-3 py-1 rounded-full font-medium">Shoshilinch</span>' : '';
+            const hasPhoto = isMedia(campaign.image);
+            // The fixed aspect box keeps the card height stable while the photo loads
+            const photo = hasPhoto ? `<div class="aspect-video bg-gray-100">${mediaImage(campaign.image, campaign.title, 'w-full h-full object-cover', '(min-width: 1024px) 33vw, (min-width: 768px) 50vw, 100vw')}</div>` : '';
             
             return `
                 <div class="bg-white rounded-2xl shadow-xl overflow-hidden card-hover relative mobile-card">
+                    ${photo}
                     ${urgentBadge}
                     <div class="p-6 md:p-8">
                         <div class="flex items-center mb-6">
-                            <div class="text-4xl md:text-5xl mr-4">${campaign.image}</div>
+                            <div class="text-4xl md:text-5xl mr-4">${hasPhoto ? getCategoryIcon(campaign.category) : campaign.image}</div>
                             <div>
                                 <h3 class="text-xl md:text-2xl font-bold text-gray-800 mb-2">${campaign.title}</h3>
                                 <div class="flex items-center space-x-2">
@@ -2691,8 +4223,9 @@ WEBAPP_HTML = '''\
         }
 
         function filterCampaigns(category) {
+            track('filter_click', { c: category });
             currentFilter = category;
-            displayCampaigns();
+            displayCampaigns(true);
             
             document.querySelectorAll('.filter-btn').forEach(btn => {
                 btn.classList.remove('bg-gradient-to-r', 'from-blue-600', 'to-purple-600', 'text-white');
@@ -2711,6 +4244,13 @@ WEBAPP_HTML = '''\
             showNotification(`🔍 ${categoryName} ko'rsatilmoqda`, 'info');
         }
 
+        function donateToCharity(campaignId) {
+            track('donate_click', { c: campaignId });
+            telemetry.flush();
+            const userId = getTelegramUserId() || 'guest';
+            window.location.href = `${PAYMENT_FORM_URL}?user_id=${encodeURIComponent(userId)}&campaign_id=${encodeURIComponent(campaignId)}`;
+        }
+
         function getCategoryIcon(category) {
             const icons = {
                 'tibbiyot': '🏥',
@@ -2755,6 +4295,177 @@ WEBAPP_HTML = '''\
             document.getElementById('completedCampaigns').textContent = completedCampaigns;
         }
 
+        // ========================================
+        // DATA CACHE & SYNC
+        // ========================================
+        
+        // The last campaigns/ads/team/settings snapshot is kept in IndexedDB
+        // with the server data version it came from. Startup renders it right
+        // away, then /api/data?since=<version> (If-None-Match) answers 304 or
+        // sends only the rows that changed.
+        let dataVersion = null;
+
+        const dataCache = {
+            db: null,
+            open() {
+                if (!this.db) {
+                    this.db = new Promise((resolve, reject) => {
+                        const req = indexedDB.open('ehson-data', 1);
+                        req.onupgradeneeded = () => req.result.createObjectStore('snapshots');
+                        req.onsuccess = () => resolve(req.result);
+                        req.onerror = () => reject(req.error);
+                    });
+                }
+                return this.db;
+            },
+            async get() {
+                const db = await this.open();
+                return new Promise((resolve, reject) => {
+                    const req = db.transaction('snapshots').objectStore('snapshots').get('current');
+                    req.onsuccess = () => resolve(req.result || null);
+                    req.onerror = () => reject(req.error);
+                });
+            },
+            async put(snapshot) {
+                const db = await this.open();
+                return new Promise((resolve, reject) => {
+                    const tx = db.transaction('snapshots', 'readwrite');
+                    tx.objectStore('snapshots').put(snapshot, 'current');
+                    tx.oncomplete = () => resolve();
+                    tx.onerror = () => reject(tx.error);
+                });
+            }
+        };
+
+        function showStorageIndicator(text, hideAfterMs) {
+            const indicator = document.getElementById('storageIndicator');
+            indicator.textContent = text;
+            indicator.style.display = 'block';
+            clearTimeout(indicator.hideTimer);
+            if (hideAfterMs) {
+                indicator.hideTimer = setTimeout(() => { indicator.style.display = 'none'; }, hideAfterMs);
+            }
+        }
+
+        function hideStorageIndicator() {
+            document.getElementById('storageIndicator').style.display = 'none';
+        }
+
+        function applySnapshot(snapshot) {
+            dataVersion = snapshot.version;
+            campaigns = snapshot.campaigns;
+            ads = snapshot.ads;
+            teamMembers = snapshot.team;
+            adSettings = snapshot.settings || {};
+            displayCampaigns();
+            displayTeam();
+            updateStats();
+            if (isAdmin) updateAdminStats();
+        }
+
+        // Replace changed rows in place, drop deleted ones, append new ones
+        function mergeChanges(items, change) {
+            if (!change) return items;
+            const deleted = new Set(change.delete.map(String));
+            const updated = new Map(change.upsert.map(item => [String(item.id), item]));
+            const merged = [];
+            for (const item of items) {
+                const id = String(item.id);
+                if (deleted.has(id)) continue;
+                if (updated.has(id)) {
+                    merged.push(updated.get(id));
+                    updated.delete(id);
+                } else {
+                    merged.push(item);
+                }
+            }
+            return merged.concat([...updated.values()]);
+        }
+
+        async function revalidateData() {
+            const headers = {};
+            let url = '/api/data';
+            if (dataVersion !== null) {
+                url += `?since=${dataVersion}`;
+                headers['If-None-Match'] = `"v${dataVersion}"`;
+            }
+            const response = await fetch(url, { headers, cache: 'no-store' });
+            if (response.status === 304) return false;
+            if (!response.ok) throw new Error(`/api/data: ${response.status}`);
+            const data = await response.json();
+            const snapshot = data.full ? {
+                version: data.version, campaigns: data.campaigns, ads: data.ads, team: data.team, settings: data.settings
+            } : {
+                version: data.version,
+                campaigns: mergeChanges(campaigns, data.campaigns),
+                ads: mergeChanges(ads, data.ads),
+                team: mergeChanges(teamMembers, data.team),
+                settings: data.settings || adSettings
+            };
+            applySnapshot(snapshot);
+            dataCache.put(snapshot).catch(e => console.warn('Kesh saqlanmadi:', e));
+            return true;
+        }
+
+        async function loadData() {
+            let cached = null;
+            try {
+                cached = await dataCache.get();
+            } catch (e) {
+                console.warn('IndexedDB ishlamadi:', e);
+            }
+            if (cached) {
+                applySnapshot(cached);
+                showStorageIndicator('📦 Saqlangan nusxa ko\'rsatilmoqda, yangilanmoqda...');
+            }
+            try {
+                const changed = await revalidateData();
+                if (cached && changed) {
+                    showStorageIndicator('🔄 Ma\'lumotlar yangilandi', 2000);
+                } else {
+                    hideStorageIndicator();
+                }
+            } catch (e) {
+                console.error('Ma\'lumotlar yuklanmadi:', e);
+                if (cached) {
+                    showStorageIndicator('📴 Internet yo\'q: saqlangan nusxa ko\'rsatilmoqda');
+                } else {
+                    showNotification('❌ Ma\'lumotlarni yuklab bo\'lmadi', 'error');
+                }
+            }
+        }
+
+        async function loadAdminData() {
+            try {
+                await revalidateData();
+            } catch (e) {
+                console.error('Ma\'lumotlar yangilanmadi:', e);
+            }
+        }
+
+        async function saveToServer(entity, data) {
+            const response = await fetch(`/api/${entity}`, {
+                method: 'POST',
+                headers: authHeaders({ 'Content-Type': 'application/json' }),
+                body: JSON.stringify(data)
+            });
+            if (!response.ok) {
+                showNotification('❌ Saqlab bo\'lmadi!', 'error');
+                throw new Error(`${entity}: ${response.status}`);
+            }
+        }
+
+        async function deleteFromServer(entity, id) {
+            const response = await fetch(`/api/${entity}/${encodeURIComponent(id)}`, {
+                method: 'DELETE',
+                headers: authHeaders()
+            });
+            if (!response.ok) {
+                showNotification('❌ O\'chirib bo\'lmadi!', 'error');
+                throw new Error(`${entity}/${id}: ${response.status}`);
+            }
+        }
+
         // ========================================
         // UTILITY FUNCTIONS
         // ========================================
@@ -2825,20 +4536,322 @@ WEBAPP_HTML = '''\
             showNotification('🆘 Yordam uchun admin bilan bog\'lanish ochildi!', 'success');
         }
 
+        // ========================================
+        // INITIALIZATION
+        // ========================================
+
+        if ('serviceWorker' in navigator) {
+            navigator.serviceWorker.register('/sw.js', { updateViaCache: 'none' })
+                .catch(e => console.warn('Service worker ro\'yxatdan o\'tmadi:', e));
+        }
+
+        document.addEventListener('DOMContentLoaded', async () => {
+            await checkAdminAccess();
+            await loadData();
+            showRandomAd();
+        });
+
     </script>
 </body>
 </html>
 '''
 
+# The page only depends on configuration, so it is rendered once
+WEBAPP_PAGE = (WEBAPP_HTML.replace('{base_url}', BASE_URL)
+               .replace('{payment_form_url}', PAYMENT_FORM_URL).replace('{app_version}', APP_VERSION))
+
 @app.route('/webapp')
 def webapp():
-    html = WEBAPP_HTML.replace('{admin_id}', ADMIN_ID).replace('{base_url}', BASE_URL)
-    return make_response(html)
+    return make_response(WEBAPP_PAGE)
+
+# App shell caching. /sw.js embeds the asset manifest, so any change to the
+# page or its CDN assets changes the worker's bytes; the browser installs the
+# new worker, which fills a fresh versioned cache and only then deletes the
+# old ones. The payment page is never cached (each load opens a payment).
+CDN_ASSET = re.compile(r'<script src="(https://[^"]+)"|<link href="(https://[^"]+)" rel="stylesheet"')
+
+def build_asset_manifest() -> dict:
+    assets = []
+    for html in (WEBAPP_HTML, PAYMENT_HTML):
+        for script, style in CDN_ASSET.findall(html):
+            if (script or style) not in assets:
+                assets.append(script or style)
+    shell = ['/webapp']
+    digest = hashlib.sha256(json.dumps([APP_VERSION, WEBAPP_PAGE, shell, assets]).encode()).hexdigest()
+    return {'version': digest[:16], 'shell': shell, 'assets': assets}
+
+ASSET_MANIFEST = build_asset_manifest()
+
+SERVICE_WORKER_JS = r'''// E-Ehson app shell worker
+const MANIFEST = {manifest};
+const CACHE_PREFIX = 'ehson-shell-';
+const CACHE_NAME = CACHE_PREFIX + MANIFEST.version;
+const CDN_HOSTS = MANIFEST.assets.map(url => new URL(url).host);
+
+self.addEventListener('install', event => {
+    event.waitUntil((async () => {
+        const cache = await caches.open(CACHE_NAME);
+        try {
+            for (const url of MANIFEST.shell.concat(MANIFEST.assets)) {
+                const sameOrigin = new URL(url, self.location.origin).origin === self.location.origin;
+                const response = await fetch(new Request(url, { mode: sameOrigin ? 'same-origin' : 'no-cors', cache: 'reload' }));
+                // CDN responses are opaque (status 0); the page loads them without CORS too
+                if (!response.ok && response.type !== 'opaque') throw new Error(`${url}: ${response.status}`);
+                await cache.put(url, response);
+            }
+        } catch (e) {
+            // Never leave a half-filled cache; the current worker keeps serving
+            await caches.delete(CACHE_NAME);
+            throw e;
+        }
+        await self.skipWaiting();
+    })());
+});
+
+self.addEventListener('activate', event => {
+    event.waitUntil((async () => {
+        const names = await caches.keys();
+        await Promise.all(names.filter(name => name.startsWith(CACHE_PREFIX) && name !== CACHE_NAME)
+            .map(name => caches.delete(name)));
+        await self.clients.claim();
+    })());
+});
+
+self.addEventListener('fetch', event => {
+    const request = event.request;
+    if (request.method !== 'GET') return;
+    const url = new URL(request.url);
+    const shell = url.origin === self.location.origin && MANIFEST.shell.includes(url.pathname);
+    // API calls, the payment form and callbacks go straight to the network
+    if (!shell && !CDN_HOSTS.includes(url.host)) return;
+    event.respondWith(cacheFirst(request, shell));
+});
+
+async function cacheFirst(request, shell) {
+    const cache = await caches.open(CACHE_NAME);
+    // Telegram appends launch parameters to the shell URL
+    const cached = await cache.match(request, { ignoreSearch: shell });
+    if (cached) return cached;
+    const response = await fetch(request);
+    // Font files referenced by the Font Awesome CSS are cached on first use
+    if (!shell && (response.ok || response.type === 'opaque')) {
+        cache.put(request, response.clone());
+    }
+    return response;
+}
+'''.replace('{manifest}', json.dumps(ASSET_MANIFEST))
+
+@app.route('/asset-manifest.json')
+def asset_manifest():
+    response = jsonify(ASSET_MANIFEST)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/sw.js')
+def service_worker():
+    response = Response(SERVICE_WORKER_JS, mimetype='text/javascript')
+    # Always revalidated, so a new manifest is picked up on the next open
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['Service-Worker-Allowed'] = '/'
+    return response
 
 # aiogram bot setup
-bot = Bot(token=BOT_TOKEN)
+if TELEGRAM_API_URL:
+    logger.info(f"Bot API server: {TELEGRAM_API_URL}")
+    bot = Bot(token=BOT_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)))
+else:
+    bot = Bot(token=BOT_TOKEN)
 dp = Dispatcher(storage=MemoryStorage())
 
+# Update recording for replay.py benchmarks
+ANONYMIZED_FIELDS = ('username', 'last_name', 'phone_number')
+# Required by the Bot API schema, so replaced instead of dropped
+PLACEHOLDER_FIELDS = {'first_name': 'User', 'title': 'Chat'}
+
+class UpdateRecorder(BaseMiddleware):
+    """Outer middleware that appends every update to a gzipped JSONL file.
+
+    User and chat ids are replaced with stable pseudonyms (same real id ->
+    same fake id within one salt) and names are dropped or replaced, so
+    recordings keep the traffic shape without personal data. Compression
+    and file I/O run on a writer thread; the event loop only serializes
+    and enqueues.
+    """
+
+    def __init__(self, path: str, salt: Optional[str] = None):
+        self.path = path
+        self.salt = (salt or uuid.uuid4().hex).encode()
+        self.queue = queue.Queue(maxsize=10000)
+        self.dropped = 0
+        self.writer = threading.Thread(target=self._write_loop, name="update-recorder", daemon=True)
+        self.writer.start()
+
+    def pseudonym(self, real_id: int) -> int:
+        digest = hashlib.sha256(self.salt + str(real_id).encode()).digest()
+        pseudo = int.from_bytes(digest[:5], 'big') + 1
+        return -pseudo if real_id < 0 else pseudo
+
+    def anonymize(self, value):
+        if isinstance(value, dict):
+            result = {}
+            for key, item in value.items():
+                if key in ANONYMIZED_FIELDS:
+                    continue
+                if key in PLACEHOLDER_FIELDS:
+                    result[key] = PLACEHOLDER_FIELDS[key]
+                    continue
+                if key in ('id', 'user_id', 'chat_id') and isinstance(item, int):
+                    result[key] = self.pseudonym(item)
+                else:
+                    result[key] = self.anonymize(item)
+            return result
+        if isinstance(value, list):
+            return [self.anonymize(item) for item in value]
+        return value
+
+    def _write_loop(self):
+        with gzip.open(self.path, 'at', encoding='utf-8') as f:
+            while True:
+                line = self.queue.get()
+                if line is None:
+                    break
+                f.write(line)
+                if self.queue.empty():
+                    f.flush()
+
+    def close(self):
+        self.queue.put(None)
+        self.writer.join(timeout=5)
+
+    async def __call__(self, handler, event, data):
+        try:
+            update = self.anonymize(event.model_dump(mode="json", exclude_none=True))
+            self.queue.put_nowait(json.dumps({"ts": time.time(), "update": update}, ensure_ascii=False) + "\n")
+        except queue.Full:
+            self.dropped += 1
+        except Exception as e:
+            logger.error(f"Update yozib olishda xato: {e}")
+        return await handler(event, data)
+
+update_recorder = None
+if UPDATE_RECORD_PATH:
+    update_recorder = UpdateRecorder(UPDATE_RECORD_PATH, os.getenv("UPDATE_RECORD_SALT"))
+    dp.update.outer_middleware(update_recorder)
+    logger.info(f"Update'lar yozib olinmoqda: {UPDATE_RECORD_PATH}")
+    metrics.gauge('ehson_update_recorder_queue_depth', 'Updates waiting to be written by the recorder',
+                  callback=lambda: {(): update_recorder.queue.qsize()})
+
+class HandlerMetrics(BaseMiddleware):
+    """Inner middleware: per-handler latency into UPDATE_HANDLER_SECONDS"""
+
+    async def __call__(self, handler, event, data):
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            elapsed = time.perf_counter() - started
+            callback = getattr(data.get('handler'), 'callback', None)
+            name = getattr(callback, '__name__', 'unknown')
+            UPDATE_HANDLER_SECONDS.observe(elapsed, name)
+            timing = update_timing.get()
+            if timing is not None:
+                timing['handler'] = name
+                timing['handler_seconds'] = elapsed
+
+dp.message.middleware(HandlerMetrics())
+dp.callback_query.middleware(HandlerMetrics())
+
+# Slow update log: updates over SLOW_UPDATE_MS, with a redacted payload and
+# where the time went (handler, DB, Bot API, the rest = middleware/filters)
+SLOW_UPDATE_MS = float(os.getenv("SLOW_UPDATE_MS", "500"))
+# Written to SLOW_UPDATE_LOG by the logging listener (see setup_logging side_logs)
+slow_logger = logging.getLogger("ehson.slow")
+slow_logger.setLevel(logging.INFO)
+
+# Reply keyboard texts and commands are kept; any other free text is replaced by its length
+KNOWN_TEXTS = {"💝 Xayriya Qilish", "📜 To'lovlar Tarixi", "E'lonlar", "Biz haqimizda", "Loyiha Jamoasi", "Aloqa", "Maxfiylik"}
+REDACTED_FIELDS = ('username', 'first_name', 'last_name', 'phone_number', 'title', 'caption', 'query')
+
+def redact_update(value):
+    if isinstance(value, dict):
+        result = {}
+        for key, item in value.items():
+            if key in REDACTED_FIELDS and isinstance(item, str):
+                result[key] = '***'
+            elif key == 'text' and isinstance(item, str) and item not in KNOWN_TEXTS and not item.startswith('/'):
+                result[key] = f"<{len(item)} chars>"
+            else:
+                result[key] = redact_update(item)
+        return result
+    if isinstance(value, list):
+        return [redact_update(item) for item in value]
+    return value
+
+class BotApiTimer(BaseRequestMiddleware):
+    """Session middleware: Bot API call latency, attributed to the current update"""
+
+    async def __call__(self, make_request, bot, method):
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        finally:
+            elapsed = time.perf_counter() - started
+            name = type(method).__name__
+            BOT_API_SECONDS.observe(elapsed, name)
+            timing = update_timing.get()
+            if timing is not None:
+                timing['api_seconds'] += elapsed
+                timing['api_calls'].append((name, round(elapsed * 1000, 1)))
+
+class UpdateTimer(BaseMiddleware):
+    """Outer middleware: end-to-end update time and the slow update log"""
+
+    async def __call__(self, handler, event, data):
+        timing = {'handler': None, 'handler_seconds': 0.0, 'db_seconds': 0.0, 'db_calls': 0,
+                  'api_seconds': 0.0, 'api_calls': []}
+        token = update_timing.set(timing)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            elapsed = time.perf_counter() - started
+            update_timing.reset(token)
+            event_type = getattr(event, 'event_type', 'unknown')
+            UPDATE_SECONDS.observe(elapsed, event_type)
+            if elapsed * 1000 >= SLOW_UPDATE_MS:
+                self.log_slow(event, event_type, elapsed, timing)
+
+    @staticmethod
+    def log_slow(event, event_type, elapsed, timing):
+        try:
+            payload = redact_update(event.model_dump(mode="json", exclude_none=True))
+        except Exception:
+            payload = None
+        handler_ms = timing['handler_seconds'] * 1000
+        db_ms = timing['db_seconds'] * 1000
+        api_ms = timing['api_seconds'] * 1000
+        slow_logger.info(json.dumps({
+            'time': datetime.now().isoformat(),
+            'update_id': getattr(event, 'update_id', None),
+            'event': event_type,
+            'handler': timing['handler'],
+            'total_ms': round(elapsed * 1000, 1),
+            'handler_ms': round(handler_ms, 1),
+            'db_ms': round(db_ms, 1),
+            'db_calls': timing['db_calls'],
+            'bot_api_ms': round(api_ms, 1),
+            'bot_api_calls': timing['api_calls'],
+            # Handler CPU and anything the handler awaited besides DB/API
+            'other_handler_ms': round(max(0.0, handler_ms - db_ms - api_ms), 1),
+            'outside_handler_ms': round(max(0.0, (elapsed - timing['handler_seconds']) * 1000), 1),
+            'payload': payload,
+        }, ensure_ascii=False))
+
+dp.update.outer_middleware(UpdateTimer())
+bot.session.middleware(BotApiTimer())
+metrics.gauge('ehson_bot_loop_tasks', 'Tasks alive on the bot event loop',
+              callback=lambda: {(): len(asyncio.all_tasks(bot_loop))} if bot_loop is not None else {})
+
 def main_keyboard() -> ReplyKeyboardMarkup:
     kb = ReplyKeyboardBuilder()
     kb.button(text="💝 Xayriya Qilish")
@@ -2856,16 +4869,22 @@ webapp_keyboard = InlineKeyboardMarkup(inline_keyboard=[
 ])
 
 @dp.message(Command("start"))
-async def start(message: types.Message):
+async def start(message: types.Message, command: CommandObject):
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = db_connect()
         c = conn.cursor()
         c.execute("INSERT OR IGNORE INTO users (user_id, username, first_name, created_at) VALUES (?, ?, ?, ?)",
                   (str(message.from_user.id), message.from_user.username or "", message.from_user.first_name or "", datetime.now().isoformat()))
         conn.commit()
         conn.close()
         await message.answer("E-Ehson Professional ga xush kelibsiz!", reply_markup=main_keyboard())
-        await message.answer("Platformani oching:", reply_markup=webapp_keyboard)
+        # t.me/<bot>?start=donate_<campaign id> from channel posts: show that campaign
+        payload = command.args or ""
+        found = get_campaigns([payload[len("donate_"):]]) if payload.startswith("donate_") else []
+        if found:
+            await send_campaign_card(message.chat.id, found[0], donate_keyboard(found[0]['id'], str(message.from_user.id)))
+        else:
+            await message.answer("Platformani oching:", reply_markup=webapp_keyboard)
     except Exception as e:
         logger.error(f"Start command xatosi: {e}")
         await message.answer("Xatolik yuz berdi. Iltimos, qayta urinib ko'ring.")
@@ -2878,9 +4897,10 @@ async def donate(message: types.Message):
 async def history(message: Message):
     try:
         user_id = str(message.from_user.id)
-        conn = sqlite3.connect(DB_PATH)
+        conn = db_connect()
         c = conn.cursor()
-        c.execute("SELECT amount, status, created_at FROM payments WHERE user_id = ?", (user_id,))
+        # Unfinished payment_form sessions are not history yet
+        c.execute("SELECT amount, status, created_at FROM payments WHERE user_id = ? AND status NOT IN ('pending', 'prepared')", (user_id,))
         rows = c.fetchall()
         conn.close()
         if not rows:
@@ -2906,7 +4926,7 @@ async def test_payment(message: types.Message):
         payment_id = str(uuid.uuid4())
         click_trans_id = str(uuid.uuid4())
         
-        conn = sqlite3.connect(DB_PATH)
+        conn = db_connect()
         c = conn.cursor()
         c.execute("INSERT OR REPLACE INTO payments (payment_id, user_id, amount, status, click_trans_id, created_at) VALUES (?, ?, ?, ?, ?, ?)",
                   (payment_id, user_id, test_amount, "success", click_trans_id, datetime.now().isoformat()))
@@ -2919,31 +4939,594 @@ async def test_payment(message: types.Message):
         logger.error(f"Test payment xatosi: {e}")
         await message.answer("Test to'lovi qo'shishda xatolik yuz berdi.")
 
-async def send_payment_confirmation(user_id: int, amount: float, status: str):
+async def send_payment_confirmation(user_id: int, amount: float, status: str, hop: Optional[tracing.Span] = None):
+    parent = None
+    if hop is not None:
+        hop.end()
+        parent = (hop.trace_id, hop.parent_id)
     text = f"Siz {amount} so'm to'lov qildingiz. Status: {'✅ Muvaffaqiyatli' if status == 'success' else '❌ Bekor qilingan'}"
+    started = time.perf_counter()
+    with tracer.span("telegram.send_message", parent=parent, user_id=user_id) as span:
+        try:
+            await bot.send_message(user_id, text)
+            NOTIFICATION_SECONDS.observe(time.perf_counter() - started, "sent")
+            logger.info(f"Confirmation sent to user {user_id}")
+        except Exception as e:
+            NOTIFICATION_SECONDS.observe(time.perf_counter() - started, type(e).__name__)
+            span.error(f"{type(e).__name__}: {e}")
+            logger.error(f"Xabar yuborishda xato: {e}")
+
+# Campaign photos sent in chats: the 1280px JPEG variant of the campaign's media
+TELEGRAM_PHOTO_WIDTH = 1280
+TELEGRAM_FILES = metrics.counter('ehson_telegram_files_total', 'Photo sends by file_id cache outcome', ('outcome',))
+
+class TelegramFileRegistry:
+    """Uploads each asset to Telegram once and reuses the returned file_id.
+
+    Entries are keyed by a hash of the bytes sent, so a changed asset misses
+    and is uploaded again; its old entry is dropped then. A file_id Telegram
+    no longer accepts is forgotten and the bytes are re-uploaded.
+    """
+
+    def __init__(self):
+        self._file_ids = None  # content hash -> file_id, loaded on first use
+        self._hashes = {}  # (media id, size, inode) -> content hash
+        self._locks = {}
+
+    def _load(self):
+        conn = db_connect()
+        self._file_ids = dict(conn.execute("SELECT content_hash, file_id FROM telegram_files").fetchall())
+        conn.close()
+
+    def _resolve(self, media_id: str):
+        """(content hash, bytes); bytes are only read when the file has not been hashed yet"""
+        f, _ = media_store.open_variant(media_id, TELEGRAM_PHOTO_WIDTH, 'jpeg')
+        with f:
+            st = os.fstat(f.fileno())
+            # Not mtime: cache hits touch it. A regenerated variant gets a new inode.
+            key = (media_id, st.st_size, st.st_ino)
+            digest = self._hashes.get(key)
+            if digest is not None:
+                return digest, None
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()
+        self._hashes[key] = digest
+        return digest, data
+
+    def _read(self, media_id: str) -> bytes:
+        f, _ = media_store.open_variant(media_id, TELEGRAM_PHOTO_WIDTH, 'jpeg')
+        with f:
+            return f.read()
+
+    def _remember(self, digest: str, asset: str, file_id: str):
+        conn = db_connect()
+        stale = [row[0] for row in conn.execute(
+            "SELECT content_hash FROM telegram_files WHERE asset = ? AND content_hash != ?", (asset, digest))]
+        conn.execute("DELETE FROM telegram_files WHERE asset = ? AND content_hash != ?", (asset, digest))
+        conn.execute("""INSERT INTO telegram_files VALUES (?, ?, ?, ?)
+                        ON CONFLICT (content_hash) DO UPDATE SET file_id = excluded.file_id,
+                        asset = excluded.asset, uploaded_at = excluded.uploaded_at""",
+                     (digest, file_id, asset, datetime.now().isoformat()))
+        conn.commit()
+        conn.close()
+        for old in stale:
+            self._file_ids.pop(old, None)
+        self._file_ids[digest] = file_id
+
+    def _forget(self, digest: str):
+        self._file_ids.pop(digest, None)
+        conn = db_connect()
+        conn.execute("DELETE FROM telegram_files WHERE content_hash = ?", (digest,))
+        conn.commit()
+        conn.close()
+
+    async def send_photo(self, chat_id, media_id: str, **kwargs) -> Message:
+        if self._file_ids is None:
+            self._load()
+        digest, data = await asyncio.to_thread(self._resolve, media_id)
+        asset = f"media:{media_id}:{TELEGRAM_PHOTO_WIDTH}.jpeg"
+        # One upload per asset even when several chats are sent to at once
+        async with self._locks.setdefault(digest, asyncio.Lock()):
+            file_id = self._file_ids.get(digest)
+            if file_id:
+                try:
+                    message = await bot.send_photo(chat_id, file_id, **kwargs)
+                    TELEGRAM_FILES.inc('reused')
+                    return message
+                except TelegramBadRequest as e:
+                    if 'file' not in e.message.lower():
+                        raise
+                    logger.warning(f"Telegram file_id rad etildi ({asset}), qayta yuklanadi: {e.message}")
+                    TELEGRAM_FILES.inc('stale')
+                    self._forget(digest)
+            if data is None:
+                data = await asyncio.to_thread(self._read, media_id)
+            message = await bot.send_photo(chat_id, BufferedInputFile(data, filename=f"{media_id}.jpg"), **kwargs)
+            self._remember(digest, asset, message.photo[-1].file_id)
+            TELEGRAM_FILES.inc('uploaded')
+            return message
+
+telegram_files = TelegramFileRegistry()
+
+def campaign_media_id(campaign: dict) -> Optional[str]:
+    image = campaign.get('image') or ''
+    return image[len('/media/'):] if image.startswith('/media/') else None
+
+def format_amount(amount) -> str:
+    return f"{amount or 0:,.0f}".replace(',', ' ')
+
+def campaign_caption(campaign: dict) -> str:
+    target = campaign['targetAmount'] or 0
+    progress = (campaign['currentAmount'] or 0) / target * 100 if target else 0
+    icon = '' if campaign_media_id(campaign) or not campaign['image'] else f"{campaign['image']} "
+    lines = [f"{icon}{campaign['title']}"]
+    if campaign['urgent']:
+        lines[0] += " 🔴 Shoshilinch"
+    lines += [
+        "",
+        campaign['description'],
+        "",
+        f"💰 Yig'ildi: {format_amount(campaign['currentAmount'])} / {format_amount(target)} so'm ({progress:.1f}%)",
+        f"👥 {campaign['donors']} xayriyachi · ⏰ {campaign['daysLeft']} kun qoldi",
+    ]
+    return '\n'.join(lines)
+
+async def send_campaign_card(chat_id, campaign: dict, reply_markup=None) -> Message:
+    """Campaign card as a photo when it has uploaded media, otherwise as text"""
+    caption = campaign_caption(campaign)
+    media_id = campaign_media_id(campaign)
+    if media_id:
+        # Photo captions are limited to 1024 characters
+        return await telegram_files.send_photo(chat_id, media_id, caption=caption[:1024], reply_markup=reply_markup)
+    return await bot.send_message(chat_id, caption, reply_markup=reply_markup)
+
+def donate_keyboard(campaign_id: str, user_id: str) -> InlineKeyboardMarkup:
+    url = f"{BASE_URL}{PAYMENT_FORM_URL}?user_id={user_id}&campaign_id={campaign_id}"
+    return InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="💝 Yordam Berish", url=url)]])
+
+@dp.message(Command("campaign"))
+async def campaign_card(message: Message):
+    parts = (message.text or "").split()
+    if len(parts) != 2:
+        await message.answer("Foydalanish: /campaign <e'lon_id>")
+        return
+    found = get_campaigns([parts[1]])
+    if not found:
+        await message.answer("E'lon topilmadi.")
+        return
     try:
-        await bot.send_message(user_id, text)
-        logger.info(f"Confirmation sent to user {user_id}")
+        await send_campaign_card(message.chat.id, found[0], donate_keyboard(found[0]['id'], str(message.from_user.id)))
     except Exception as e:
-        logger.error(f"Xabar yuborishda xato: {e}")
+        logger.error(f"E'lon kartasini yuborishda xato: {e}")
+        await message.answer("E'lonni yuborishda xatolik yuz berdi.")
+
+async def donate_deep_link(campaign_id: str) -> str:
+    # bot.me() is cached by aiogram after the first call
+    me = await bot.me()
+    return f"https://t.me/{me.username}?start=donate_{campaign_id}"
+
+class ChannelPublisher:
+    """Mirrors campaigns as CHANNEL_ID posts, one post per campaign.
+
+    Admin writes already land in data_changes; the publisher follows that
+    log, so any number of changes to a campaign within CHANNEL_EDIT_INTERVAL
+    collapse into one edit of its latest state. An edit is skipped when the
+    rendered text matches what was last posted. Only actual Telegram calls
+    are paced below the per-chat limit, and the log is polled again between
+    them, so admin edits go ahead of a rebuild that is still running.
+    SQLite is only touched from worker threads.
+    """
+
+    def __init__(self, channel_id: str, interval: float, max_per_minute: int = 20,
+                 poll_seconds: float = 2.0, max_backoff: float = 600):
+        self.channel_id = channel_id
+        self.interval = interval
+        self.min_gap = 60 / max_per_minute
+        self.poll_seconds = poll_seconds
+        self.max_backoff = max_backoff
+        self.cursor = None  # last data_changes version seen
+        self._dirty = set()
+        self._backlog = set()  # dirty only because of a rebuild; published after edits
+        self._rebuild = True  # publish everything once after start-up
+        self._last_edit = {}  # campaign id -> monotonic time of the last publish
+        self._failures = {}  # campaign id -> consecutive failed publishes
+        self._retry_at = {}  # campaign id -> monotonic time before which it is not retried
+
+    def rebuild(self):
+        self._rebuild = True
+
+    def _fetch_changes(self, cursor: Optional[int], rebuild: bool):
+        """(version, changed campaign ids, ids to rebuild); runs in a worker thread"""
+        conn = db_connect()
+        try:
+            c = conn.cursor()
+            version = data_version(c)
+            changed, everything = set(), set()
+            if cursor is not None and version > cursor:
+                c.execute("SELECT MIN(version) FROM data_changes")
+                if c.fetchone()[0] > cursor + 1:
+                    rebuild = True  # pruned past our cursor
+                c.execute("SELECT DISTINCT item_id FROM data_changes WHERE entity = 'campaigns' AND version > ?",
+                          (cursor,))
+                for (item_id,) in c.fetchall():
+                    if item_id is None:
+                        rebuild = True  # api_clear
+                    else:
+                        changed.add(item_id)
+            if rebuild:
+                c.execute("SELECT id FROM campaigns UNION SELECT campaign_id FROM channel_posts")
+                everything = {row[0] for row in c.fetchall()}
+            return version, changed, everything
+        finally:
+            conn.close()
+
+    async def _poll_changes(self):
+        rebuild, self._rebuild = self._rebuild, False
+        try:
+            self.cursor, changed, everything = await asyncio.to_thread(self._fetch_changes, self.cursor, rebuild)
+        except Exception:
+            self._rebuild = self._rebuild or rebuild
+            raise
+        self._backlog.update(everything - self._dirty - changed)
+        self._backlog -= changed
+        self._dirty.update(changed, everything)
+
+    def _load(self, campaign_id: str):
+        """(channel_posts row or None, campaign or None); runs in a worker thread"""
+        conn = db_connect()
+        row = conn.execute("SELECT message_id, text, media_id FROM channel_posts WHERE campaign_id = ?",
+                           (campaign_id,)).fetchone()
+        conn.close()
+        found = get_campaigns([campaign_id])
+        return row, found[0] if found else None
+
+    def _save(self, campaign_id: str, message_id: Optional[int], text: str = None, media_id: str = None):
+        conn = db_connect()
+        if message_id is None:
+            conn.execute("DELETE FROM channel_posts WHERE campaign_id = ?", (campaign_id,))
+        else:
+            conn.execute("INSERT OR REPLACE INTO channel_posts VALUES (?, ?, ?, ?, ?)",
+                         (campaign_id, message_id, text, media_id, datetime.now().isoformat()))
+        conn.commit()
+        conn.close()
+
+    async def publish(self, campaign_id: str) -> bool:
+        """Bring one campaign's post up to date; returns whether Telegram was called"""
+        post, campaign = await asyncio.to_thread(self._load, campaign_id)
+        if campaign is None:
+            if not post:
+                return False
+            try:
+                await bot.delete_message(self.channel_id, post[0])
+            except TelegramBadRequest:
+                # Posts older than 48 hours cannot be deleted; close them instead
+                closed = "❌ Bu e'lon yopilgan."
+                try:
+                    if post[2]:
+                        await bot.edit_message_caption(chat_id=self.channel_id, message_id=post[0], caption=closed)
+                    else:
+                        await bot.edit_message_text(closed, chat_id=self.channel_id, message_id=post[0])
+                except TelegramBadRequest as e:
+                    # Gone from the channel or already closed: nothing is left to do
+                    if 'not found' not in e.message and 'not modified' not in e.message:
+                        raise
+            await asyncio.to_thread(self._save, campaign_id, None)
+            CHANNEL_POSTS.inc('deleted')
+            return True
+        text = campaign_caption(campaign)
+        media_id = campaign_media_id(campaign)
+        if post and post[1] == text and post[2] == media_id:
+            CHANNEL_POSTS.inc('unchanged')
+            return False
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[[
+            InlineKeyboardButton(text="💝 Yordam Berish", url=await donate_deep_link(campaign['id']))]])
+        if post is None or post[2] != media_id:
+            # A text post cannot become a photo post (or the reverse) by editing
+            if post:
+                try:
+                    await bot.delete_message(self.channel_id, post[0])
+                except TelegramBadRequest:
+                    pass
+            message = await send_campaign_card(self.channel_id, campaign, keyboard)
+            await asyncio.to_thread(self._save, campaign_id, message.message_id, text, media_id)
+            CHANNEL_POSTS.inc('posted')
+            return True
+        try:
+            if media_id:
+                await bot.edit_message_caption(chat_id=self.channel_id, message_id=post[0], caption=text[:1024],
+                                               reply_markup=keyboard)
+            else:
+                await bot.edit_message_text(text, chat_id=self.channel_id, message_id=post[0], reply_markup=keyboard)
+            CHANNEL_POSTS.inc('edited')
+        except TelegramBadRequest as e:
+            if 'not modified' in e.message:
+                CHANNEL_POSTS.inc('unchanged')
+            elif 'not found' in e.message:
+                # Removed from the channel by hand: post it again next time
+                await asyncio.to_thread(self._save, campaign_id, None)
+                self._dirty.add(campaign_id)
+                return True
+            else:
+                raise
+        await asyncio.to_thread(self._save, campaign_id, post[0], text, media_id)
+        return True
+
+    def _due(self) -> list:
+        """Dirty campaigns that may be published now, admin edits before rebuild backlog"""
+        now = time.monotonic()
+        due = [cid for cid in self._dirty
+               if now - self._last_edit.get(cid, float('-inf')) >= self.interval
+               and now >= self._retry_at.get(cid, 0)]
+        due.sort(key=lambda cid: cid in self._backlog)
+        return due
+
+    async def _publish_one(self, campaign_id: str) -> bool:
+        """publish() with retry bookkeeping; returns whether Telegram was called"""
+        self._dirty.discard(campaign_id)
+        self._backlog.discard(campaign_id)
+        self._last_edit[campaign_id] = time.monotonic()
+        try:
+            called = await self.publish(campaign_id)
+        except TelegramRetryAfter as e:
+            self._dirty.add(campaign_id)
+            CHANNEL_POSTS.inc('throttled')
+            await asyncio.sleep(e.retry_after)
+            return False
+        except Exception as e:
+            # Keep the update: retry with backoff instead of waiting for the next change
+            failures = self._failures.get(campaign_id, 0) + 1
+            self._failures[campaign_id] = failures
+            self._retry_at[campaign_id] = time.monotonic() + min(self.max_backoff, 5 * 2 ** failures)
+            self._dirty.add(campaign_id)
+            CHANNEL_POSTS.inc('error')
+            logger.error(f"Kanal posti {campaign_id} yangilanmadi ({failures}-urinish): {e}")
+            return True
+        self._failures.pop(campaign_id, None)
+        self._retry_at.pop(campaign_id, None)
+        return called
+
+    async def run(self):
+        logger.info(f"Kanal nashriyotchisi ishga tushdi ({self.channel_id})")
+        while True:
+            more = False
+            try:
+                await self._poll_changes()
+                polled = time.monotonic()
+                for campaign_id in self._due():
+                    if time.monotonic() - polled >= self.poll_seconds:
+                        more = True  # look for new admin edits before going on
+                        break
+                    if await self._publish_one(campaign_id):
+                        await asyncio.sleep(self.min_gap)
+            except Exception as e:
+                logger.error(f"Kanal nashriyotchisi xatosi: {e}")
+            await asyncio.sleep(0 if more else 1)
+
+CHANNEL_POSTS = metrics.counter('ehson_channel_posts_total', 'Channel publisher actions', ('action',))
+channel_publisher = ChannelPublisher(CHANNEL_ID, CHANNEL_EDIT_INTERVAL)
+
+# Inline mode search. Queries are answered from search.CampaignIndex only;
+# a loop task follows data_changes and applies campaign edits to the index,
+# so SQLite sees one cheap version check every couple of seconds instead
+# of a query per keystroke.
+INLINE_QUERIES = metrics.counter('ehson_inline_queries_total', 'Inline queries by result', ('outcome',))
+INLINE_PAGE_SIZE = 20
+
+class CampaignSearch:
+    def __init__(self, refresh_seconds: float = 2.0):
+        self.index = search.CampaignIndex()
+        self.refresh_seconds = refresh_seconds
+        self.cursor = None  # last data_changes version applied
+
+    def _fetch(self):
+        """('full', new index) or ('diff', changed ids, their current rows); runs in a worker thread"""
+        conn = db_connect()
+        try:
+            c = conn.cursor()
+            version = data_version(c)
+            if self.cursor is not None and version == self.cursor:
+                return version, None
+            full = self.cursor is None
+            ids = set()
+            if not full:
+                c.execute("SELECT MIN(version) FROM data_changes")
+                full = c.fetchone()[0] > self.cursor + 1
+                c.execute("SELECT DISTINCT item_id FROM data_changes WHERE entity = 'campaigns' AND version > ?",
+                          (self.cursor,))
+                ids = {row[0] for row in c.fetchall()}
+                full = full or None in ids
+        finally:
+            conn.close()
+        if full:
+            # Built off the loop and swapped in whole
+            return version, ('full', search.CampaignIndex(get_campaigns()))
+        return version, ('diff', ids, get_campaigns(sorted(ids)) if ids else [])
+
+    def _apply(self, update):
+        if update[0] == 'full':
+            self.index = update[1]
+            return
+        _, ids, rows = update
+        for row in rows:
+            self.index.upsert(row)
+        for missing in ids - {str(row['id']) for row in rows}:
+            self.index.remove(missing)
+
+    async def run(self):
+        while True:
+            try:
+                version, update = await asyncio.to_thread(self._fetch)
+                if update is not None:
+                    self._apply(update)
+                self.cursor = version
+            except Exception as e:
+                logger.error(f"Qidiruv indeksini yangilashda xato: {e}")
+            await asyncio.sleep(self.refresh_seconds)
+
+campaign_search = CampaignSearch()
+
+@dp.inline_query()
+async def inline_search(query: InlineQuery):
+    offset = int(query.offset) if query.offset.isdigit() else 0
+    found, next_offset = campaign_search.index.search(query.query, offset, INLINE_PAGE_SIZE)
+    INLINE_QUERIES.inc('found' if found else 'empty')
+    results = []
+    for campaign in found:
+        target = campaign['targetAmount'] or 0
+        progress = (campaign['currentAmount'] or 0) / target * 100 if target else 0
+        media_id = campaign_media_id(campaign)
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[[
+            InlineKeyboardButton(text="💝 Yordam Berish", url=await donate_deep_link(campaign['id']))]])
+        results.append(InlineQueryResultArticle(
+            id=str(campaign['id'])[:64],
+            title=campaign['title'],
+            description=f"{progress:.0f}% · {format_amount(campaign['currentAmount'])} / {format_amount(target)} so'm",
+            input_message_content=InputTextMessageContent(message_text=campaign_caption(campaign)),
+            reply_markup=keyboard,
+            # Telegram fetches thumbnails itself, so only a public https BASE_URL works
+            thumbnail_url=f"{BASE_URL}/media/{media_id}?w=160&f=jpeg"
+            if media_id and BASE_URL.startswith("https://") else None,
+        ))
+    # Answers are the same for everyone, so Telegram may share them across users
+    await query.answer(results, cache_time=INLINE_CACHE_SECONDS, is_personal=False,
+                       next_offset=str(next_offset) if next_offset else "")
+
+@dp.message(Command("channel_rebuild"))
+async def channel_rebuild(message: Message):
+    if str(message.from_user.id) != ADMIN_ID:
+        return
+    if not CHANNEL_ID:
+        await message.answer("CHANNEL_ID sozlanmagan.")
+        return
+    channel_publisher.rebuild()
+    await message.answer("Kanal postlari qayta qurilmoqda: o'zgargan postlar navbat bilan yangilanadi.")
+
+@dp.message(Command("trace"))
+async def trace_payment(message: Message):
+    if str(message.from_user.id) != ADMIN_ID:
+        return
+    parts = (message.text or "").split()
+    if len(parts) != 2:
+        await message.answer("Foydalanish: /trace <payment_id>")
+        return
+    payment_id = parts[1]
+    conn = db_connect()
+    row = conn.execute("SELECT status, amount, created_at, traceparent FROM payments WHERE payment_id = ?",
+                       (payment_id,)).fetchone()
+    conn.close()
+    if not row:
+        await message.answer("To'lov topilmadi.")
+        return
+    status, amount, created_at, traceparent = row
+    context = tracing.parse_traceparent(traceparent)
+    if not context:
+        await message.answer(f"Status: {status}, Miqdor: {amount}, Vaqt: {created_at}\nBu to'lov uchun trace yo'q.")
+        return
+    # The trace file can be large; scan it off the event loop
+    spans = await asyncio.to_thread(tracing.load_trace, TRACE_PATH, context[0])
+    names = {s['name'] for s in spans}
+    text = f"Status: {status}, Miqdor: {amount}, Vaqt: {created_at}\ntrace {context[0]}\n\n"
+    text += tracing.render_timeline(spans) or "Span'lar topilmadi."
+    if status == "success" and "telegram.send_message" not in names:
+        text += "\n\n⚠️ Tasdiqlash xabari yuborilmagan."
+    await message.answer(text[:4000])
 
 # Run Flask in thread
 def run_flask():
     app.run(host="0.0.0.0", port=8000, debug=False, use_reloader=False)
 
-flask_thread = threading.Thread(target=run_flask)
-flask_thread.daemon = True
-flask_thread.start()
-
-# Run bot
-bot_loop = asyncio.get_event_loop()
+# Event loop watchdog: a heartbeat task measures scheduling lag; a helper
+# thread notices when the heartbeat stops and dumps the loop thread's stack,
+# which shows the synchronous call (sqlite, file logging, CPU work) blocking it
+LOOP_LAG_THRESHOLD_MS = float(os.getenv("LOOP_LAG_THRESHOLD_MS", "250"))
+LOOP_LAG_SECONDS = metrics.histogram('ehson_loop_lag_seconds', 'Bot event loop scheduling lag',
+                                     buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+LOOP_STALLS = metrics.counter('ehson_loop_stalls_total', 'Loop stalls longer than LOOP_LAG_THRESHOLD_MS')
+
+class LoopWatchdog:
+    def __init__(self, interval: float = 0.1, threshold_ms: float = LOOP_LAG_THRESHOLD_MS):
+        self.interval = interval
+        self.threshold = threshold_ms / 1000
+        self.last_beat = time.monotonic()
+        self.current_lag = 0.0
+        self.loop_thread_id = None
+        self._stalled = False
+        self._stop = threading.Event()
+        self._heartbeat_task = None  # kept so the task is not garbage-collected
+
+    async def heartbeat(self):
+        self.loop_thread_id = threading.get_ident()
+        while not self._stop.is_set():
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.current_lag = max(0.0, now - expected)
+            LOOP_LAG_SECONDS.observe(self.current_lag)
+            self.last_beat = now
+
+    def watch(self):
+        while not self._stop.wait(self.interval / 2):
+            stalled_for = time.monotonic() - self.last_beat - self.interval
+            if stalled_for > self.threshold:
+                if not self._stalled:
+                    # One stack per stall; the blocking call is still on top
+                    self._stalled = True
+                    LOOP_STALLS.inc()
+                    self.dump_stack(stalled_for)
+            else:
+                self._stalled = False
+
+    def dump_stack(self, stalled_for: float):
+        frame = sys._current_frames().get(self.loop_thread_id)
+        stack = ''.join(traceback.format_stack(frame)) if frame is not None else '(stack topilmadi)'
+        logger.warning(f"Event loop {stalled_for * 1000:.0f} ms dan beri bloklangan. Loop thread stack:\n{stack}")
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        self.last_beat = time.monotonic()
+        self._heartbeat_task = loop.create_task(self.heartbeat())
+        threading.Thread(target=self.watch, name="loop-watchdog", daemon=True).start()
+
+    async def stop(self):
+        self._stop.set()  # first, so the watcher does not report the shutdown as a stall
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            await asyncio.gather(self._heartbeat_task, return_exceptions=True)
+            self._heartbeat_task = None
+
+loop_watchdog = LoopWatchdog()
+metrics.gauge('ehson_loop_lag_current_seconds', 'Most recent bot loop lag sample',
+              callback=lambda: {(): loop_watchdog.current_lag})
+
+# Run bot; set from inside main() so callbacks target the loop that actually runs
+bot_loop = None
 
 async def main():
+    global bot_loop
+    bot_loop = asyncio.get_running_loop()
+    loop_watchdog.start(bot_loop)
+    # Referenced for the life of main(), so the tasks are not garbage-collected
+    tasks = [asyncio.create_task(campaign_search.run(), name="campaign-search")]
+    if CHANNEL_ID:
+        tasks.append(asyncio.create_task(channel_publisher.run(), name="channel-publisher"))
     logger.info("Bot ishga tushmoqda...")
     try:
         await dp.start_polling(bot)
     except Exception as e:
         logger.error(f"Bot polling xatosi: {e}")
+    finally:
+        # Stopped while the loop still runs, instead of being destroyed pending by asyncio.run
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await loop_watchdog.stop()
 
 if __name__ == "__main__":
+    # Started here rather than at import so tools (replay.py, benchmarks) can
+    # import app/dp without binding port 8000
+    flask_thread = threading.Thread(target=run_flask)
+    flask_thread.daemon = True
+    flask_thread.start()
+    get_event_log()  # closes segments left open by a crashed run
+    threading.Thread(target=run_event_rollup, name="event-rollup", daemon=True).start()
+    threading.Thread(target=run_rum_flush, name="rum-flush", daemon=True).start()
     asyncio.run(main())
@@ -0,0 +1,231 @@
+# click_simulator.py - Local Click payment simulator and callback load generator
+#
+# Plays out Click's prepare/complete protocol against a running bot's
+# /click/callback, the same way Click does after the user pays on my.click.uz.
+# Each simulated payment first opens the payment form (PAYMENT_FORM_URL, as in
+# bot.py, or --payment-path) to get a pending payment_id.
+#
+# Usage:
+#   python click_simulator.py --scenario success
+#   python click_simulator.py --scenario all --payments 200 --concurrency 20
+#   python click_simulator.py --base-url http://127.0.0.1:8000 --secret $CLICK_SECRET_KEY --payments 5000 --concurrency 50
+
+import os
+import re
+import sys
+import time
+import random
+import hashlib
+import argparse
+import threading
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+
+SCENARIOS = ['success', 'provider_error', 'duplicate_prepare', 'duplicate_complete', 'out_of_order', 'bad_amount']
+
+# error code we expect the merchant to answer with for each step of a scenario
+EXPECTED = {
+    'success': [0, 0],
+    'provider_error': [0, -9],
+    'duplicate_prepare': [0, 0, 0],
+    'duplicate_complete': [0, 0, 0],
+    'out_of_order': [-6, 0, 0],
+    'bad_amount': [0, -2],
+}
+
+_local = threading.local()
+
+
+def _session() -> requests.Session:
+    # One keep-alive session per worker thread
+    if not hasattr(_local, 'session'):
+        _local.session = requests.Session()
+    return _local.session
+
+
+def sign(data: dict, secret: str) -> str:
+    parts = [data['click_trans_id'], data['service_id'], secret, data['merchant_trans_id']]
+    if data['action'] == '1':
+        parts.append(data.get('merchant_prepare_id', ''))
+    parts += [data['amount'], data['action'], data['sign_time']]
+    return hashlib.md5(''.join(str(p) for p in parts).encode()).hexdigest()
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.outcomes = Counter()
+        self.failures = Counter()
+
+    def record(self, phase: str, seconds: float):
+        with self.lock:
+            self.latencies[phase].append(seconds)
+
+    def outcome(self, scenario: str, ok: bool, reason: str = ''):
+        with self.lock:
+            self.outcomes[(scenario, ok)] += 1
+            if not ok:
+                self.failures[reason] += 1
+
+
+def percentile(values, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class ClickSimulator:
+    def __init__(self, base_url: str, secret: str = '', service_id: str = 'YOUR_SERVICE_ID',
+                 stats: Stats = None, timeout: float = 10.0, payment_path: str = '/payment'):
+        self.base_url = base_url.rstrip('/')
+        self.payment_path = payment_path
+        self.secret = secret
+        self.service_id = service_id
+        self.stats = stats or Stats()
+        self.timeout = timeout
+
+    def _timed(self, phase: str, method: str, url: str, **kwargs) -> requests.Response:
+        started = time.perf_counter()
+        try:
+            return _session().request(method, url, timeout=self.timeout, **kwargs)
+        finally:
+            self.stats.record(phase, time.perf_counter() - started)
+
+    def open_payment(self, user_id: str, campaign_id: str = '') -> str:
+        response = self._timed('payment_form', 'GET', f"{self.base_url}{self.payment_path}",
+                               params={'user_id': user_id, 'campaign_id': campaign_id})
+        response.raise_for_status()
+        match = re.search(r'name="transaction_param" value="([^"]+)"', response.text)
+        if not match:
+            raise RuntimeError("payment_form javobida transaction_param topilmadi")
+        return match.group(1)
+
+    def callback(self, data: dict) -> dict:
+        data = dict(data, sign_time=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        data['sign_string'] = sign(data, self.secret)
+        phase = 'prepare' if data['action'] == '0' else 'complete'
+        response = self._timed(phase, 'POST', f"{self.base_url}/click/callback", data=data)
+        response.raise_for_status()
+        return response.json()
+
+    def run(self, scenario: str, user_id: str, amount: int = 10000) -> list:
+        """Play one payment through `scenario`; returns the merchant's error codes in order"""
+        # The bot reuses a user's pending row per campaign; a campaign id of
+        # its own keeps concurrent payments of one simulated user apart
+        payment_id = self.open_payment(user_id, f"sim_{random.randrange(10**12)}")
+        base = {
+            'click_trans_id': str(random.randrange(10**11, 10**12)),
+            'service_id': self.service_id,
+            'click_paydoc_id': str(random.randrange(10**11, 10**12)),
+            'merchant_trans_id': payment_id,
+            'amount': f"{amount:.2f}",
+            'error': '0',
+            'error_note': 'Success',
+        }
+        prepare_id = ''
+        codes = []
+
+        def send(data):
+            nonlocal prepare_id
+            body = self.callback(data)
+            if 'merchant_prepare_id' in body:
+                prepare_id = str(body['merchant_prepare_id'])
+            codes.append(int(body.get('error', -999)))
+
+        def complete(**overrides):
+            return dict(base, action='1', merchant_prepare_id=prepare_id, **overrides)
+
+        prepare = dict(base, action='0')
+        if scenario == 'success':
+            send(prepare)
+            send(complete())
+        elif scenario == 'provider_error':
+            send(prepare)
+            send(complete(error='-5017', error_note='Insufficient funds'))
+        elif scenario == 'duplicate_prepare':
+            send(prepare)
+            send(prepare)
+            send(complete())
+        elif scenario == 'duplicate_complete':
+            send(prepare)
+            send(complete())
+            send(complete())
+        elif scenario == 'out_of_order':
+            # Complete arrives before prepare, then Click retries in the right order
+            send(complete(merchant_prepare_id='0'))
+            send(prepare)
+            send(complete())
+        elif scenario == 'bad_amount':
+            send(prepare)
+            send(complete(amount=f"{amount + 1:.2f}"))
+        else:
+            raise ValueError(f"Noma'lum ssenariy: {scenario}")
+        return codes
+
+    def run_checked(self, scenario: str, user_id: str, amount: int = 10000) -> bool:
+        try:
+            codes = self.run(scenario, user_id, amount)
+        except Exception as e:
+            self.stats.outcome(scenario, False, f"{type(e).__name__}")
+            return False
+        ok = codes == EXPECTED[scenario]
+        self.stats.outcome(scenario, ok, '' if ok else f"{scenario}: {codes} != {EXPECTED[scenario]}")
+        return ok
+
+
+def load_test(simulator: ClickSimulator, scenarios, payments: int, concurrency: int, user_pool: int) -> float:
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for i in range(payments):
+            scenario = scenarios[i % len(scenarios)]
+            user_id = str(random.randrange(1, user_pool + 1))
+            pool.submit(simulator.run_checked, scenario, user_id, random.choice([5000, 10000, 25000, 50000]))
+    return time.perf_counter() - started
+
+
+def report(stats: Stats, elapsed: float, payments: int):
+    print(f"\n{payments} ta to'lov, {elapsed:.2f} s, {payments / elapsed if elapsed else 0:.1f} to'lov/s")
+    print(f"{'phase':<14}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for phase, values in sorted(stats.latencies.items()):
+        print(f"{phase:<14}{len(values):>8}"
+              f"{percentile(values, 50) * 1000:>10.1f}{percentile(values, 95) * 1000:>10.1f}"
+              f"{percentile(values, 99) * 1000:>10.1f}{max(values) * 1000:>10.1f}")
+    total = sum(stats.outcomes.values())
+    failed = sum(count for (_, ok), count in stats.outcomes.items() if not ok)
+    print(f"\nxatolar: {failed}/{total} ({failed / total * 100 if total else 0:.2f}%)")
+    for reason, count in stats.failures.most_common(10):
+        print(f"  {count:>6}  {reason}")
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Click to'lov simulyatori va yuklama generatori")
+    parser.add_argument('--base-url', default=os.getenv('BASE_URL', 'http://127.0.0.1:8000'))
+    parser.add_argument('--payment-path', default=os.getenv('PAYMENT_FORM_URL', '/payment'),
+                        help="Bot'dagi to'lov formasi yo'li (PAYMENT_FORM_URL)")
+    parser.add_argument('--secret', default=os.getenv('CLICK_SECRET_KEY', ''))
+    parser.add_argument('--service-id', default='YOUR_SERVICE_ID')
+    parser.add_argument('--scenario', choices=SCENARIOS + ['all'], default='success')
+    parser.add_argument('--payments', type=int, default=1)
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--users', type=int, default=1000, help="Tasodifiy user_id lar soni")
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args(argv)
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    scenarios = SCENARIOS if args.scenario == 'all' else [args.scenario]
+    simulator = ClickSimulator(args.base_url, args.secret, args.service_id, payment_path=args.payment_path)
+    elapsed = load_test(simulator, scenarios, args.payments, args.concurrency, args.users)
+    failed = report(simulator.stats, elapsed, args.payments)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,265 @@
+# db_stress.py - SQLite write-contention stress harness
+#
+# Reproduces what happens when the Flask threads (Click callbacks, admin
+# saves) and the bot loop (/start upserts, history reads) hit the same
+# SQLite file at once. Runs a weighted mix of operations from threads and/or
+# processes and reports "database is locked" errors, retries and commit
+# latency, so connection-layer changes can be compared on numbers.
+#
+# Works on a scratch copy of the database unless --in-place is given.
+#
+# Usage:
+#   python db_stress.py --threads 8 --duration 20
+#   python db_stress.py --processes 4 --threads 4 --mix callback=5,start=3,admin=1,reader=20
+#   python db_stress.py --journal-mode wal --busy-timeout 0.1 --retries 5
+
+import os
+import sys
+import time
+import uuid
+import random
+import shutil
+import sqlite3
+import argparse
+import tempfile
+import threading
+import traceback
+import multiprocessing
+from collections import defaultdict
+from datetime import datetime
+
+OPERATIONS = ['callback', 'start', 'admin', 'reader']
+DEFAULT_MIX = 'callback=4,start=3,admin=1,reader=12'
+
+
+def parse_mix(text: str) -> dict:
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError(f"Noma'lum operatsiya: {name} (mumkin: {', '.join(OPERATIONS)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def op_callback(c, rnd):
+    # Same shape as click_prepare + click_complete: create pending, update by PK twice
+    payment_id = str(uuid.uuid4())
+    user_id = str(rnd.randint(1, 100000))
+    now = datetime.now().isoformat()
+    c.execute("INSERT INTO payments (payment_id, user_id, amount, status, created_at) VALUES (?, ?, ?, 'pending', ?)",
+              (payment_id, user_id, None, now))
+    c.execute("UPDATE payments SET amount = ?, status = 'prepared', click_trans_id = ? WHERE payment_id = ?",
+              (rnd.choice([5000.0, 10000.0, 50000.0]), f"stress_{payment_id}", payment_id))
+    c.execute("UPDATE payments SET status = 'success' WHERE payment_id = ? AND status = 'prepared'", (payment_id,))
+    c.execute("INSERT OR IGNORE INTO users (user_id, created_at) VALUES (?, ?)", (user_id, now))
+
+
+def op_start(c, rnd):
+    user_id = str(rnd.randint(1, 100000))
+    c.execute("INSERT OR IGNORE INTO users (user_id, username, first_name, created_at) VALUES (?, ?, ?, ?)",
+              (user_id, f"user{user_id}", "Stress", datetime.now().isoformat()))
+
+
+def op_admin(c, rnd):
+    camp_id = f"stress_{rnd.randint(1, 200)}"
+    c.execute("INSERT OR REPLACE INTO campaigns VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+              (camp_id, "Stress kampaniya", "ijtimoiy", "tavsif", 1e7, rnd.random() * 1e7, rnd.randint(0, 500), 30,
+               0, "8600 0000 0000 0000", "Stress", "+998900000000", "Stress", "💝", "Admin", datetime.now().isoformat()))
+
+
+def op_reader(c, rnd):
+    if rnd.random() < 0.5:
+        c.execute("SELECT * FROM campaigns")
+    else:
+        c.execute("SELECT amount, status, created_at FROM payments WHERE user_id = ?", (str(rnd.randint(1, 100000)),))
+    c.fetchall()
+
+
+OPS = {'callback': op_callback, 'start': op_start, 'admin': op_admin, 'reader': op_reader}
+
+
+def _is_locked(error: sqlite3.OperationalError) -> bool:
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+
+def run_worker(db_path: str, mix: dict, duration: float, busy_timeout: float, retries: int,
+               reuse: bool, seed: int) -> dict:
+    """One thread's loop; returns raw counters and latency samples"""
+    rnd = random.Random(seed)
+    names = list(mix)
+    weights = [mix[n] for n in names]
+    stats = {
+        'ops': defaultdict(int), 'lock_errors': defaultdict(int), 'retries': defaultdict(int),
+        'failed': defaultdict(int), 'latency': defaultdict(list), 'commit': defaultdict(list),
+        'errors': defaultdict(int),  # "op: error" -> count, for errors other than locking
+    }
+    conn = sqlite3.connect(db_path, timeout=busy_timeout) if reuse else None
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        name = rnd.choices(names, weights)[0]
+        started = time.perf_counter()
+        for attempt in range(retries + 1):
+            local_conn = conn or sqlite3.connect(db_path, timeout=busy_timeout)
+            try:
+                c = local_conn.cursor()
+                OPS[name](c, rnd)
+                commit_started = time.perf_counter()
+                local_conn.commit()
+                stats['commit'][name].append(time.perf_counter() - commit_started)
+                stats['ops'][name] += 1
+                break
+            except Exception as e:
+                local_conn.rollback()
+                if not isinstance(e, sqlite3.OperationalError) or not _is_locked(e):
+                    # Not contention: count it as a failed op and keep going
+                    stats['failed'][name] += 1
+                    stats['errors'][f"{name}: {type(e).__name__}: {e}"] += 1
+                    break
+                stats['lock_errors'][name] += 1
+                if attempt == retries:
+                    stats['failed'][name] += 1
+                else:
+                    stats['retries'][name] += 1
+                    time.sleep(min(0.001 * (2 ** attempt), 0.1) * rnd.random())
+            finally:
+                if conn is None:
+                    local_conn.close()
+        stats['latency'][name].append(time.perf_counter() - started)
+    if conn is not None:
+        conn.close()
+    return {key: dict(value) for key, value in stats.items()}
+
+
+def run_process(db_path, mix, duration, busy_timeout, retries, reuse, threads, seed, result_queue):
+    result_queue.put(run_threads(db_path, mix, duration, busy_timeout, retries, reuse, threads, seed))
+
+
+def run_threads(db_path, mix, duration, busy_timeout, retries, reuse, threads, seed) -> list:
+    results = [None] * threads
+
+    def target(i):
+        try:
+            results[i] = run_worker(db_path, mix, duration, busy_timeout, retries, reuse, seed * 1000 + i)
+        except Exception:
+            # Left as None: merge() counts it as a crashed worker
+            traceback.print_exc()
+
+    workers = [threading.Thread(target=target, args=(i,)) for i in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return results
+
+
+def merge(results: list) -> dict:
+    merged = defaultdict(lambda: defaultdict(int))
+    samples = defaultdict(lambda: defaultdict(list))
+    crashed = 0
+    for result in results:
+        if result is None:
+            crashed += 1
+            continue
+        for key in ('ops', 'lock_errors', 'retries', 'failed', 'errors'):
+            for name, count in result[key].items():
+                merged[key][name] += count
+        for key in ('latency', 'commit'):
+            for name, values in result[key].items():
+                samples[key][name].extend(values)
+    return {'counts': merged, 'samples': samples, 'crashed': crashed}
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))] if ordered else 0.0
+
+
+def report(merged: dict, duration: float):
+    counts, samples = merged['counts'], merged['samples']
+    total = sum(counts['ops'].values())
+    print(f"\n{total} ta muvaffaqiyatli operatsiya, {total / duration:.1f} op/s")
+    print(f"{'op':<10}{'ok':>8}{'locked':>8}{'retries':>9}{'failed':>8}"
+          f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}{'commit p99':>12}")
+    for name in OPERATIONS:
+        latency = samples['latency'].get(name, [])
+        if not latency:
+            continue
+        commit = samples['commit'].get(name, [])
+        print(f"{name:<10}{counts['ops'][name]:>8}{counts['lock_errors'][name]:>8}{counts['retries'][name]:>9}"
+              f"{counts['failed'][name]:>8}"
+              f"{percentile(latency, 50) * 1000:>9.2f}{percentile(latency, 95) * 1000:>9.2f}"
+              f"{percentile(latency, 99) * 1000:>9.2f}{max(latency) * 1000:>9.2f}"
+              f"{percentile(commit, 99) * 1000:>12.2f}")
+    print(f"\nlock xatolari: {sum(counts['lock_errors'].values())}, "
+          f"qayta urinishlar: {sum(counts['retries'].values())}, "
+          f"muvaffaqiyatsiz: {sum(counts['failed'].values())}")
+    for error, count in sorted(counts['errors'].items(), key=lambda item: -item[1]):
+        print(f"  {count:>6} x {error}")
+    if merged['crashed']:
+        print(f"{merged['crashed']} ta oqim xato bilan to'xtadi (yuqoridagi traceback)")
+    return sum(counts['failed'].values()) + merged['crashed']
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SQLite yozish raqobati stress testi")
+    parser.add_argument('--db', default=os.getenv('DB_PATH', 'ehson_test.db'),
+                        help="bot.py yaratgan baza (nusxasi ustida ishlanadi)")
+    parser.add_argument('--in-place', action='store_true', help="Nusxa emas, bazaning o'zida ishlash")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f"Operatsiyalar vazni (standart: {DEFAULT_MIX})")
+    parser.add_argument('--threads', type=int, default=8, help="Har bir jarayondagi oqimlar")
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--duration', type=float, default=10.0, help='Sekund')
+    parser.add_argument('--busy-timeout', type=float, default=5.0,
+                        help="sqlite3.connect(timeout=...) - bot.py standarti 5 s")
+    parser.add_argument('--retries', type=int, default=0, help="'database is locked' dan keyin qayta urinishlar")
+    parser.add_argument('--journal-mode', choices=['delete', 'truncate', 'wal'], help="Boshlashdan oldin o'rnatish")
+    parser.add_argument('--reuse-connections', action='store_true',
+                        help="Har operatsiyada yangi ulanish o'rniga oqim bo'yicha bitta ulanish")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    mix = parse_mix(args.mix)
+    if not os.path.exists(args.db):
+        parser.error(f"{args.db} topilmadi; avval bot.py ni bir marta ishga tushiring yoki --db bering")
+    db_path = args.db
+    work_dir = None
+    if not args.in_place:
+        work_dir = tempfile.mkdtemp(prefix='ehson_stress_')
+        db_path = os.path.join(work_dir, os.path.basename(args.db))
+        shutil.copy2(args.db, db_path)
+    if args.journal_mode:
+        conn = sqlite3.connect(db_path)
+        mode = conn.execute(f"PRAGMA journal_mode={args.journal_mode}").fetchone()[0]
+        conn.close()
+        print(f"journal_mode = {mode}")
+
+    print(f"{args.processes} jarayon x {args.threads} oqim, {args.duration:.0f} s, mix: {mix}")
+    started = time.perf_counter()
+    results = []
+    if args.processes <= 1:
+        results = run_threads(db_path, mix, args.duration, args.busy_timeout, args.retries,
+                              args.reuse_connections, args.threads, args.seed)
+    else:
+        result_queue = multiprocessing.Queue()
+        procs = [multiprocessing.Process(target=run_process, args=(
+            db_path, mix, args.duration, args.busy_timeout, args.retries, args.reuse_connections,
+            args.threads, args.seed + p, result_queue)) for p in range(args.processes)]
+        for p in procs:
+            p.start()
+        for _ in procs:
+            results.extend(result_queue.get())
+        for p in procs:
+            p.join()
+    elapsed = time.perf_counter() - started
+
+    failed = report(merge(results), elapsed)
+    if work_dir:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,296 @@
+# events.py - Segmented client event log and hourly rollup
+#
+# The webapp batches UI events (ad overlay shown/skipped, banner and filter
+# clicks, donate presses, team modal opens) and sends them with
+# navigator.sendBeacon to /api/events. Each accepted batch becomes one line
+# in the current gzip segment, written by a single writer thread: no SQLite
+# transaction per event or per batch. Segments are closed after
+# EVENT_SEGMENT_SECONDS or EVENT_SEGMENT_BYTES and only closed segments are
+# rolled up, so the rollup never reads a file that is still being written.
+#
+# Batch format (compact arrays):
+#   {"t0": <client epoch ms>, "s": "<session>", "u": "<user id>", "v": "<app version>",
+#    "e": [[<ms since t0>, "<event name>", {<optional props>}], ...]}
+#
+# Usage:
+#   python events.py rollup --dir events --db ehson_test.db
+#   python events.py hourly --db ehson_test.db --name donate_click
+
+import os
+import sys
+import glob
+import gzip
+import json
+import math
+import time
+import queue
+import atexit
+import sqlite3
+import argparse
+import threading
+from collections import Counter
+from datetime import datetime
+
+MAX_BATCH_BYTES = 64 * 1024
+MAX_EVENTS_PER_BATCH = 200
+MAX_NAME_LENGTH = 64
+# Offsets count from the page load (t0); a clock step back can make them
+# slightly negative
+MIN_OFFSET_MS = -3600 * 1000
+MAX_OFFSET_MS = 7 * 24 * 3600 * 1000
+# t0 must be a plausible epoch: 2020-01-01 .. 2100-01-01
+MIN_T0_MS = 1577836800000
+MAX_T0_MS = 4102444800000
+OPEN_SUFFIX = '.jsonl.gz.open'
+CLOSED_SUFFIX = '.jsonl.gz'
+
+
+def _number(value) -> bool:
+    # json accepts NaN/Infinity and bool is an int, so check both explicitly
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def parse_batch(body: bytes):
+    """Validate a beacon body; returns the batch dict or raises ValueError"""
+    if len(body) > MAX_BATCH_BYTES:
+        raise ValueError('batch too large')
+    batch = json.loads(body)
+    if not isinstance(batch, dict) or not isinstance(batch.get('e'), list):
+        raise ValueError('expected {"e": [...]}')
+    events = batch['e']
+    if len(events) > MAX_EVENTS_PER_BATCH:
+        raise ValueError('too many events')
+    for event in events:
+        if (not isinstance(event, list) or len(event) < 2 or not _number(event[0])
+                or not MIN_OFFSET_MS <= event[0] <= MAX_OFFSET_MS
+                or not isinstance(event[1], str) or len(event[1]) > MAX_NAME_LENGTH):
+            raise ValueError('event must be [offset_ms, name, props?]')
+    t0 = batch.get('t0')
+    if t0 is not None and not (_number(t0) and MIN_T0_MS <= t0 <= MAX_T0_MS):
+        raise ValueError('t0 must be epoch milliseconds')
+    return batch
+
+
+def _writer_alive(path: str) -> bool:
+    """Whether the process that opened a segment (pid in its name) still runs"""
+    try:
+        pid = int(os.path.basename(path).split('-')[3])
+    except (IndexError, ValueError):
+        return False
+    if pid == os.getpid():
+        return False  # an earlier run that had our pid (e.g. pid 1 in a container)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class EventLog:
+    """Appends batches to rotating gzip segments from one writer thread"""
+
+    def __init__(self, directory: str, segment_seconds: float = 300, segment_bytes: int = 16 * 1024 * 1024,
+                 max_queue: int = 10000):
+        self.directory = directory
+        self.segment_seconds = segment_seconds
+        self.segment_bytes = segment_bytes
+        self.queue = queue.Queue(max_queue)
+        self.dropped = 0
+        self.accepted = 0
+        self._sequence = 0
+        os.makedirs(directory, exist_ok=True)
+        self._recover()
+        self.writer = threading.Thread(target=self._write_loop, name='event-log', daemon=True)
+        self.writer.start()
+        atexit.register(self.close)
+
+    def _recover(self):
+        # A segment left open by a crash is complete up to its last flushed
+        # gzip member; close it so the rollup picks it up. Segments of a
+        # writer that is still running are left alone.
+        for path in glob.glob(os.path.join(self.directory, '*' + OPEN_SUFFIX)):
+            if not _writer_alive(path):
+                os.replace(path, path[:-len('.open')])
+
+    def append(self, batch: dict, received_at: float) -> bool:
+        batch['r'] = round(received_at, 3)
+        try:
+            self.queue.put_nowait(json.dumps(batch, ensure_ascii=False, separators=(',', ':')) + '\n')
+        except queue.Full:
+            self.dropped += 1
+            return False
+        self.accepted += 1
+        return True
+
+    def _open_segment(self):
+        # The sequence keeps names unique when size rotation closes several segments in one second
+        self._sequence += 1
+        name = f"segment-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{self._sequence}"
+        path = os.path.join(self.directory, name + OPEN_SUFFIX)
+        return path, open(path, 'ab'), time.monotonic()
+
+    def _close_segment(self, path, raw):
+        raw.close()
+        if os.path.getsize(path) == 0:
+            os.remove(path)
+        else:
+            os.replace(path, path[:-len('.open')])
+
+    def _write_loop(self):
+        path = raw = None
+        opened_at = 0.0
+        buffer = []
+        while True:
+            try:
+                line = self.queue.get(timeout=1.0)
+            except queue.Empty:
+                line = ''
+            if line is None:
+                break
+            if line:
+                buffer.append(line)
+                if not self.queue.empty() and len(buffer) < 1000:
+                    continue
+            if buffer:
+                if raw is None:
+                    path, raw, opened_at = self._open_segment()
+                # One gzip member per burst: each member is a complete, readable unit
+                raw.write(gzip.compress(''.join(buffer).encode('utf-8')))
+                raw.flush()
+                buffer = []
+            if raw is not None and (time.monotonic() - opened_at >= self.segment_seconds
+                                    or raw.tell() >= self.segment_bytes):
+                self._close_segment(path, raw)
+                path = raw = None
+        if buffer:
+            if raw is None:
+                path, raw, opened_at = self._open_segment()
+            raw.write(gzip.compress(''.join(buffer).encode('utf-8')))
+        if raw is not None:
+            self._close_segment(path, raw)
+
+    def close(self):
+        if self.writer.is_alive():
+            self.queue.put(None)
+            self.writer.join(timeout=5)
+
+
+def init_rollup_tables(conn: sqlite3.Connection):
+    conn.execute('''CREATE TABLE IF NOT EXISTS event_hourly (
+                        hour TEXT,
+                        name TEXT,
+                        count INTEGER,
+                        PRIMARY KEY (hour, name)
+                    )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS event_segments (
+                        segment TEXT PRIMARY KEY,
+                        batches INTEGER,
+                        events INTEGER,
+                        rolled_up_at TEXT
+                    )''')
+
+
+def read_segment(path: str):
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        try:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+        except (EOFError, gzip.BadGzipFile):
+            return  # torn last member of a crashed writer
+
+
+def rollup(directory: str, conn: sqlite3.Connection, retain_days: float = 0) -> dict:
+    """Fold closed segments into event_hourly; each segment is counted exactly once"""
+    init_rollup_tables(conn)
+    done = {row[0] for row in conn.execute("SELECT segment FROM event_segments")}
+    summary = {'segments': 0, 'batches': 0, 'events': 0, 'skipped': 0}
+    for path in sorted(glob.glob(os.path.join(directory, '*' + CLOSED_SUFFIX))):
+        segment = os.path.basename(path)
+        if segment in done:
+            if retain_days and time.time() - os.path.getmtime(path) > retain_days * 86400:
+                os.remove(path)
+            continue
+        counts = Counter()
+        batches = events = skipped = 0
+        for batch in read_segment(path):
+            batches += 1
+            # Trust the client clock unless it is off by more than an hour;
+            # then anchor the batch at the server receive time instead
+            received_ms = batch.get('r', 0) * 1000
+            t0 = batch.get('t0') or 0
+            offsets = [event[0] for event in batch.get('e', []) if _number(event[0])]
+            if not _number(t0) or abs(t0 - received_ms) > 3600 * 1000:
+                t0 = received_ms - max(offsets, default=0)
+            for event in batch.get('e', []):
+                # Segments written before parse_batch checked ranges may hold
+                # values no timestamp can be made of; one bad event must not
+                # keep the whole segment from being rolled up
+                try:
+                    hour = datetime.fromtimestamp((t0 + event[0]) / 1000).strftime('%Y-%m-%dT%H:00')
+                except (TypeError, ValueError, OverflowError, OSError):
+                    skipped += 1
+                    continue
+                counts[(hour, event[1])] += 1
+                events += 1
+        # Counts and the "done" marker commit together, so a crash mid-rollup
+        # cannot count a segment twice
+        conn.executemany("""INSERT INTO event_hourly (hour, name, count) VALUES (?, ?, ?)
+                            ON CONFLICT (hour, name) DO UPDATE SET count = count + excluded.count""",
+                         [(hour, name, n) for (hour, name), n in counts.items()])
+        conn.execute("INSERT INTO event_segments VALUES (?, ?, ?, ?)",
+                     (segment, batches, events, datetime.now().isoformat()))
+        conn.commit()
+        summary['segments'] += 1
+        summary['batches'] += batches
+        summary['events'] += events
+        summary['skipped'] += skipped
+    return summary
+
+
+def hourly_counts(conn: sqlite3.Connection, name: str = None, since: str = None) -> list:
+    init_rollup_tables(conn)
+    query = "SELECT hour, name, count FROM event_hourly WHERE 1 = 1"
+    params = []
+    if name:
+        query += " AND name = ?"
+        params.append(name)
+    if since:
+        query += " AND hour >= ?"
+        params.append(since)
+    return conn.execute(query + " ORDER BY hour, name", params).fetchall()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Webapp hodisalari jurnali: soatlik yig'ish")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_rollup = sub.add_parser('rollup', help="Yopilgan segmentlarni event_hourly ga yig'ish")
+    p_rollup.add_argument('--dir', default=os.getenv('EVENT_LOG_DIR', 'events'))
+    p_rollup.add_argument('--db', default=os.getenv('DB_PATH', 'ehson_test.db'))
+    p_rollup.add_argument('--retain-days', type=float, default=0,
+                          help="Yig'ilgan segmentlarni shuncha kundan keyin o'chirish (0 - saqlash)")
+    p_hourly = sub.add_parser('hourly', help="Soatlik sonlarni chiqarish")
+    p_hourly.add_argument('--db', default=os.getenv('DB_PATH', 'ehson_test.db'))
+    p_hourly.add_argument('--name')
+    p_hourly.add_argument('--since', help='YYYY-MM-DDTHH:00')
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(args.db)
+    try:
+        if args.command == 'rollup':
+            summary = rollup(args.dir, conn, args.retain_days)
+            print(f"{summary['segments']} segment, {summary['batches']} paket, {summary['events']} hodisa")
+        else:
+            for hour, name, count in hourly_counts(conn, args.name, args.since):
+                print(f"{hour}  {name:<24}{count:>8}")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,277 @@
+# fake_telegram.py - Local stand-in for the Telegram Bot API
+#
+# Speaks enough of the Bot API for bot.py to run against it without touching
+# real Telegram: getMe, getUpdates, setWebhook/deleteWebhook, sendMessage,
+# editMessageText, sendDocument, sendPhoto and answerCallbackQuery. Latency
+# and 429 "retry after" answers can be injected, and every outbound call is
+# recorded for inspection.
+#
+# Point the bot at it with TELEGRAM_API_URL=http://127.0.0.1:8081
+#
+# Control endpoints (not part of the Bot API):
+#   POST   /_fake/updates   queue one update (JSON object) or a list of them
+#   GET    /_fake/sent      recorded outbound calls
+#   DELETE /_fake/sent      clear the recording
+#   GET    /_fake/stats     per-method call counts and injected 429s
+#   POST   /_fake/config    change latency / rate limit settings at runtime
+#
+# Usage:
+#   python fake_telegram.py --port 8081 --latency-ms 40 --jitter-ms 20 --retry-after-rate 0.01
+
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+from collections import Counter, defaultdict, deque
+
+from aiohttp import web
+
+BOT_USER = {'id': 1000000001, 'is_bot': True, 'first_name': 'Ehson Fake Bot', 'username': 'ehson_fake_bot'}
+
+
+class FakeBotAPI:
+    def __init__(self, latency_ms: float = 0.0, jitter_ms: float = 0.0, retry_after_rate: float = 0.0,
+                 retry_after: int = 1, per_chat_rate: float = 0.0, max_recorded: int = 100000):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.retry_after_rate = retry_after_rate
+        self.retry_after = retry_after
+        # Telegram allows roughly one message per second per chat; 0 disables the check
+        self.per_chat_rate = per_chat_rate
+        self.sent = deque(maxlen=max_recorded)
+        self.calls = Counter()
+        self.throttled = Counter()
+        self.webhook_url = ''
+        self._updates = deque()
+        self._update_event = asyncio.Event()
+        self._next_update_id = 1
+        self._next_message_id = defaultdict(lambda: 1)
+        self._next_file_id = 1
+        self._last_send = {}
+
+        self.app = web.Application(client_max_size=50 * 1024 * 1024)
+        self.app.router.add_post('/_fake/updates', self.handle_push_updates)
+        self.app.router.add_get('/_fake/sent', self.handle_sent)
+        self.app.router.add_delete('/_fake/sent', self.handle_clear_sent)
+        self.app.router.add_get('/_fake/stats', self.handle_stats)
+        self.app.router.add_post('/_fake/config', self.handle_config)
+        self.app.router.add_route('*', '/bot{token}/{method}', self.handle_method)
+
+    # ---- updates -------------------------------------------------------
+
+    def push_update(self, update: dict) -> int:
+        update = dict(update)
+        if 'update_id' not in update:
+            update['update_id'] = self._next_update_id
+        self._next_update_id = max(self._next_update_id, update['update_id']) + 1
+        self._updates.append(update)
+        self._update_event.set()
+        return update['update_id']
+
+    async def _get_updates(self, params: dict):
+        offset = int(params.get('offset') or 0)
+        limit = min(int(params.get('limit') or 100), 100)
+        timeout = float(params.get('timeout') or 0)
+        # Acknowledge everything below offset, as Telegram does
+        while self._updates and self._updates[0]['update_id'] < offset:
+            self._updates.popleft()
+        if not self._updates and timeout > 0:
+            self._update_event.clear()
+            try:
+                await asyncio.wait_for(self._update_event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return [u for _, u in zip(range(limit), self._updates)]
+
+    # ---- helpers -------------------------------------------------------
+
+    def _message(self, chat_id, **fields) -> dict:
+        chat_id = int(chat_id) if str(chat_id).lstrip('-').isdigit() else chat_id
+        message_id = self._next_message_id[chat_id]
+        self._next_message_id[chat_id] += 1
+        message = {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private' if isinstance(chat_id, int) and chat_id > 0 else 'channel'},
+            'from': BOT_USER,
+        }
+        message.update(fields)
+        return message
+
+    def _file(self, field, kind: str) -> dict:
+        if isinstance(field, web.FileField):
+            size = len(field.file.read())
+            name = field.filename
+        else:
+            # Re-sent by file_id / URL: nothing uploaded
+            size, name = 0, None
+        file_id = f"fake-{kind}-{self._next_file_id}"
+        self._next_file_id += 1
+        info = {'file_id': file_id, 'file_unique_id': file_id, 'file_size': size}
+        if name:
+            info['file_name'] = name
+        return info
+
+    def _throttle(self, method: str, chat_id):
+        if self.retry_after_rate and random.random() < self.retry_after_rate:
+            return self.retry_after
+        if self.per_chat_rate and chat_id is not None:
+            now = time.monotonic()
+            last = self._last_send.get(chat_id)
+            if last is not None and now - last < 1.0 / self.per_chat_rate:
+                return max(1, int(1.0 / self.per_chat_rate - (now - last)) + 1)
+            self._last_send[chat_id] = now
+        return None
+
+    @staticmethod
+    def _ok(result):
+        return web.json_response({'ok': True, 'result': result})
+
+    @staticmethod
+    def _error(code: int, description: str, **parameters):
+        body = {'ok': False, 'error_code': code, 'description': description}
+        if parameters:
+            body['parameters'] = parameters
+        return web.json_response(body, status=code)
+
+    # ---- Bot API -------------------------------------------------------
+
+    async def handle_method(self, request: web.Request):
+        method = request.match_info['method']
+        self.calls[method] += 1
+        if request.content_type == 'application/json':
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+        params.update(request.query)
+
+        if self.latency_ms or self.jitter_ms:
+            await asyncio.sleep(max(0.0, self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000)
+
+        chat_id = params.get('chat_id')
+        if method in ('sendMessage', 'editMessageText', 'sendDocument', 'sendPhoto', 'answerCallbackQuery'):
+            retry_after = self._throttle(method, chat_id)
+            if retry_after is not None:
+                self.throttled[method] += 1
+                return self._error(429, f"Too Many Requests: retry after {retry_after}", retry_after=retry_after)
+
+        handler = getattr(self, f"api_{method}", None)
+        if handler is None:
+            return self._error(404, 'Not Found: method not found')
+        result = handler(params) if not asyncio.iscoroutinefunction(handler) else await handler(params)
+        if method not in ('getUpdates', 'getMe', 'getWebhookInfo'):
+            self.sent.append({'method': method, 'time': time.time(),
+                              'params': {k: v for k, v in params.items() if not isinstance(v, web.FileField)}})
+        return self._ok(result)
+
+    def api_getMe(self, params):
+        return BOT_USER
+
+    async def api_getUpdates(self, params):
+        return await self._get_updates(params)
+
+    def api_setWebhook(self, params):
+        self.webhook_url = params.get('url', '')
+        return True
+
+    def api_deleteWebhook(self, params):
+        self.webhook_url = ''
+        if str(params.get('drop_pending_updates', '')).lower() == 'true':
+            self._updates.clear()
+        return True
+
+    def api_getWebhookInfo(self, params):
+        return {'url': self.webhook_url, 'has_custom_certificate': False, 'pending_update_count': len(self._updates)}
+
+    def api_sendMessage(self, params):
+        return self._message(params['chat_id'], text=params.get('text', ''))
+
+    def api_editMessageText(self, params):
+        if params.get('inline_message_id'):
+            return True
+        message = self._message(params['chat_id'], text=params.get('text', ''))
+        message['message_id'] = int(params.get('message_id', 0))
+        message['edit_date'] = int(time.time())
+        return message
+
+    def api_sendDocument(self, params):
+        return self._message(params['chat_id'], document=self._file(params.get('document'), 'document'),
+                             caption=params.get('caption'))
+
+    def api_sendPhoto(self, params):
+        photo = self._file(params.get('photo'), 'photo')
+        photo.update(width=800, height=600)
+        return self._message(params['chat_id'], photo=[photo], caption=params.get('caption'))
+
+    def api_answerCallbackQuery(self, params):
+        return True
+
+    def api_answerInlineQuery(self, params):
+        return True
+
+    # ---- control endpoints ---------------------------------------------
+
+    async def handle_push_updates(self, request: web.Request):
+        body = await request.json()
+        updates = body if isinstance(body, list) else [body]
+        ids = [self.push_update(u) for u in updates]
+        return web.json_response({'queued': ids})
+
+    async def handle_sent(self, request: web.Request):
+        method = request.query.get('method')
+        sent = [s for s in self.sent if not method or s['method'] == method]
+        return web.json_response(sent)
+
+    async def handle_clear_sent(self, request: web.Request):
+        self.sent.clear()
+        return web.json_response({'cleared': True})
+
+    async def handle_stats(self, request: web.Request):
+        return web.json_response({'calls': self.calls, 'throttled': self.throttled,
+                                  'pending_updates': len(self._updates)})
+
+    async def handle_config(self, request: web.Request):
+        body = await request.json()
+        for key in ('latency_ms', 'jitter_ms', 'retry_after_rate', 'retry_after', 'per_chat_rate'):
+            if key in body:
+                setattr(self, key, type(getattr(self, key))(body[key]))
+        return web.json_response({key: getattr(self, key) for key in
+                                  ('latency_ms', 'jitter_ms', 'retry_after_rate', 'retry_after', 'per_chat_rate')})
+
+    # ---- embedding -----------------------------------------------------
+
+    async def start(self, host: str = '127.0.0.1', port: int = 8081) -> web.AppRunner:
+        """Start inside an already running loop (benchmarks, replay harness)"""
+        runner = web.AppRunner(self.app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Lokal soxta Telegram Bot API serveri")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    parser.add_argument('--retry-after-rate', type=float, default=0.0,
+                        help="Yuboruvchi so'rovlarning qancha qismiga 429 qaytarish (0..1)")
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--per-chat-rate', type=float, default=0.0,
+                        help="Har bir chat uchun sekundiga ruxsat etilgan xabarlar (0 - cheklovsiz)")
+    parser.add_argument('--updates', help="Ishga tushganda navbatga qo'yiladigan update'lar (JSON list fayli)")
+    args = parser.parse_args(argv)
+
+    fake = FakeBotAPI(args.latency_ms, args.jitter_ms, args.retry_after_rate, args.retry_after, args.per_chat_rate)
+    if args.updates:
+        with open(args.updates, encoding='utf-8') as f:
+            for update in json.load(f):
+                fake.push_update(update)
+    web.run_app(fake.app, host=args.host, port=args.port, access_log=None)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
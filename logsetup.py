@@ -0,0 +1,240 @@
+# logsetup.py - Non-blocking structured logging for bot.py
+#
+# Producers (Flask threads, the bot event loop) only put records on a queue;
+# a single QueueListener thread formats them as JSON lines, redacts card
+# numbers, bot tokens and Click signatures, and writes to files that rotate
+# by size and by age, gzip-compressing each rotated file.
+#
+# High-volume DEBUG lines are sampled per call site (1 in N) before they are
+# queued, so turning DEBUG on does not flood the queue.
+
+import os
+import re
+import gzip
+import json
+import queue
+import atexit
+import shutil
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from itertools import count
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# LogRecord attributes that are not user-supplied "extra" fields
+_RECORD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+_GROUPED_CARD = re.compile(r'\b\d{4}[ -]\d{4}[ -]\d{4}[ -]\d{4}(?:[ -]\d{1,3})?\b')
+_CARD_DIGITS = re.compile(r'\b\d{13,19}\b')
+_BOT_TOKEN = re.compile(r'\b\d{6,12}:[A-Za-z0-9_-]{30,}\b')
+_SECRET_VALUE = re.compile(
+    r'((?:sign_string|secret_key|token|password|authorization)["\']?\s*[:=]\s*["\']?)([^"\',\s}&]+)',
+    re.IGNORECASE)
+
+
+def luhn_valid(digits: str) -> bool:
+    total = 0
+    for i, ch in enumerate(reversed(digits)):
+        d = int(ch)
+        if i % 2:
+            d = d * 2 - 9 if d > 4 else d * 2
+        total += d
+    return total % 10 == 0
+
+
+def _mask_card(match) -> str:
+    digits = re.sub(r'\D', '', match.group(0))
+    return f"****{digits[-4:]}"
+
+
+def _mask_card_digits(match) -> str:
+    # Bare digit runs are often ids (click_trans_id, timestamps); only Luhn-valid ones are cards
+    digits = match.group(0)
+    return f"****{digits[-4:]}" if luhn_valid(digits) else digits
+
+
+class Redactor:
+    """Masks card numbers, bot tokens, signatures and configured secret strings"""
+
+    def __init__(self, secrets=()):
+        self.secrets = [s for s in secrets if s and len(s) >= 6]
+
+    def __call__(self, text: str) -> str:
+        text = _GROUPED_CARD.sub(_mask_card, text)
+        text = _CARD_DIGITS.sub(_mask_card_digits, text)
+        text = _BOT_TOKEN.sub('<bot-token>', text)
+        text = _SECRET_VALUE.sub(r'\1***', text)
+        for secret in self.secrets:
+            text = text.replace(secret, '***')
+        return text
+
+
+class JsonFormatter(logging.Formatter):
+    def __init__(self, redactor: Redactor):
+        super().__init__()
+        self.redactor = redactor
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'thread': record.threadName,
+            'where': f"{record.module}:{record.lineno}",
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return self.redactor(json.dumps(entry, ensure_ascii=False, default=str))
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self, redactor: Redactor, fmt: str):
+        super().__init__(fmt)
+        self.redactor = redactor
+
+    def format(self, record: logging.LogRecord) -> str:
+        return self.redactor(super().format(record))
+
+
+class RawFormatter(logging.Formatter):
+    """Message only; for logs whose messages are already JSON (slow update log)"""
+
+    def __init__(self, redactor: Redactor):
+        super().__init__('%(message)s')
+        self.redactor = redactor
+
+    def format(self, record: logging.LogRecord) -> str:
+        return self.redactor(super().format(record))
+
+
+class CompressingRotatingFileHandler(RotatingFileHandler):
+    """Rotates at max_bytes or every interval seconds; rotated files are gzipped"""
+
+    def __init__(self, filename: str, max_bytes: int = 0, interval: float = 0, backup_count: int = 7):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8', delay=True)
+        self.interval = interval
+        self.next_rollover = time.time() + interval if interval else None
+        self.namer = lambda name: name + '.gz'
+        self.rotator = self._compress
+
+    @staticmethod
+    def _compress(source: str, dest: str):
+        with open(source, 'rb') as src, gzip.open(dest, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(source)
+
+    def shouldRollover(self, record) -> bool:
+        if self.next_rollover is not None and time.time() >= self.next_rollover and os.path.exists(self.baseFilename):
+            return True
+        return bool(super().shouldRollover(record))
+
+    def doRollover(self):
+        super().doRollover()
+        if self.interval:
+            self.next_rollover = time.time() + self.interval
+
+
+class DebugSampler(logging.Filter):
+    """Passes 1 in every_n DEBUG records per call site; other levels always pass"""
+
+    def __init__(self, every_n: int):
+        super().__init__()
+        self.every_n = max(1, every_n)
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.every_n == 1:
+            return True
+        key = (record.pathname, record.lineno)
+        counter = self._counters.get(key)
+        if counter is None:
+            with self._lock:
+                counter = self._counters.setdefault(key, count())
+        return next(counter) % self.every_n == 0
+
+
+class OnlyLoggers(logging.Filter):
+    def __init__(self, names, exclude: bool = False):
+        super().__init__()
+        self.names = tuple(names)
+        self.exclude = exclude
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        matched = any(record.name == n or record.name.startswith(n + '.') for n in self.names)
+        return matched != self.exclude
+
+
+class StructuredQueueHandler(QueueHandler):
+    """Enqueues without formatting; JSON formatting and redaction happen on the listener thread"""
+
+    dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Never block a request or the event loop on logging
+            self.dropped += 1
+
+
+def stop_listener(listener: QueueListener):
+    """Flush and stop; safe to call more than once"""
+    if listener._thread is not None:
+        listener.stop()
+
+
+def setup_logging(path: str = 'ehson.log', level: str = 'INFO', max_bytes: int = 50 * 1024 * 1024,
+                  interval: float = 86400, backup_count: int = 14, debug_sample: int = 10,
+                  console: bool = True, side_logs: dict = None, secrets=(), queue_size: int = 100000):
+    """Route all logging through one queue; side_logs maps logger name -> separate file.
+
+    Returns the QueueHandler (for attaching to non-propagating loggers) and
+    the started QueueListener, which is stopped at interpreter exit.
+    """
+    redactor = Redactor(secrets)
+    side_logs = side_logs or {}
+    handlers = []
+
+    main_file = CompressingRotatingFileHandler(path, max_bytes, interval, backup_count)
+    main_file.setFormatter(JsonFormatter(redactor))
+    handlers.append(main_file)
+    if console:
+        stream = logging.StreamHandler()
+        stream.setFormatter(TextFormatter(redactor, '%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+        handlers.append(stream)
+    if side_logs:
+        for handler in handlers:
+            handler.addFilter(OnlyLoggers(side_logs, exclude=True))
+    for name, side_path in side_logs.items():
+        side = CompressingRotatingFileHandler(side_path, max_bytes, interval, backup_count)
+        side.setFormatter(RawFormatter(redactor))
+        side.addFilter(OnlyLoggers([name]))
+        handlers.append(side)
+
+    records = queue.Queue(queue_size)
+    queue_handler = StructuredQueueHandler(records)
+    queue_handler.addFilter(DebugSampler(debug_sample))
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(queue_handler)
+    root.setLevel(level.upper())
+
+    listener = QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(stop_listener, listener)
+    return queue_handler, listener
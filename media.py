@@ -0,0 +1,320 @@
+# media.py - Upload-backed image store with resized variants
+#
+# Uploads are stored once under a hash of their content, so a media id never
+# changes meaning and every /media URL can be cached as immutable. Resized
+# WebP/JPEG variants are made on first request by media_worker.py processes
+# (resizing is CPU-bound and would hold the GIL in the Flask threads) and
+# kept in a disk cache that evicts the least recently used files above a
+# byte budget. Originals are never evicted.
+#
+# Usage:
+#   python media.py add photo.jpg --dir media --db ehson_test.db
+#   python media.py stats --dir media
+
+import io
+import os
+import re
+import sys
+import json
+import atexit
+import select
+import hashlib
+import sqlite3
+import argparse
+import threading
+import subprocess
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+# Variant widths offered in srcset; requests are snapped up to one of these
+WIDTHS = (160, 320, 480, 640, 960, 1280)
+FORMATS = {'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+QUALITY = {'webp': 80, 'jpeg': 82}
+ACCEPTED_FORMATS = ('JPEG', 'PNG', 'WEBP', 'GIF')
+MAX_UPLOAD_BYTES = 10 * 1024 * 1024
+MAX_PIXELS = 40_000_000
+VARIANT_TIMEOUT = 30
+# A request may wait behind other jobs in the pool, so it waits longer than one job may take
+VARIANT_WAIT = 2 * VARIANT_TIMEOUT
+MEDIA_ID = re.compile(r'[0-9a-f]{24}')
+
+# Workers are started with subprocess (fork + exec), not multiprocessing:
+# a plain fork of the multithreaded bot can inherit a held lock, and
+# spawn/forkserver would re-import bot.py as __main__ in every worker.
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'media_worker.py')
+
+
+def _pillow():
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        raise RuntimeError("Rasmlar uchun Pillow o'rnatilmagan (pip install Pillow)")
+    Image.MAX_IMAGE_PIXELS = MAX_PIXELS
+    return Image, ImageOps
+
+
+def init_tables(conn: sqlite3.Connection):
+    conn.execute('''CREATE TABLE IF NOT EXISTS media (
+                        id TEXT PRIMARY KEY,
+                        format TEXT,
+                        width INTEGER,
+                        height INTEGER,
+                        size INTEGER,
+                        created_at TEXT
+                    )''')
+
+
+def probe(data: bytes):
+    """(format, width, height) of an upload; raises ValueError if it is not an image we accept"""
+    Image, ImageOps = _pillow()
+    try:
+        with Image.open(io.BytesIO(data)) as im:
+            im.verify()
+        # verify() leaves the image unusable, so open it again for the size
+        with Image.open(io.BytesIO(data)) as im:
+            fmt = im.format
+            width, height = ImageOps.exif_transpose(im).size
+    except (OSError, SyntaxError, Image.DecompressionBombError) as e:
+        raise ValueError(f"Rasm o'qilmadi: {e}")
+    if fmt not in ACCEPTED_FORMATS:
+        raise ValueError(f"{fmt} formati qabul qilinmaydi")
+    return fmt, width, height
+
+
+def make_variant(source: str, dest: str, width: int, fmt: str) -> int:
+    """Resize source to width (never upscaling) and write dest atomically; runs in media_worker.py"""
+    Image, ImageOps = _pillow()
+    with Image.open(source) as im:
+        im = ImageOps.exif_transpose(im)
+        if im.width > width:
+            im = im.resize((width, max(1, round(im.height * width / im.width))), Image.LANCZOS)
+        transparent = 'A' in im.getbands() or 'transparency' in im.info
+        if fmt == 'jpeg' and im.mode != 'RGB':
+            # JPEG has no alpha: flatten onto white instead of black
+            rgba = im.convert('RGBA')
+            im = Image.new('RGB', im.size, (255, 255, 255))
+            im.paste(rgba, mask=rgba.getchannel('A'))
+        elif fmt == 'webp' and im.mode not in ('RGB', 'RGBA'):
+            im = im.convert('RGBA' if transparent else 'RGB')
+        tmp = f"{dest}.{os.getpid()}.tmp"
+        if fmt == 'webp':
+            im.save(tmp, 'WEBP', quality=QUALITY[fmt], method=4)
+        else:
+            im.save(tmp, 'JPEG', quality=QUALITY[fmt], optimize=True, progressive=True)
+    os.replace(tmp, dest)
+    return os.path.getsize(dest)
+
+
+def snap_width(requested: int) -> int:
+    for width in WIDTHS:
+        if width >= requested:
+            return width
+    return WIDTHS[-1]
+
+
+class MediaStore:
+    """Content-addressed originals plus an LRU disk cache of resized variants"""
+
+    def __init__(self, directory: str, cache_bytes: int = 512 * 1024 * 1024, workers: int = 2):
+        self.originals = os.path.join(directory, 'originals')
+        self.variants = os.path.join(directory, 'variants')
+        self.cache_bytes = cache_bytes
+        self.workers = workers
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.cached_bytes = 0
+        self._pool = None
+        self._local = threading.local()  # the worker process of each pool thread
+        self._procs = set()
+        self._lock = threading.Lock()
+        self._inflight = {}  # variant name -> Future
+        self._lru = OrderedDict()  # variant name -> size, least recently used first
+        os.makedirs(self.originals, exist_ok=True)
+        os.makedirs(self.variants, exist_ok=True)
+        self._load_cache()
+        atexit.register(self.close)
+
+    def _load_cache(self):
+        # Hits touch the file's mtime, so the order survives restarts
+        entries = []
+        for name in os.listdir(self.variants):
+            path = os.path.join(self.variants, name)
+            if name.endswith('.tmp'):
+                os.remove(path)  # a worker died mid-write
+                continue
+            st = os.stat(path)
+            entries.append((st.st_mtime, name, st.st_size))
+        for _, name, size in sorted(entries):
+            self._lru[name] = size
+            self.cached_bytes += size
+
+    def original_path(self, media_id: str) -> str:
+        return os.path.join(self.originals, media_id)
+
+    def save(self, data: bytes, conn: sqlite3.Connection) -> dict:
+        if len(data) > MAX_UPLOAD_BYTES:
+            raise ValueError(f"Rasm {MAX_UPLOAD_BYTES // (1024 * 1024)} MB dan katta")
+        fmt, width, height = probe(data)
+        media_id = hashlib.sha256(data).hexdigest()[:24]
+        path = self.original_path(media_id)
+        if not os.path.exists(path):
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        conn.execute("INSERT OR IGNORE INTO media VALUES (?, ?, ?, ?, ?, ?)",
+                     (media_id, fmt, width, height, len(data), datetime.now().isoformat()))
+        conn.commit()
+        return {'id': media_id, 'url': f"/media/{media_id}", 'width': width, 'height': height}
+
+    def _executor(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix='media')
+        return self._pool
+
+    def _resize(self, source: str, dest: str, width: int, fmt: str) -> int:
+        """Run one job on this pool thread's worker process, starting it if needed"""
+        proc = getattr(self._local, 'proc', None)
+        if proc is None or proc.poll() is not None:
+            proc = subprocess.Popen([sys.executable, WORKER_SCRIPT], stdin=subprocess.PIPE,
+                                    stdout=subprocess.PIPE, bufsize=0)
+            self._local.proc = proc
+            with self._lock:
+                self._procs.add(proc)
+        line = b''
+        try:
+            proc.stdin.write(json.dumps([source, dest, width, fmt]).encode() + b'\n')
+            if select.select([proc.stdout], [], [], VARIANT_TIMEOUT)[0]:
+                line = proc.stdout.readline()
+        except OSError:
+            pass
+        if not line:
+            # Hung or died: replace it rather than leave the thread waiting on it
+            self._stop_worker(proc)
+            self._local.proc = None
+            raise RuntimeError(f"media_worker javob bermadi ({dest})")
+        reply = json.loads(line)
+        if 'error' in reply:
+            raise RuntimeError(reply['error'])
+        return reply['size']
+
+    def _stop_worker(self, proc: subprocess.Popen):
+        with self._lock:
+            self._procs.discard(proc)
+        if proc.poll() is None:
+            proc.kill()
+        proc.wait()
+
+    def open_variant(self, media_id: str, width: int, fmt: str):
+        """(open file, was cached) for a variant, generating it in the pool on first request.
+
+        Raises FileNotFoundError for unknown ids. The file is opened under the
+        lock, so a concurrent eviction cannot remove it before it is served.
+        """
+        if not MEDIA_ID.fullmatch(media_id) or fmt not in FORMATS:
+            raise FileNotFoundError(media_id)
+        source = self.original_path(media_id)
+        if not os.path.exists(source):
+            raise FileNotFoundError(media_id)
+        name = f"{media_id}-{snap_width(width)}.{fmt}"
+        path = os.path.join(self.variants, name)
+        with self._lock:
+            if name in self._lru:
+                self._lru.move_to_end(name)
+                self.hits += 1
+                try:
+                    os.utime(path)
+                except OSError:
+                    pass
+                return open(path, 'rb'), True
+            future = self._inflight.get(name)
+            submitted = future is None
+            if submitted:
+                self.misses += 1
+                future = self._executor().submit(self._resize, source, path, snap_width(width), fmt)
+                self._inflight[name] = future
+        if submitted:
+            # Outside the lock: a future that is already done runs the callback right here
+            future.add_done_callback(lambda done: self._finished(name, done))
+        future.result(timeout=VARIANT_WAIT)
+        with self._lock:
+            return open(path, 'rb'), False
+
+    def _finished(self, name: str, future):
+        """Done callback: drop the inflight entry and count the variant, even if no request still waits for it"""
+        with self._lock:
+            if self._inflight.get(name) is future:
+                del self._inflight[name]
+            if future.cancelled() or future.exception() is not None or name in self._lru:
+                return
+            size = future.result()
+            self._lru[name] = size
+            self.cached_bytes += size
+            self._evict(keep=name)
+
+    def _evict(self, keep: str):
+        while self.cached_bytes > self.cache_bytes and len(self._lru) > 1:
+            name, size = next(iter(self._lru.items()))
+            if name == keep:
+                break
+            del self._lru[name]
+            self.cached_bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(os.path.join(self.variants, name))
+            except OSError:
+                pass
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        with self._lock:
+            procs, self._procs = self._procs, set()
+        for proc in procs:
+            proc.stdin.close()  # workers exit at end of input
+        for proc in procs:
+            try:
+                proc.wait(timeout=1)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Media ombori: rasm qo'shish va kesh holati")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_add = sub.add_parser('add', help="Rasmni omborga qo'shish")
+    p_add.add_argument('files', nargs='+')
+    p_add.add_argument('--dir', default=os.getenv('MEDIA_DIR', 'media'))
+    p_add.add_argument('--db', default=os.getenv('DB_PATH', 'ehson_test.db'))
+    p_stats = sub.add_parser('stats', help="Kesh hajmi")
+    p_stats.add_argument('--dir', default=os.getenv('MEDIA_DIR', 'media'))
+    args = parser.parse_args(argv)
+
+    store = MediaStore(args.dir)
+    if args.command == 'stats':
+        print(f"{len(os.listdir(store.originals))} asl rasm, {len(store._lru)} variant, "
+              f"{store.cached_bytes / 1e6:.1f} MB kesh")
+        return 0
+    conn = sqlite3.connect(args.db)
+    init_tables(conn)
+    status = 0
+    try:
+        for path in args.files:
+            with open(path, 'rb') as f:
+                try:
+                    info = store.save(f.read(), conn)
+                except ValueError as e:
+                    print(f"{path}: {e}")
+                    status = 1
+                    continue
+            print(f"{path}: {info['url']} ({info['width']}x{info['height']})")
+    finally:
+        conn.close()
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
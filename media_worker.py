@@ -0,0 +1,35 @@
+# media_worker.py - Resize worker process for media.MediaStore
+#
+# MediaStore starts a few of these with subprocess instead of forking the
+# bot: the bot process runs Flask, aiogram and logging threads, and a forked
+# child can inherit one of their locks held. A worker imports only media.py
+# and Pillow, reads one JSON job per line on stdin and answers each with one
+# JSON line on stdout. It exits when stdin is closed.
+#
+# Usage (normally started by MediaStore):
+#   echo '["media/originals/<id>", "/tmp/<id>-320.webp", 320, "webp"]' | python media_worker.py
+
+import sys
+import json
+
+import media
+
+
+def main():
+    try:
+        media._pillow()  # import Pillow once, before the first job
+    except RuntimeError:
+        pass  # every job will report it
+    for line in sys.stdin:
+        try:
+            source, dest, width, fmt = json.loads(line)
+            reply = {'size': media.make_variant(source, dest, width, fmt)}
+        except Exception as e:
+            reply = {'error': f"{type(e).__name__}: {e}"}
+        sys.stdout.write(json.dumps(reply) + '\n')
+        sys.stdout.flush()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
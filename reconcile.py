@@ -0,0 +1,191 @@
+# reconcile.py - Match Click settlement statements against the payments table
+#
+# Both sides are streamed in click_trans_id order and merge-joined, so memory
+# is bounded by --chunk-size regardless of how many rows the statement has.
+# An unsorted statement is first split into sorted runs on disk.
+#
+# Usage:
+#   python reconcile.py statement.csv --out reconcile_2024_01/
+#   python reconcile.py statement.csv --id-column "ID транзакции" --amount-column "Сумма"
+
+import os
+import csv
+import sys
+import heapq
+import sqlite3
+import argparse
+import tempfile
+from itertools import groupby
+from typing import Iterator, List, Tuple
+
+OUTPUTS = {
+    'matched': ['click_trans_id', 'amount', 'payment_id', 'status'],
+    'missing_locally': ['click_trans_id', 'amount'],
+    'missing_at_provider': ['click_trans_id', 'amount', 'payment_id', 'status'],
+    'amount_mismatch': ['click_trans_id', 'provider_amount', 'local_amount', 'payment_id'],
+    'duplicates': ['side', 'click_trans_id', 'count'],
+}
+
+Row = Tuple[str, float, str, str]  # (click_trans_id, amount, payment_id, status)
+
+
+def _parse_amount(value) -> float:
+    # Statements may use spaces as thousand separators and a comma as decimal mark
+    return float(str(value).replace('\xa0', '').replace(' ', '').replace(',', '.') or 0)
+
+
+def _read_statement(path: str, id_column: str, amount_column: str, delimiter: str) -> Iterator[Row]:
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        for record in csv.DictReader(f, delimiter=delimiter):
+            trans_id = (record.get(id_column) or '').strip()
+            if not trans_id:
+                continue
+            yield (trans_id, _parse_amount(record.get(amount_column)), '', '')
+
+
+def _write_run(rows: List[Row], tmp_dir: str) -> str:
+    rows.sort()
+    fd, path = tempfile.mkstemp(suffix='.csv', dir=tmp_dir)
+    with os.fdopen(fd, 'w', newline='', encoding='utf-8') as f:
+        csv.writer(f).writerows(rows)
+    return path
+
+
+def _read_run(path: str) -> Iterator[Row]:
+    with open(path, newline='', encoding='utf-8') as f:
+        for trans_id, amount, payment_id, status in csv.reader(f):
+            yield (trans_id, float(amount), payment_id, status)
+
+
+def sorted_statement(path: str, id_column: str, amount_column: str, delimiter: str,
+                     chunk_size: int, tmp_dir: str) -> Iterator[Row]:
+    """External merge sort of the statement by click_trans_id"""
+    runs = []
+    chunk: List[Row] = []
+    for row in _read_statement(path, id_column, amount_column, delimiter):
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            runs.append(_write_run(chunk, tmp_dir))
+            chunk = []
+    if not runs:
+        # Everything fit in one chunk; no need to touch the disk
+        chunk.sort()
+        return iter(chunk)
+    if chunk:
+        runs.append(_write_run(chunk, tmp_dir))
+    return heapq.merge(*(_read_run(p) for p in runs))
+
+
+def local_payments(db_path: str, all_statuses: bool, fetch_size: int = 5000) -> Iterator[Row]:
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        c = conn.cursor()
+        # ORDER BY click_trans_id is served by the click_trans_id index
+        sql = ("SELECT click_trans_id, amount, payment_id, status FROM payments "
+               "WHERE click_trans_id IS NOT NULL AND click_trans_id != ''")
+        if not all_statuses:
+            sql += " AND status = 'success'"
+        c.execute(sql + " ORDER BY click_trans_id")
+        while True:
+            rows = c.fetchmany(fetch_size)
+            if not rows:
+                break
+            for trans_id, amount, payment_id, status in rows:
+                yield (str(trans_id), float(amount or 0), payment_id, status)
+    finally:
+        conn.close()
+
+
+def _groups(rows: Iterator[Row]) -> Iterator[Tuple[str, List[Row]]]:
+    for key, group in groupby(rows, key=lambda r: r[0]):
+        yield key, list(group)
+
+
+def merge_join(provider: Iterator[Row], local: Iterator[Row], tolerance: float = 0.01):
+    """Yield (kind, row) pairs; kind is one of the OUTPUTS keys"""
+    provider_groups = _groups(provider)
+    local_groups = _groups(local)
+    p = next(provider_groups, None)
+    l = next(local_groups, None)
+
+    while p is not None or l is not None:
+        if l is None or (p is not None and p[0] < l[0]):
+            key, rows = p
+            if len(rows) > 1:
+                yield 'duplicates', ['provider', key, len(rows)]
+            for row in rows:
+                yield 'missing_locally', [key, row[1]]
+            p = next(provider_groups, None)
+        elif p is None or l[0] < p[0]:
+            key, rows = l
+            if len(rows) > 1:
+                yield 'duplicates', ['local', key, len(rows)]
+            for row in rows:
+                yield 'missing_at_provider', [key, row[1], row[2], row[3]]
+            l = next(local_groups, None)
+        else:
+            key, p_rows = p
+            _, l_rows = l
+            if len(p_rows) > 1:
+                yield 'duplicates', ['provider', key, len(p_rows)]
+            if len(l_rows) > 1:
+                yield 'duplicates', ['local', key, len(l_rows)]
+            # Duplicates are already reported above; compare one row from each side
+            provider_amount = p_rows[0][1]
+            local_row = l_rows[0]
+            if abs(provider_amount - local_row[1]) > tolerance:
+                yield 'amount_mismatch', [key, provider_amount, local_row[1], local_row[2]]
+            else:
+                yield 'matched', [key, local_row[1], local_row[2], local_row[3]]
+            p = next(provider_groups, None)
+            l = next(local_groups, None)
+
+
+def reconcile(statement_path: str, db_path: str, out_dir: str, id_column: str = 'click_trans_id',
+              amount_column: str = 'amount', delimiter: str = ',', chunk_size: int = 500000,
+              tolerance: float = 0.01, all_statuses: bool = False) -> dict:
+    os.makedirs(out_dir, exist_ok=True)
+    files = {kind: open(os.path.join(out_dir, f"{kind}.csv"), 'w', newline='', encoding='utf-8')
+             for kind in OUTPUTS}
+    counts = {kind: 0 for kind in OUTPUTS}
+    try:
+        writers = {kind: csv.writer(f) for kind, f in files.items()}
+        for kind, header in OUTPUTS.items():
+            writers[kind].writerow(header)
+        with tempfile.TemporaryDirectory(prefix='reconcile_') as tmp_dir:
+            provider = sorted_statement(statement_path, id_column, amount_column, delimiter, chunk_size, tmp_dir)
+            local = local_payments(db_path, all_statuses)
+            for kind, row in merge_join(provider, local, tolerance):
+                writers[kind].writerow(row)
+                counts[kind] += 1
+    finally:
+        for f in files.values():
+            f.close()
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Click hisobotini payments jadvali bilan solishtirish")
+    parser.add_argument('statement', help='Click settlement CSV fayli')
+    parser.add_argument('--db', default=os.getenv('DB_PATH', 'ehson_test.db'))
+    parser.add_argument('--out', default='reconcile_out', help='Natija CSV fayllari uchun papka')
+    parser.add_argument('--id-column', default='click_trans_id')
+    parser.add_argument('--amount-column', default='amount')
+    parser.add_argument('--delimiter', default=',')
+    parser.add_argument('--chunk-size', type=int, default=500000,
+                        help="Xotirada saralanadigan qatorlar soni (katta fayllar diskda bo'laklab saralanadi)")
+    parser.add_argument('--tolerance', type=float, default=0.01)
+    parser.add_argument('--all-statuses', action='store_true',
+                        help="Faqat 'success' emas, barcha lokal to'lovlarni solishtirish")
+    args = parser.parse_args(argv)
+
+    counts = reconcile(args.statement, args.db, args.out, args.id_column, args.amount_column,
+                       args.delimiter, args.chunk_size, args.tolerance, args.all_statuses)
+    for kind, count in counts.items():
+        print(f"{kind}: {count}")
+    problems = counts['missing_locally'] + counts['missing_at_provider'] + counts['amount_mismatch'] + counts['duplicates']
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
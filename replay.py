@@ -0,0 +1,191 @@
+# replay.py - Replay recorded updates through bot.py's Dispatcher
+#
+# Record real traffic by running the bot with UPDATE_RECORD_PATH=updates.jsonl.gz
+# (ids are anonymized by UpdateRecorder), then feed it back here against
+# fake_telegram.py to measure how many updates per second the dispatcher
+# sustains and where handler time goes.
+#
+# Usage:
+#   python replay.py updates.jsonl.gz                 # original pacing (1x)
+#   python replay.py updates.jsonl.gz --speed 10      # 10x faster
+#   python replay.py updates.jsonl.gz --speed max --concurrency 200 --api-latency-ms 50
+
+import os
+import sys
+import gzip
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+from collections import defaultdict
+
+from fake_telegram import FakeBotAPI
+
+# Histogram bucket upper bounds in milliseconds
+BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+
+def load_updates(path: str):
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                record = json.loads(line)
+                yield record.get('ts', 0.0), record['update']
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.values = []
+
+    def observe(self, ms: float):
+        for i, bound in enumerate(BUCKETS_MS):
+            if ms <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.values.append(ms)
+
+    def percentile(self, pct: float) -> float:
+        if not self.values:
+            return 0.0
+        ordered = sorted(self.values)
+        return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+    def render(self, indent: str = '    ') -> str:
+        lines = []
+        total = len(self.values) or 1
+        labels = [f"<={b}ms" for b in BUCKETS_MS] + [f">{BUCKETS_MS[-1]}ms"]
+        for label, count in zip(labels, self.counts):
+            if count:
+                lines.append(f"{indent}{label:>10} {count:>8} {'#' * max(1, int(40 * count / total))}")
+        return '\n'.join(lines)
+
+
+class HandlerTimer:
+    """Inner middleware: time spent in each handler callback"""
+
+    def __init__(self):
+        self.by_handler = defaultdict(Histogram)
+
+    async def __call__(self, handler, event, data):
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            handler_object = data.get('handler')
+            name = getattr(getattr(handler_object, 'callback', None), '__name__', 'unknown')
+            self.by_handler[name].observe((time.perf_counter() - started) * 1000)
+
+
+async def measure_loop_lag(histogram: Histogram, stop: asyncio.Event, interval: float = 0.01):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        histogram.observe(max(0.0, loop.time() - expected) * 1000)
+
+
+async def replay(args) -> int:
+    fake = FakeBotAPI(latency_ms=args.api_latency_ms, jitter_ms=args.api_jitter_ms,
+                      retry_after_rate=args.retry_after_rate)
+    runner = await fake.start(port=args.api_port)
+
+    # bot.py reads its configuration at import time
+    os.environ['TELEGRAM_API_URL'] = f"http://127.0.0.1:{args.api_port}"
+    os.environ['DB_PATH'] = args.db
+    import bot
+    from aiogram.types import Update
+
+    bot.bot_loop = asyncio.get_running_loop()
+    timer = HandlerTimer()
+    bot.dp.message.middleware(timer)
+    bot.dp.callback_query.middleware(timer)
+
+    records = list(load_updates(args.recording))
+    if args.limit:
+        records = records[:args.limit]
+    if not records:
+        print("Yozuvda update topilmadi")
+        return 1
+    updates = [Update.model_validate(u, context={'bot': bot.bot}) for _, u in records]
+    first_ts = records[0][0]
+
+    end_to_end = Histogram()
+    loop_lag = Histogram()
+    errors = 0
+    semaphore = asyncio.Semaphore(args.concurrency)
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(measure_loop_lag(loop_lag, stop))
+
+    async def feed(update):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await bot.dp.feed_update(bot.bot, update)
+            except Exception:
+                errors += 1
+            end_to_end.observe((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    tasks = []
+    for (ts, _), update in zip(records, updates):
+        if args.speed != 'max':
+            delay = (ts - first_ts) / float(args.speed) - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(feed(update)))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await lag_task
+
+    print(f"\n{len(updates)} ta update, {elapsed:.2f} s, {len(updates) / elapsed:.1f} update/s "
+          f"(tezlik: {args.speed}, xatolar: {errors})")
+    print(f"\nend-to-end: p50 {end_to_end.percentile(50):.1f} ms, p95 {end_to_end.percentile(95):.1f} ms, "
+          f"p99 {end_to_end.percentile(99):.1f} ms")
+    print(end_to_end.render())
+    for name, histogram in sorted(timer.by_handler.items()):
+        print(f"\n{name}: {len(histogram.values)} ta, p50 {histogram.percentile(50):.1f} ms, "
+              f"p95 {histogram.percentile(95):.1f} ms, p99 {histogram.percentile(99):.1f} ms")
+        print(histogram.render())
+    print(f"\nevent loop lag: p50 {loop_lag.percentile(50):.1f} ms, p99 {loop_lag.percentile(99):.1f} ms, "
+          f"max {max(loop_lag.values or [0]):.1f} ms")
+    print(f"Bot API chaqiruvlari: {dict(fake.calls)}, 429: {sum(fake.throttled.values())}")
+
+    await bot.bot.session.close()
+    await runner.cleanup()
+    return 1 if errors else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Yozib olingan update'larni Dispatcher orqali qayta ijro etish")
+    parser.add_argument('recording', help='UPDATE_RECORD_PATH bilan yozilgan .jsonl.gz fayl')
+    parser.add_argument('--speed', default='1', help="1, 10 (N marta tez) yoki max")
+    parser.add_argument('--concurrency', type=int, default=100, help="max rejimida bir vaqtdagi update'lar")
+    parser.add_argument('--limit', type=int, default=0)
+    parser.add_argument('--api-port', type=int, default=8081)
+    parser.add_argument('--api-latency-ms', type=float, default=0.0)
+    parser.add_argument('--api-jitter-ms', type=float, default=0.0)
+    parser.add_argument('--retry-after-rate', type=float, default=0.0)
+    parser.add_argument('--db', default=os.path.join(tempfile.gettempdir(), 'ehson_replay.db'),
+                        help="Ijro uchun alohida baza (production bazasiga yozmaslik uchun)")
+    args = parser.parse_args(argv)
+    if args.speed != 'max':
+        try:
+            speed = float(args.speed)
+        except ValueError:
+            speed = None
+        # "not > 0" also rejects nan
+        if speed is None or not speed > 0:
+            parser.error("--speed musbat son yoki 'max' bo'lishi kerak")
+    return asyncio.run(replay(args))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
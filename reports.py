@@ -0,0 +1,247 @@
+# reports.py - Streaming payment reports (CSV / XLSX) for accountants
+#
+# Rows are read with an index-backed range scan on payments.created_at and
+# written out as they arrive, so memory stays flat no matter how many
+# payments fall into the requested range.
+#
+# Usage:
+#   python reports.py --from 2024-01-01 --to 2024-01-31 -o january.csv
+#   python reports.py --from 2024-01-01 --to 2024-01-31 --format xlsx -o january.xlsx
+
+import os
+import csv
+import sys
+import time
+import queue
+import sqlite3
+import argparse
+import threading
+from datetime import date, timedelta
+from typing import Iterator, List, Optional
+
+REPORT_HEADER = ['row_type', 'date', 'payment_id', 'created_at', 'user_id',
+                 'campaign_id', 'status', 'amount', 'count']
+FETCH_SIZE = 1000
+CSV_CHUNK_ROWS = 500
+# A producer gives up when the client has not taken a chunk for this long
+STALL_SECONDS = 120
+
+_SENTINEL = object()
+
+
+def _range_bounds(date_from: str, date_to: str):
+    """Turn an inclusive YYYY-MM-DD range into half-open created_at bounds"""
+    start = date.fromisoformat(date_from)
+    end = date.fromisoformat(date_to) + timedelta(days=1)
+    if end <= start:
+        raise ValueError("'to' sanasi 'from' sanasidan oldin bo'lishi mumkin emas")
+    return start.isoformat(), end.isoformat()
+
+
+def iter_payments(db_path: str, date_from: str, date_to: str) -> Iterator[tuple]:
+    lower, upper = _range_bounds(date_from, date_to)
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        c = conn.cursor()
+        # Served by idx_payments_created_at; ORDER BY matches the index so
+        # SQLite walks it without a temp b-tree.
+        c.execute("SELECT payment_id, created_at, user_id, campaign_id, status, amount "
+                  "FROM payments WHERE created_at >= ? AND created_at < ? ORDER BY created_at",
+                  (lower, upper))
+        while True:
+            rows = c.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        conn.close()
+
+
+def iter_report_rows(db_path: str, date_from: str, date_to: str) -> Iterator[list]:
+    """Payment rows with per-day subtotals inline and per-campaign/per-status totals at the end"""
+    current_day = None
+    day_amount, day_count = 0.0, 0
+    by_campaign = {}
+    by_status = {}
+    total_amount, total_count = 0.0, 0
+
+    for payment_id, created_at, user_id, campaign_id, status, amount in iter_payments(db_path, date_from, date_to):
+        day = (created_at or '')[:10]
+        amount = amount or 0.0
+        if day != current_day:
+            if current_day is not None:
+                yield ['subtotal_day', current_day, '', '', '', '', '', round(day_amount, 2), day_count]
+            current_day, day_amount, day_count = day, 0.0, 0
+
+        yield ['payment', day, payment_id, created_at, user_id, campaign_id or '', status, amount, 1]
+
+        day_amount += amount
+        day_count += 1
+        # Bounded by the number of distinct campaigns/statuses, not by rows
+        key = campaign_id or ''
+        camp = by_campaign.setdefault(key, [0.0, 0])
+        camp[0] += amount
+        camp[1] += 1
+        stat = by_status.setdefault(status or '', [0.0, 0])
+        stat[0] += amount
+        stat[1] += 1
+        total_amount += amount
+        total_count += 1
+
+    if current_day is not None:
+        yield ['subtotal_day', current_day, '', '', '', '', '', round(day_amount, 2), day_count]
+    for campaign_id, (amount, count) in sorted(by_campaign.items()):
+        yield ['subtotal_campaign', '', '', '', '', campaign_id, '', round(amount, 2), count]
+    for status, (amount, count) in sorted(by_status.items()):
+        yield ['subtotal_status', '', '', '', '', '', status, round(amount, 2), count]
+    yield ['total', '', '', '', '', '', '', round(total_amount, 2), total_count]
+
+
+class _Buffer:
+    """Minimal file-like object that lets csv.writer write into a list"""
+
+    def __init__(self):
+        self.parts: List[str] = []
+
+    def write(self, data):
+        self.parts.append(data)
+
+    def drain(self) -> str:
+        data = ''.join(self.parts)
+        self.parts.clear()
+        return data
+
+
+def iter_csv_chunks(db_path: str, date_from: str, date_to: str,
+                    cancel: Optional[threading.Event] = None) -> Iterator[bytes]:
+    buf = _Buffer()
+    writer = csv.writer(buf)
+    writer.writerow(REPORT_HEADER)
+    pending = 1
+    for row in iter_report_rows(db_path, date_from, date_to):
+        if cancel is not None and cancel.is_set():
+            return
+        writer.writerow(row)
+        pending += 1
+        if pending >= CSV_CHUNK_ROWS:
+            yield buf.drain().encode('utf-8')
+            pending = 0
+    if pending:
+        yield buf.drain().encode('utf-8')
+
+
+class _ChunkStream:
+    """Iterator over queued chunks whose close() cancels the producer.
+
+    A plain generator would not do: closing one that never started does
+    not run its finally block, and WSGI servers close the response without
+    iterating it when the client disconnects early.
+    """
+
+    def __init__(self, chunks: queue.Queue, cancel: threading.Event):
+        self.chunks = chunks
+        self.cancel = cancel
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> bytes:
+        while True:
+            try:
+                item = self.chunks.get(timeout=1)
+                break
+            except queue.Empty:
+                # The producer gave up on a stalled client and will not send the sentinel
+                if self.cancel.is_set():
+                    raise StopIteration
+        if item is _SENTINEL:
+            self.close()
+            raise StopIteration
+        if isinstance(item, Exception):
+            self.close()
+            raise item
+        return item
+
+    def close(self):
+        self.cancel.set()
+
+
+def stream_csv_report(executor, db_path: str, date_from: str, date_to: str,
+                      max_chunks: int = 16, stall_seconds: float = STALL_SECONDS) -> Iterator[bytes]:
+    """Produce the CSV on `executor` and hand chunks over through a bounded queue.
+
+    The caller (a Flask response) only moves bytes; the scan and formatting
+    happen on the report pool. The queue bound gives backpressure when the
+    client reads slowly. Closing the returned stream cancels the job, and a
+    client that stops reading for `stall_seconds` cancels it too.
+    """
+    _range_bounds(date_from, date_to)
+    chunks = queue.Queue(maxsize=max_chunks)
+    cancel = threading.Event()
+
+    def put(item):
+        # Never block forever: if the client went away nobody drains the queue
+        deadline = time.monotonic() + stall_seconds
+        while not cancel.is_set():
+            try:
+                chunks.put(item, timeout=1)
+                return
+            except queue.Full:
+                if time.monotonic() >= deadline:
+                    cancel.set()
+
+    def produce():
+        try:
+            for chunk in iter_csv_chunks(db_path, date_from, date_to, cancel):
+                put(chunk)
+        except Exception as e:
+            put(e)
+        finally:
+            put(_SENTINEL)
+
+    executor.submit(produce)
+    return _ChunkStream(chunks, cancel)
+
+
+def write_xlsx_report(db_path: str, date_from: str, date_to: str, output_path: str) -> str:
+    try:
+        from openpyxl import Workbook
+    except ImportError:
+        raise RuntimeError("XLSX hisobot uchun openpyxl o'rnatilmagan (pip install openpyxl)")
+    # write_only workbooks stream rows to a temp file instead of keeping cells in memory
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('payments')
+    ws.append(REPORT_HEADER)
+    for row in iter_report_rows(db_path, date_from, date_to):
+        ws.append(row)
+    wb.save(output_path)
+    return output_path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="To'lovlar bo'yicha hisobot (CSV/XLSX)")
+    parser.add_argument('--from', dest='date_from', required=True, help='Boshlanish sanasi, YYYY-MM-DD')
+    parser.add_argument('--to', dest='date_to', required=True, help='Tugash sanasi (shu kun ham kiradi), YYYY-MM-DD')
+    parser.add_argument('--format', choices=['csv', 'xlsx'], default='csv')
+    parser.add_argument('--db', default=os.getenv('DB_PATH', 'ehson_test.db'))
+    parser.add_argument('-o', '--output', help="Chiqish fayli (CSV uchun standart: stdout)")
+    args = parser.parse_args(argv)
+
+    if args.format == 'xlsx':
+        if not args.output:
+            parser.error('XLSX uchun --output kerak')
+        write_xlsx_report(args.db, args.date_from, args.date_to, args.output)
+        return 0
+
+    out = open(args.output, 'wb') if args.output else sys.stdout.buffer
+    try:
+        for chunk in iter_csv_chunks(args.db, args.date_from, args.date_to):
+            out.write(chunk)
+    finally:
+        if args.output:
+            out.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,194 @@
+# rum.py - Real-user performance monitoring for the Telegram WebApp
+#
+# The webapp reports Navigation Timing, paint, long-task and CDN resource
+# timings plus its own measures around displayCampaigns/displayTeam. Each
+# sample lands in a fixed-bucket histogram keyed by (day, metric, device
+# class, app version). Bucket counts are kept in memory and flushed to the
+# rum_buckets table as deltas, the same way ad counters are; percentiles are
+# read back from the merged buckets.
+#
+# Usage:
+#   python rum.py --db ehson_test.db --days 7
+
+import os
+import sys
+import math
+import sqlite3
+import argparse
+import threading
+from bisect import bisect_left
+from datetime import datetime, timedelta
+
+# Upper bounds in milliseconds; the last bucket is open-ended
+# (rows store the bucket index, so existing bounds must not change)
+BUCKETS_MS = (10, 25, 50, 75, 100, 150, 200, 250, 300, 400, 500, 600, 750, 1000, 1250, 1500, 1750, 2000,
+              2500, 3000, 3500, 4000, 5000, 6000, 7500, 10000, 12500, 15000, 20000, 30000, 60000)
+
+# Only these names are accepted, so a client cannot create unbounded series
+METRICS = (
+    'ttfb', 'dom_content_loaded', 'load', 'first_paint', 'first_contentful_paint',
+    'long_task', 'long_tasks_total',
+    'res_tailwind', 'res_fontawesome', 'res_telegram', 'res_other',
+    'display_campaigns', 'display_team',
+)
+MAX_SAMPLES_PER_REPORT = 500
+# Reports from app versions outside the accepted list are filed under this one
+OTHER_VERSION = 'other'
+
+
+def _number(value):
+    """value if it is a finite number, else None (bool and strings do not count)"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value):
+        return value
+    return None
+
+
+def device_class(memory_gb, cores) -> str:
+    """Coarse class from navigator.deviceMemory / hardwareConcurrency (either may be missing)"""
+    memory_gb, cores = _number(memory_gb), _number(cores)
+    if not memory_gb and not cores:
+        return 'unknown'
+    if (memory_gb and memory_gb <= 2) or (cores and cores <= 4):
+        return 'low'
+    if (memory_gb or 0) >= 8 and (cores or 0) >= 8:
+        return 'high'
+    return 'mid'
+
+
+def bucket_index(ms: float) -> int:
+    return bisect_left(BUCKETS_MS, ms)
+
+
+def percentile(counts: list, pct: float) -> float:
+    """Interpolated percentile from bucket counts (len(BUCKETS_MS) + 1 entries)"""
+    total = sum(counts)
+    if not total:
+        return 0.0
+    rank = pct / 100.0 * total
+    seen = 0
+    for i, n in enumerate(counts):
+        if n and seen + n >= rank:
+            lower = BUCKETS_MS[i - 1] if i else 0
+            upper = BUCKETS_MS[i] if i < len(BUCKETS_MS) else BUCKETS_MS[-1] * 2
+            return lower + (upper - lower) * (rank - seen) / n
+        seen += n
+    return float(BUCKETS_MS[-1])
+
+
+def init_tables(conn: sqlite3.Connection):
+    conn.execute('''CREATE TABLE IF NOT EXISTS rum_buckets (
+                        day TEXT,
+                        metric TEXT,
+                        device_class TEXT,
+                        app_version TEXT,
+                        bucket INTEGER,
+                        count INTEGER,
+                        PRIMARY KEY (day, metric, device_class, app_version, bucket)
+                    )''')
+
+
+class RumAggregator:
+    def __init__(self, versions=()):
+        # Client-supplied versions are only kept when listed here, so the
+        # number of series stays bounded
+        self.versions = frozenset(versions)
+        self._lock = threading.Lock()
+        self._pending = {}  # (day, metric, device_class, app_version, bucket) -> count
+        self.samples = 0
+
+    def record(self, report: dict) -> int:
+        """Add one beacon's samples; returns how many were accepted"""
+        if not isinstance(report, dict):
+            raise ValueError('expected a JSON object')
+        device = device_class(report.get('dm'), report.get('hc'))
+        version = report.get('v')
+        if not isinstance(version, str) or version not in self.versions:
+            version = OTHER_VERSION
+        day = datetime.now().date().isoformat()
+        measures = report.get('m')
+        if not isinstance(measures, dict):
+            raise ValueError('expected {"m": {metric: [ms, ...]}}')
+        keys = []
+        for metric, values in measures.items():
+            if metric not in METRICS:
+                continue
+            for value in values if isinstance(values, list) else [values]:
+                if _number(value) is not None and 0 <= value < 3600 * 1000:
+                    keys.append((day, metric, device, version, bucket_index(value)))
+                if len(keys) >= MAX_SAMPLES_PER_REPORT:
+                    break
+        with self._lock:
+            for key in keys:
+                self._pending[key] = self._pending.get(key, 0) + 1
+            self.samples += len(keys)
+        return len(keys)
+
+    def flush(self, conn: sqlite3.Connection):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        try:
+            conn.executemany("""INSERT INTO rum_buckets VALUES (?, ?, ?, ?, ?, ?)
+                                ON CONFLICT (day, metric, device_class, app_version, bucket)
+                                DO UPDATE SET count = count + excluded.count""",
+                             [key + (count,) for key, count in pending.items()])
+            conn.commit()
+        except sqlite3.Error:
+            with self._lock:
+                for key, count in pending.items():
+                    self._pending[key] = self._pending.get(key, 0) + count
+            raise
+
+    def summary(self, conn: sqlite3.Connection, days: int = 7, version: str = None) -> list:
+        """p50/p75/p95 per metric x device class x app version over the last `days` days"""
+        since = (datetime.now().date() - timedelta(days=days - 1)).isoformat()
+        query = "SELECT metric, device_class, app_version, bucket, SUM(count) FROM rum_buckets WHERE day >= ?"
+        params = [since]
+        if version:
+            query += " AND app_version = ?"
+            params.append(version)
+        rows = conn.execute(query + " GROUP BY metric, device_class, app_version, bucket", params).fetchall()
+        histograms = {}
+        for metric, device, app_version, bucket, count in rows:
+            counts = histograms.setdefault((metric, device, app_version), [0] * (len(BUCKETS_MS) + 1))
+            counts[min(bucket, len(BUCKETS_MS))] += count
+        # Samples not flushed yet
+        with self._lock:
+            for (day, metric, device, app_version, bucket), count in self._pending.items():
+                if day >= since and (not version or app_version == version):
+                    counts = histograms.setdefault((metric, device, app_version), [0] * (len(BUCKETS_MS) + 1))
+                    counts[bucket] += count
+        order = {name: i for i, name in enumerate(METRICS)}
+        return [{
+            'metric': metric, 'device_class': device, 'app_version': app_version, 'count': sum(counts),
+            'p50': round(percentile(counts, 50)), 'p75': round(percentile(counts, 75)),
+            'p95': round(percentile(counts, 95)), 'buckets': counts,
+        } for (metric, device, app_version), counts in
+            sorted(histograms.items(), key=lambda item: (order.get(item[0][0], 99), item[0][1], item[0][2]))]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="WebApp RUM foizliklari")
+    parser.add_argument('--db', default=os.getenv('DB_PATH', 'ehson_test.db'))
+    parser.add_argument('--days', type=int, default=7)
+    parser.add_argument('--version')
+    args = parser.parse_args(argv)
+    if not os.path.exists(args.db):
+        parser.error(f"{args.db} topilmadi (--db)")
+    conn = sqlite3.connect(f"file:{args.db}?mode=ro", uri=True)
+    try:
+        rows = RumAggregator().summary(conn, args.days, args.version)
+    except sqlite3.OperationalError:
+        rows = []  # no rum_buckets table yet: nothing reported
+    finally:
+        conn.close()
+    print(f"{'metric':<26}{'device':<9}{'version':<12}{'n':>8}{'p50':>8}{'p75':>8}{'p95':>8}  (ms)")
+    for row in rows:
+        print(f"{row['metric']:<26}{row['device_class']:<9}{row['app_version']:<12}{row['count']:>8}"
+              f"{row['p50']:>8}{row['p75']:>8}{row['p95']:>8}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
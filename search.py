@@ -0,0 +1,176 @@
+# search.py - In-memory campaign title search for inline mode
+#
+# Inline queries arrive at keystroke rate, so they are answered from memory:
+# a sorted token list gives prefix matches ("anv" -> "anvar") and a trigram
+# index over the same tokens catches typos and infixes. The index is updated
+# one campaign at a time on admin edits; ranked results per query are cached
+# until the next update.
+#
+# Usage:
+#   python search.py --db ehson_test.db anvar oper
+
+import os
+import re
+import sys
+import bisect
+import sqlite3
+import argparse
+from collections import Counter, OrderedDict, defaultdict
+
+# Uzbek o' / g' are typed with any of these
+_APOSTROPHES = str.maketrans({'ʻ': "'", 'ʼ': "'", '‘': "'", '’': "'", '`': "'"})
+_WORD = re.compile(r"[\w']+")
+# Share of a query word's trigrams a token must contain to count as a fuzzy match
+MIN_TRIGRAM_OVERLAP = 0.6
+MAX_RESULTS = 200
+CACHE_SIZE = 1024
+
+
+def normalize(text: str) -> str:
+    return (text or '').casefold().translate(_APOSTROPHES)
+
+
+def tokenize(text: str) -> list:
+    return [word for word in (w.strip("'") for w in _WORD.findall(normalize(text))) if word]
+
+
+def trigrams(word: str) -> set:
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class CampaignIndex:
+    """Prefix and trigram index over campaign titles with a per-query result cache"""
+
+    def __init__(self, campaigns=()):
+        self.campaigns = {}  # id -> campaign dict
+        self.version = 0
+        self._tokens = {}  # id -> tokens of its title
+        self._postings = defaultdict(set)  # token -> ids
+        self._sorted = []  # distinct tokens, sorted for prefix ranges
+        self._grams = defaultdict(set)  # trigram -> tokens
+        self._cache = OrderedDict()  # normalized query -> ranked ids
+        for campaign in campaigns:
+            self.upsert(campaign)
+
+    def __len__(self):
+        return len(self.campaigns)
+
+    def upsert(self, campaign: dict):
+        campaign_id = str(campaign['id'])
+        self._unindex(campaign_id)
+        self.campaigns[campaign_id] = campaign
+        tokens = set(tokenize(campaign.get('title')))
+        self._tokens[campaign_id] = tokens
+        for token in tokens:
+            postings = self._postings[token]
+            if not postings:
+                bisect.insort(self._sorted, token)
+                for gram in trigrams(token):
+                    self._grams[gram].add(token)
+            postings.add(campaign_id)
+        self._changed()
+
+    def remove(self, campaign_id):
+        campaign_id = str(campaign_id)
+        self._unindex(campaign_id)
+        self.campaigns.pop(campaign_id, None)
+        self._changed()
+
+    def _unindex(self, campaign_id: str):
+        for token in self._tokens.pop(campaign_id, ()):
+            postings = self._postings[token]
+            postings.discard(campaign_id)
+            if postings:
+                continue
+            del self._postings[token]
+            del self._sorted[bisect.bisect_left(self._sorted, token)]
+            for gram in trigrams(token):
+                tokens = self._grams[gram]
+                tokens.discard(token)
+                if not tokens:
+                    del self._grams[gram]
+
+    def _changed(self):
+        self.version += 1
+        self._cache.clear()
+
+    def _word_scores(self, word: str) -> dict:
+        """id -> best score of any title token against one query word"""
+        scores = {}
+
+        def add(token, score):
+            for campaign_id in self._postings[token]:
+                if scores.get(campaign_id, 0) < score:
+                    scores[campaign_id] = score
+
+        i = bisect.bisect_left(self._sorted, word)
+        while i < len(self._sorted) and self._sorted[i].startswith(word):
+            add(self._sorted[i], 1.0 if self._sorted[i] == word else 0.8)
+            i += 1
+        if len(word) >= 3:
+            grams = trigrams(word)
+            counts = Counter(token for gram in grams for token in self._grams.get(gram, ()))
+            for token, hits in counts.items():
+                overlap = hits / len(grams)
+                if overlap >= MIN_TRIGRAM_OVERLAP:
+                    add(token, 0.6 * overlap)
+        return scores
+
+    def _rank(self, query: str) -> list:
+        words = tokenize(query)
+        if not words:
+            # Empty query: urgent campaigns first, then the newest
+            ranked = sorted(self.campaigns.values(), key=lambda c: c.get('createdAt') or '', reverse=True)
+            ranked.sort(key=lambda c: not c.get('urgent'))
+            return [str(c['id']) for c in ranked[:MAX_RESULTS]]
+        total = None
+        for word in words:
+            scores = self._word_scores(word)
+            if total is None:
+                total = scores
+            else:
+                # Every word has to match some title token
+                total = {cid: total[cid] + score for cid, score in scores.items() if cid in total}
+            if not total:
+                return []
+        ranked = sorted(total, key=lambda cid: (-total[cid], not self.campaigns[cid].get('urgent'),
+                                                normalize(self.campaigns[cid].get('title'))))
+        return ranked[:MAX_RESULTS]
+
+    def search(self, query: str, offset: int = 0, limit: int = 20):
+        """(campaigns, next offset or None) for one page of a query"""
+        key = ' '.join(tokenize(query))
+        ranked = self._cache.get(key)
+        if ranked is None:
+            ranked = self._rank(key)
+            self._cache[key] = ranked
+            if len(self._cache) > CACHE_SIZE:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(key)
+        page = [self.campaigns[cid] for cid in ranked[offset:offset + limit]]
+        next_offset = offset + limit if offset + limit < len(ranked) else None
+        return page, next_offset
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="E'lonlarni nomi bo'yicha qidirish (inline rejim indeksi)")
+    parser.add_argument('query', nargs='*')
+    parser.add_argument('--db', default=os.getenv('DB_PATH', 'ehson_test.db'))
+    parser.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args(argv)
+    if not os.path.exists(args.db):
+        parser.error(f"{args.db} topilmadi (--db)")
+    conn = sqlite3.connect(f"file:{args.db}?mode=ro", uri=True)
+    rows = conn.execute("SELECT id, title, urgent, createdAt FROM campaigns").fetchall()
+    conn.close()
+    index = CampaignIndex({'id': r[0], 'title': r[1], 'urgent': bool(r[2]), 'createdAt': r[3]} for r in rows)
+    results, _ = index.search(' '.join(args.query), limit=args.limit)
+    for campaign in results:
+        print(f"{campaign['id']:<24}{campaign['title']}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,219 @@
+# seed_data.py - Deterministic synthetic dataset generator for scale testing
+#
+# Bulk-loads realistic volumes into a copy of the bot's schema: users,
+# campaigns across all webapp categories and payments whose donors and
+# campaigns follow a power-law (a few heavy donors / popular campaigns, a
+# long tail of one-off ones). The same --seed always produces the same data.
+#
+# Loading is fast: secondary indexes are only created after the load,
+# rows go in through executemany in large batches, and journaling/sync are
+# switched off for the duration (the target is a scratch file).
+#
+# Usage:
+#   python seed_data.py --out scale.db                                  # 100k users, 5M payments, 20k campaigns
+#   python seed_data.py --out small.db --users 1000 --payments 20000 --campaigns 200
+#   DB_PATH=scale.db python bot.py                                      # run the bot on it
+
+import os
+import sys
+import time
+import random
+import bisect
+import sqlite3
+import argparse
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+CATEGORIES = ['tibbiyot', 'nogironlik', 'talim', 'uy-joy', 'hayvonlar', 'ijtimoiy', 'ayollar', 'yetimlar']
+CATEGORY_ICONS = {'tibbiyot': '🏥', 'nogironlik': '♿', 'talim': '📚', 'uy-joy': '🏠',
+                  'hayvonlar': '🐾', 'ijtimoiy': '🤝', 'ayollar': '👩', 'yetimlar': '👶'}
+NAMES = ['Anvar', 'Dilnoza', 'Jasur', 'Malika', 'Bekzod', 'Nigora', 'Sardor', 'Zarina', 'Otabek', 'Gulnora',
+         'Rustam', 'Shahlo', 'Javohir', 'Madina', 'Aziz', 'Kamola', 'Farrux', 'Sevara', 'Ulug\'bek', 'Feruza']
+PURPOSES = {
+    'tibbiyot': ['operatsiyasi', 'davolanishi', 'dori-darmoni', 'reabilitatsiyasi'],
+    'nogironlik': ['nogironlar aravachasi', 'protezi', 'eshitish apparati'],
+    'talim': ["o'qish to'lovi", 'kompyuteri', 'darsliklari', 'kontrakti'],
+    'uy-joy': ['uyini tiklash', 'tom yopish', 'isitish tizimi'],
+    'hayvonlar': ['boshpana uchun ozuqa', 'veterinar xizmati'],
+    'ijtimoiy': ["oziq-ovqat to'plami", 'qishki kiyim', "kommunal to'lovlar"],
+    'ayollar': ['tadbirkorlik kursi', 'tikuv mashinasi'],
+    'yetimlar': ['maktab anjomlari', 'bayram sovg\'alari', 'sport to\'garagi'],
+}
+AMOUNTS = [5000, 10000, 10000, 20000, 25000, 50000, 50000, 100000, 200000, 500000, 1000000]
+STATUSES = ['success'] * 90 + ['failed'] * 6 + ['cancelled'] * 2 + ['pending'] * 2
+# Copied from the template as-is. Everything else (change log, channel posts,
+# Telegram file ids, ad/event/RUM counters) is state derived from the
+# template's own history and stays empty, so a bot run on the output does
+# not act on the template's channel messages.
+COPIED_TABLES = ('ads', 'team', 'settings')
+
+
+def power_law_cum_weights(n: int, exponent: float):
+    """Cumulative Zipf weights for ranks 1..n, for bisect-based sampling"""
+    return list(accumulate(1.0 / (rank ** exponent) for rank in range(1, n + 1)))
+
+
+def sample(rnd: random.Random, cum_weights) -> int:
+    return bisect.bisect(cum_weights, rnd.random() * cum_weights[-1])
+
+
+def batched(rows, size: int):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def copy_schema(template: str, target: str):
+    """Create the target with the template's tables (empty) and return its index DDL"""
+    src = sqlite3.connect(f"file:{template}?mode=ro", uri=True)
+    ddl = src.execute("SELECT type, name, sql FROM sqlite_master WHERE sql IS NOT NULL "
+                      "AND name NOT LIKE 'sqlite_%' ORDER BY type DESC").fetchall()
+    src.close()
+    dst = sqlite3.connect(target)
+    for kind, name, sql in ddl:
+        if kind == 'table':
+            dst.execute(sql)
+    dst.commit()
+    dst.close()
+    return [(name, sql) for kind, name, sql in ddl if kind == 'index']
+
+
+def generate(conn, args, rnd: random.Random):
+    c = conn.cursor()
+    start_date = datetime.fromisoformat(args.start_date)
+    span_seconds = args.days * 86400
+    user_ids = [str(1000000000 + i) for i in range(args.users)]
+
+    t = time.perf_counter()
+    for batch in batched(((uid, f"user{uid[-6:]}", rnd.choice(NAMES),
+                           (start_date + timedelta(seconds=rnd.randrange(span_seconds))).isoformat())
+                          for uid in user_ids), args.batch_size):
+        c.executemany("INSERT INTO users (user_id, username, first_name, created_at) VALUES (?, ?, ?, ?)", batch)
+    print(f"users: {args.users} ({time.perf_counter() - t:.1f} s)")
+
+    # Payments: donor and campaign both drawn from power laws. Shuffling the
+    # rank->entity mapping keeps heavy donors spread over the id space.
+    donor_weights = power_law_cum_weights(args.users, args.donor_exponent)
+    donor_order = list(range(args.users))
+    rnd.shuffle(donor_order)
+    campaign_weights = power_law_cum_weights(args.campaigns, args.campaign_exponent)
+    campaign_order = list(range(args.campaigns))
+    rnd.shuffle(campaign_order)
+    raised = [0.0] * args.campaigns
+    donors = [0] * args.campaigns
+
+    def payment_rows():
+        for i in range(args.payments):
+            user = user_ids[donor_order[sample(rnd, donor_weights)]]
+            campaign = campaign_order[sample(rnd, campaign_weights)]
+            amount = float(rnd.choice(AMOUNTS))
+            status = rnd.choice(STATUSES)
+            if status == 'success':
+                raised[campaign] += amount
+                donors[campaign] += 1
+            created = (start_date + timedelta(seconds=rnd.randrange(span_seconds))).isoformat()
+            click_id = f"{i + 1:012d}" if status != 'pending' else None
+            yield (f"seed-{i:09d}", user, amount if status != 'pending' else None, status, click_id, created,
+                   f"campaign_{campaign}")
+
+    t = time.perf_counter()
+    loaded = 0
+    for batch in batched(payment_rows(), args.batch_size):
+        c.executemany("INSERT INTO payments (payment_id, user_id, amount, status, click_trans_id, created_at, campaign_id) "
+                      "VALUES (?, ?, ?, ?, ?, ?, ?)", batch)
+        loaded += len(batch)
+        if loaded % (args.batch_size * 20) == 0:
+            print(f"  payments: {loaded}/{args.payments} ({loaded / (time.perf_counter() - t):.0f} qator/s)")
+    print(f"payments: {args.payments} ({time.perf_counter() - t:.1f} s)")
+
+    t = time.perf_counter()
+
+    def campaign_rows():
+        for i in range(args.campaigns):
+            category = CATEGORIES[i % len(CATEGORIES)] if i < len(CATEGORIES) else rnd.choice(CATEGORIES)
+            name = rnd.choice(NAMES)
+            title = f"{name}ning {rnd.choice(PURPOSES[category])}"
+            target = float(max(raised[i] * rnd.uniform(1.0, 3.0), rnd.choice([5, 10, 20, 50, 100]) * 1e6))
+            yield (f"campaign_{i}", title, category, f"{title} uchun yordam so'raladi.", target, raised[i],
+                   donors[i], rnd.randint(0, 90), 1 if rnd.random() < 0.15 else 0,
+                   f"8600 {rnd.randrange(10000):04d} {rnd.randrange(10000):04d} {rnd.randrange(10000):04d}",
+                   name.upper(), f"+99890{rnd.randrange(10000000):07d}", name, CATEGORY_ICONS[category], 'Admin',
+                   (start_date + timedelta(seconds=rnd.randrange(span_seconds))).isoformat())
+
+    for batch in batched(campaign_rows(), args.batch_size):
+        c.executemany("INSERT INTO campaigns VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", batch)
+    print(f"campaigns: {args.campaigns} ({time.perf_counter() - t:.1f} s)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Masshtab testlari uchun sintetik ma'lumotlar generatori")
+    parser.add_argument('--out', required=True, help='Yaratiladigan baza fayli')
+    parser.add_argument('--template', default=os.getenv('DB_PATH', 'ehson_test.db'),
+                        help="Sxema olinadigan baza (bot.py yaratgan)")
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--payments', type=int, default=5000000)
+    parser.add_argument('--campaigns', type=int, default=20000)
+    parser.add_argument('--days', type=int, default=365, help="created_at taqsimoti oralig'i")
+    parser.add_argument('--start-date', default='2024-01-01')
+    parser.add_argument('--donor-exponent', type=float, default=1.1)
+    parser.add_argument('--campaign-exponent', type=float, default=1.2)
+    parser.add_argument('--batch-size', type=int, default=50000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--force', action='store_true', help='Mavjud --out faylini almashtirish')
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.template):
+        parser.error(f"{args.template} topilmadi; avval bot.py ni bir marta ishga tushiring yoki --template bering")
+    if os.path.exists(args.out):
+        if not args.force:
+            parser.error(f"{args.out} allaqachon mavjud (--force)")
+        os.remove(args.out)
+    if args.users < 1 or args.campaigns < 1:
+        parser.error("--users va --campaigns kamida 1 bo'lishi kerak")
+
+    started = time.perf_counter()
+    indexes = copy_schema(args.template, args.out)
+    src = sqlite3.connect(f"file:{args.template}?mode=ro", uri=True)
+    conn = sqlite3.connect(args.out)
+    tables = {row[0] for row in src.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    for table in COPIED_TABLES:
+        if table not in tables:
+            continue
+        rows = src.execute(f"SELECT * FROM {table}").fetchall()
+        if rows:
+            conn.executemany(f"INSERT INTO {table} VALUES ({', '.join('?' * len(rows[0]))})", rows)
+    src.close()
+    conn.commit()
+
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("PRAGMA locking_mode = EXCLUSIVE")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA cache_size = -262144")  # 256 MB
+
+    conn.execute("BEGIN")
+    generate(conn, args, random.Random(args.seed))
+    conn.commit()
+
+    t = time.perf_counter()
+    for name, sql in indexes:
+        conn.execute(sql)
+    conn.commit()
+    print(f"indekslar: {len(indexes)} ({time.perf_counter() - t:.1f} s)")
+
+    conn.execute("ANALYZE")
+    conn.execute("PRAGMA locking_mode = NORMAL")
+    conn.execute("PRAGMA journal_mode = DELETE")
+    conn.commit()
+    conn.close()
+    print(f"Tayyor: {args.out} ({os.path.getsize(args.out) / 1e6:.0f} MB, {time.perf_counter() - started:.1f} s)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,280 @@
+# tracing.py - Minimal payment tracing with OpenTelemetry-shaped JSONL spans
+#
+# A trace id is minted when payment_form opens a payment and stored with the
+# row as a W3C traceparent ("00-<trace id>-<span id>-01"). Every later stage
+# (Click prepare/complete, DB writes, the hop onto the bot loop, the Telegram
+# send) opens a span under it. Finished spans are queued and appended to a
+# local JSONL file by a writer thread, one span per line, using the field
+# names of the OTLP JSON encoding so the file can be fed to a collector.
+# The file rotates by size like the logs: <path>.1.gz is the newest backup.
+#
+# Usage:
+#   python tracing.py payment_traces.jsonl <payment_id|trace_id> [--db ehson_test.db]
+
+import os
+import sys
+import glob
+import gzip
+import json
+import time
+import shutil
+import queue
+import atexit
+import sqlite3
+import argparse
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Optional
+
+SERVICE_NAME = 'ehson-bot'
+
+# Innermost open Span in this thread / task
+current_span = contextvars.ContextVar('current_span', default=None)
+
+
+def new_trace_id() -> str:
+    return os.urandom(16).hex()
+
+
+def new_span_id() -> str:
+    return os.urandom(8).hex()
+
+
+def format_traceparent(trace_id: str, span_id: str) -> str:
+    return f"00-{trace_id}-{span_id}-01"
+
+
+def parse_traceparent(value: Optional[str]):
+    """'00-<trace>-<span>-01' -> (trace_id, span_id); None if missing or malformed"""
+    if not value:
+        return None
+    parts = value.split('-')
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    return parts[1], parts[2]
+
+
+class Span:
+    __slots__ = ('tracer', 'name', 'trace_id', 'span_id', 'parent_id', 'start_ns', 'end_ns', 'attributes',
+                 'status', 'message')
+
+    def __init__(self, tracer, name: str, trace_id: str, parent_id: Optional[str], attributes: dict,
+                 start_ns: Optional[int] = None):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = new_span_id()
+        self.parent_id = parent_id
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes
+        self.status = 'STATUS_CODE_UNSET'
+        self.message = ''
+
+    @property
+    def context(self):
+        return self.trace_id, self.span_id
+
+    @property
+    def traceparent(self) -> str:
+        return format_traceparent(self.trace_id, self.span_id)
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def error(self, message: str):
+        self.status = 'STATUS_CODE_ERROR'
+        self.message = message
+
+    def end(self, end_ns: Optional[int] = None):
+        if self.end_ns is None:
+            self.end_ns = end_ns or time.time_ns()
+            self.tracer.export(self)
+
+    def to_json(self) -> dict:
+        span = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'parentSpanId': self.parent_id or '',
+            'name': self.name,
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns),
+            'attributes': [{'key': k, 'value': {'stringValue': str(v)}} for k, v in self.attributes.items()],
+            'status': {'code': self.status},
+            'resource': {'service.name': SERVICE_NAME},
+        }
+        if self.message:
+            span['status']['message'] = self.message
+        return span
+
+
+class Tracer:
+    """Creates spans and appends finished ones to a JSONL file off-thread; path '' disables export"""
+
+    def __init__(self, path: str, max_queue: int = 10000, max_bytes: int = 0, backup_count: int = 7):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.dropped = 0
+        self.queue = queue.Queue(max_queue)
+        self.writer = None
+        if path:
+            self.writer = threading.Thread(target=self._write_loop, name='trace-writer', daemon=True)
+            self.writer.start()
+            atexit.register(self.close)
+
+    def start(self, name: str, parent=None, start_ns: Optional[int] = None, **attributes) -> Span:
+        """Open a span under parent (a (trace_id, span_id) pair or traceparent string), else the current span"""
+        if isinstance(parent, str):
+            parent = parse_traceparent(parent)
+        if parent is None:
+            parent = current_span.get()
+        if isinstance(parent, Span):
+            parent = parent.context
+        trace_id, parent_id = parent if parent else (new_trace_id(), None)
+        return Span(self, name, trace_id, parent_id, attributes, start_ns)
+
+    @contextmanager
+    def span(self, name: str, parent=None, **attributes):
+        span = self.start(name, parent, **attributes)
+        token = current_span.set(span)
+        try:
+            yield span
+        except Exception as e:
+            span.error(f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            current_span.reset(token)
+            span.end()
+
+    def adopt(self, traceparent: Optional[str]):
+        """Move the innermost open span into the trace of traceparent.
+
+        For spans that learn their trace only after they started, e.g. a Click
+        callback whose payment row is read by the handler. Spans started under
+        it from then on follow; a span that already has a parent is left alone.
+        """
+        span = current_span.get()
+        parent = parse_traceparent(traceparent)
+        if span is not None and parent is not None and span.parent_id is None:
+            span.trace_id, span.parent_id = parent
+
+    def export(self, span: Span):
+        if self.writer is None:
+            return
+        try:
+            self.queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _rotate(self):
+        for i in range(self.backup_count - 1, 0, -1):
+            source = f"{self.path}.{i}.gz"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{i + 1}.gz")
+        if self.backup_count > 0:
+            with open(self.path, 'rb') as src, gzip.open(f"{self.path}.1.gz", 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+        os.remove(self.path)
+
+    def _write_loop(self):
+        f = open(self.path, 'a', encoding='utf-8')
+        try:
+            while True:
+                span = self.queue.get()
+                if span is None:
+                    break
+                f.write(json.dumps(span.to_json(), ensure_ascii=False) + '\n')
+                if self.queue.empty():
+                    f.flush()
+                if self.max_bytes and f.tell() >= self.max_bytes:
+                    f.close()
+                    self._rotate()
+                    f = open(self.path, 'a', encoding='utf-8')
+        finally:
+            f.close()
+
+    def close(self):
+        if self.writer is not None and self.writer.is_alive():
+            self.queue.put(None)
+            self.writer.join(timeout=5)
+
+
+def load_trace(path: str, trace_id: str) -> list:
+    """Spans of one trace from the current file and its rotated backups"""
+    spans = []
+    needle = f'"traceId": "{trace_id}"'
+    for name in sorted(glob.glob(glob.escape(path) + '.*.gz')) + [path]:
+        if not os.path.exists(name):
+            continue
+        opener = gzip.open if name.endswith('.gz') else open
+        with opener(name, 'rt', encoding='utf-8') as f:
+            for line in f:
+                if needle in line:
+                    spans.append(json.loads(line))
+    return spans
+
+
+def render_timeline(spans: list) -> str:
+    """Spans as an indented timeline: offset from trace start, duration, name, status"""
+    if not spans:
+        return ''
+    spans = sorted(spans, key=lambda s: int(s['startTimeUnixNano']))
+    trace_start = int(spans[0]['startTimeUnixNano'])
+    by_id = {s['spanId']: s for s in spans}
+
+    def depth(span):
+        level = 0
+        while span['parentSpanId'] in by_id and level < 20:
+            span = by_id[span['parentSpanId']]
+            level += 1
+        return level
+
+    lines = []
+    for span in spans:
+        start = int(span['startTimeUnixNano'])
+        duration_ms = (int(span['endTimeUnixNano']) - start) / 1e6
+        offset = (start - trace_start) / 1e9
+        offset_text = f"+{offset:.3f}s" if offset < 60 else f"+{offset / 60:.1f}m"
+        status = span['status']
+        mark = '❌' if status['code'] == 'STATUS_CODE_ERROR' else '•'
+        attributes = ', '.join(f"{a['key']}={a['value']['stringValue']}" for a in span['attributes'])
+        line = f"{offset_text:>9} {'  ' * depth(span)}{mark} {span['name']} {duration_ms:.1f} ms"
+        if attributes:
+            line += f" ({attributes})"
+        if status.get('message'):
+            line += f" - {status['message']}"
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="To'lov trace'ini vaqt chizig'i sifatida ko'rsatish")
+    parser.add_argument('trace_file')
+    parser.add_argument('id', help='payment_id yoki trace id')
+    parser.add_argument('--db', default=os.getenv('DB_PATH', 'ehson_test.db'))
+    args = parser.parse_args(argv)
+
+    trace_id = args.id
+    if len(trace_id) != 32:
+        if not os.path.exists(args.db):
+            parser.error(f"{args.db} topilmadi (--db)")
+        conn = sqlite3.connect(f"file:{args.db}?mode=ro", uri=True)
+        row = conn.execute("SELECT traceparent FROM payments WHERE payment_id = ?", (args.id,)).fetchone()
+        conn.close()
+        parsed = parse_traceparent(row[0] if row else None)
+        if not parsed:
+            print(f"{args.id} uchun trace topilmadi")
+            return 1
+        trace_id = parsed[0]
+    spans = load_trace(args.trace_file, trace_id)
+    if not spans:
+        print(f"{trace_id}: span'lar topilmadi")
+        return 1
+    print(f"trace {trace_id}\n{render_timeline(spans)}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())